@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2013 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
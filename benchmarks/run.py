@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2013 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+"""Run uconf benchmarks against a synthetic repository.
+
+Usage:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --files 500 --depth 5 --compare results.json
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from uconf import __version__
+from uconf import cli
+from uconf import config
+from uconf import converter
+from uconf import diffing
+from uconf import rule_parser
+
+from . import synthetic
+
+
+def measure(fn, repeat, setup=None):
+    """Time ``repeat`` calls to ``fn``.
+
+    ``setup``, if provided, is called (untimed) before each run.
+    """
+    timings = []
+    for _i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    return dict(
+        repeat=repeat,
+        min=min(timings),
+        median=statistics.median(timings),
+        mean=statistics.mean(timings),
+    )
+
+
+def parse_importtime(output):
+    """Parse the output of ``python -X importtime``.
+
+    Returns:
+        (float, (str, float) list): the total import time, and the cumulative
+            time of top-level imports, slowest first; in seconds.
+    """
+    top_level = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _self, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit() and not name.startswith('  '):
+            # Top-level imports are indented by a single space
+            top_level.append((name.strip(), int(cumulative) / 10 ** 6))
+    top_level.sort(key=lambda entry: entry[1], reverse=True)
+    return sum(duration for _name, duration in top_level), top_level
+
+
+def run_command(root, *argv):
+    """Run a uconf command, without touching the logging setup."""
+    uconf_cli = cli.CLI('uconf')
+    args = uconf_cli.parse_args(list(argv) + ['--root', root])
+    env = uconf_cli.make_command_config(args, args.command)
+    return args.command(env, uconf_cli.parser).run()
+
+
+class Benchmarks:
+    """Benchmarks of a synthetic repository.
+
+    Attributes:
+        root (str): the synthetic repository
+        target (str): where files get installed
+        generator (synthetic.Generator): the repository content generator
+        sources (str => str list): source lines, by file name
+        categories (frozenset): active categories for the benchmark host
+    """
+
+    def __init__(self, workdir, shape, repeat):
+        self.root = os.path.join(workdir, 'repo')
+        self.target = os.path.join(workdir, 'target')
+        self.repeat = repeat
+        self.generator = synthetic.make_repository(self.root, self.target, shape)
+
+        self.sources = {}
+        for filename in self.generator.get_filenames():
+            with open(os.path.join(self.root, filename)) as f:
+                self.sources[filename] = f.read().splitlines()
+
+        env = config.Env.from_files(repo_root=self.root, config_files=())
+        self.categories = env.get_active_repository([synthetic.HOST]).categories
+
+    # Helpers
+    # -------
+
+    def _reset(self):
+        """Remove all built files and build caches."""
+        shutil.rmtree(self.target, ignore_errors=True)
+        os.makedirs(self.target)
+        shutil.rmtree(os.path.join(self.root, '.uconf', 'cache'), ignore_errors=True)
+        shutil.rmtree(os.path.join(self.root, '.uconf', 'state'), ignore_errors=True)
+
+    def _modify(self, lines):
+        """Simulate local edits to a generated file."""
+        return [line + ' # edited' if i % 10 == 0 else line for i, line in enumerate(lines)]
+
+    def _run_cli(self, *argv, python_options=()):
+        """Run uconf in a fresh interpreter, as users do.
+
+        Returns:
+            str: the standard error of the process
+        """
+        code = "import sys; from uconf import cli; sys.exit(cli.main(['uconf'] + sys.argv[1:]))"
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [
+            os.path.dirname(os.path.dirname(os.path.abspath(cli.__file__))),
+            os.environ.get('PYTHONPATH'),
+        ])))
+        return subprocess.run(
+            [sys.executable] + list(python_options) + ['-c', code] + list(argv),
+            cwd=self.root, env=env, check=True,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True,
+        ).stderr
+
+    # Benchmarks
+    # ----------
+
+    def bench_rule_parse(self):
+        rules = [self.generator.make_rule() for _i in range(1000)]
+
+        def parse():
+            lexer = rule_parser.RuleLexer()
+            for rule in rules:
+                lexer.get_rule(rule)
+
+        # Parsed rules are interned; measure actual parsing.
+        return measure(parse, self.repeat, setup=rule_parser.RuleLexer.clear_cache)
+
+    def bench_forward(self):
+        def forward():
+            for lines in self.sources.values():
+                for _line in converter.FileProcessor(lines, fs=None).forward(self.categories):
+                    pass
+
+        return measure(forward, self.repeat)
+
+    def bench_forward_cached(self):
+        template_cache = converter.TemplateCache()
+
+        def forward():
+            for lines in self.sources.values():
+                processor = converter.FileProcessor(lines, fs=None, template_cache=template_cache)
+                for _line in processor.forward(self.categories):
+                    pass
+
+        return measure(forward, self.repeat)
+
+    def bench_backward(self):
+        modified = {
+            filename: self._modify(list(converter.FileProcessor(lines, fs=None).forward(self.categories)))
+            for filename, lines in self.sources.items()
+        }
+
+        def backward():
+            for filename, lines in self.sources.items():
+                processor = converter.FileProcessor(lines, fs=None)
+                for _line in processor.backward(self.categories, modified[filename]):
+                    pass
+
+        return measure(backward, self.repeat)
+
+    def bench_diff_large(self):
+        # Myers finds minimal diffs, where difflib's autojunk heuristic may
+        # replace a whole repetitive file; time both, and patience.
+        rng = random.Random(self.generator.shape.seed)
+        allowed = ['allow %d.%d.%d.%d' % tuple(rng.randrange(256) for _i in range(4)) for _j in range(50000)]
+        edited = list(allowed)
+        for _i in range(50):
+            edited[rng.randrange(len(edited))] = 'allow 10.0.0.%d' % rng.randrange(256)
+        cases = [
+            (allowed, edited),
+            # Unrelated files, then barely related ones: bounded by the diff budget
+            ([str(rng.random()) for _i in range(20000)], [str(rng.random()) for _i in range(20000)]),
+            ([str(rng.randrange(50)) for _i in range(20000)], [str(rng.randrange(50)) for _i in range(20000)]),
+        ]
+
+        def diff(algorithm):
+            for original, modified in cases:
+                diffing.get_opcodes(original, modified, algorithm)
+
+        result = measure(lambda: diff(diffing.MYERS), self.repeat)
+        for algorithm in (diffing.PATIENCE, diffing.DIFFLIB):
+            result[algorithm] = measure(lambda: diff(algorithm), self.repeat)['median']
+        return result
+
+    def bench_repository_load(self):
+        def load():
+            config.Env.from_files(repo_root=self.root, config_files=())
+
+        return measure(load, self.repeat)
+
+    def bench_repository_load_cold(self):
+        def clear():
+            shutil.rmtree(os.path.join(self.root, '.uconf', 'cache'), ignore_errors=True)
+
+        def load():
+            config.Env.from_files(repo_root=self.root, config_files=())
+
+        return measure(load, self.repeat, setup=clear)
+
+    def bench_make_cold(self):
+        return measure(lambda: run_command(self.root, 'make'), self.repeat, setup=self._reset)
+
+    def bench_make_warm(self):
+        self._reset()
+        run_command(self.root, 'make')
+        return measure(lambda: run_command(self.root, 'make'), self.repeat)
+
+    def bench_diff(self):
+        self._reset()
+        run_command(self.root, 'make')
+        for filename in self.generator.get_filenames()[::2]:
+            path = os.path.join(self.target, filename)
+            with open(path) as f:
+                lines = f.read().splitlines()
+            synthetic.write_lines(path, self._modify(lines))
+        return measure(lambda: run_command(self.root, 'diff'), self.repeat)
+
+    def bench_status(self):
+        self._reset()
+        run_command(self.root, 'make')
+        for filename in self.generator.get_filenames()[::2]:
+            path = os.path.join(self.target, filename)
+            with open(path, 'a') as f:
+                f.write('modified\n')
+
+        def status():
+            with contextlib.redirect_stdout(io.StringIO()):
+                run_command(self.root, 'status')
+        return measure(status, self.repeat)
+
+    def bench_startup(self):
+        outputs = []
+
+        def startup():
+            outputs.append(self._run_cli('categories', python_options=['-X', 'importtime']))
+
+        result = measure(startup, self.repeat)
+        totals = []
+        for output in outputs:
+            total, top_level = parse_importtime(output)
+            totals.append(total)
+        result['imports'] = statistics.median(totals)
+        result['slowest_imports'] = top_level[:10]
+        return result
+
+    def bench_files_cold(self):
+        # A single run, with empty caches: rules are only evaluated a few times.
+        def clear():
+            shutil.rmtree(os.path.join(self.root, '.uconf', 'cache'), ignore_errors=True)
+
+        return measure(lambda: self._run_cli('files', '-i', synthetic.HOST), self.repeat, setup=clear)
+
+    def bench_files_warm(self):
+        self._run_cli('files', '-i', synthetic.HOST)
+        return measure(lambda: self._run_cli('files', '-i', synthetic.HOST), self.repeat)
+
+    @classmethod
+    def get_names(cls):
+        return [name[len('bench_'):] for name in dir(cls) if name.startswith('bench_')]
+
+    def run(self, names):
+        results = {}
+        for name in names:
+            results[name] = getattr(self, 'bench_' + name)()
+            print("%-20s median %9.4fs  min %9.4fs" % (
+                name, results[name]['median'], results[name]['min']), file=sys.stderr)
+        return results
+
+
+def compare(previous, current):
+    """Print a comparison of two sets of results."""
+    print("%-20s %12s %12s %8s" % ('benchmark', 'previous', 'current', 'ratio'))
+    for name, result in sorted(current['results'].items()):
+        old = previous['results'].get(name)
+        if old is None:
+            print("%-20s %12s %11.4fs" % (name, '-', result['median']))
+        else:
+            print("%-20s %11.4fs %11.4fs %7.2fx" % (
+                name, old['median'], result['median'], result['median'] / old['median']))
+
+
+def make_parser():
+    defaults = synthetic.RepoShape()
+    parser = argparse.ArgumentParser(description="Benchmark uconf on a synthetic repository")
+    parser.add_argument('--files', type=int, default=defaults.files, help="Number of source files")
+    parser.add_argument('--lines', type=int, default=defaults.lines, help="Lines per source file")
+    parser.add_argument('--depth', type=int, default=defaults.depth, help="Maximum block nesting")
+    parser.add_argument('--categories', type=int, default=defaults.categories, help="Number of categories")
+    parser.add_argument('--complexity', type=int, default=defaults.complexity, help="Categories per rule")
+    parser.add_argument(
+        '--category-rules', type=int, default=defaults.category_rules,
+        help="Number of [categories] rules",
+    )
+    parser.add_argument('--seed', type=int, default=defaults.seed, help="Random seed")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per benchmark")
+    parser.add_argument(
+        '--only', nargs='*', choices=Benchmarks.get_names(), metavar='BENCHMARK',
+        help="Only run some benchmarks (%s)" % ', '.join(Benchmarks.get_names()),
+    )
+    parser.add_argument('--output', '-o', help="Write JSON results to OUTPUT")
+    parser.add_argument('--compare', help="Compare results with a previous JSON output")
+    parser.add_argument('--workdir', help="Build the repository in WORKDIR (kept afterwards)")
+    return parser
+
+
+def main(argv):
+    args = make_parser().parse_args(argv)
+    shape = synthetic.RepoShape(
+        files=args.files,
+        lines=args.lines,
+        depth=args.depth,
+        categories=args.categories,
+        complexity=args.complexity,
+        category_rules=args.category_rules,
+        seed=args.seed,
+    )
+
+    # Building files logs one line per file; don't measure the terminal.
+    logging.disable(logging.CRITICAL)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='uconf-bench-')
+    try:
+        benchmarks = Benchmarks(workdir, shape, repeat=args.repeat)
+        results = benchmarks.run(args.only or Benchmarks.get_names())
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir)
+
+    output = dict(
+        uconf=__version__,
+        python=platform.python_version(),
+        platform=platform.platform(),
+        date=datetime.datetime.now().isoformat(),
+        shape=shape.as_dict(),
+        results=results,
+    )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), output)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
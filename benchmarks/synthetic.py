@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2013 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+"""Generate synthetic uconf repositories, for benchmarking."""
+
+import os
+import random
+
+
+HOST = 'benchhost'
+
+
+class RepoShape:
+    """Parameters of a synthetic repository.
+
+    Attributes:
+        files (int): number of source files
+        lines (int): approximate number of lines per file
+        depth (int): maximum nesting depth of #@if / #@with blocks
+        categories (int): number of distinct categories
+        complexity (int): number of categories in each rule
+        category_rules (int): number of lines in the [categories] section
+        seed (int): random seed, for reproducible repositories
+    """
+
+    def __init__(self, files=50, lines=200, depth=3, categories=20, complexity=3,
+                 category_rules=20, seed=42):
+        self.files = files
+        self.lines = lines
+        self.depth = depth
+        self.categories = categories
+        self.complexity = complexity
+        self.category_rules = category_rules
+        self.seed = seed
+
+    def __repr__(self):
+        return '<RepoShape: %r>' % self.as_dict()
+
+    def as_dict(self):
+        return dict(
+            files=self.files,
+            lines=self.lines,
+            depth=self.depth,
+            categories=self.categories,
+            complexity=self.complexity,
+            category_rules=self.category_rules,
+            seed=self.seed,
+        )
+
+
+class Generator:
+    """Build the content of a synthetic repository from a RepoShape."""
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.random = random.Random(shape.seed)
+        self.category_names = ['cat%d' % i for i in range(shape.categories)]
+        self.host_categories = self.random.sample(
+            self.category_names, max(1, shape.categories // 3))
+
+    # Rules
+    # -----
+
+    def make_rule(self, complexity=None):
+        """Build a random rule text, using ``complexity`` categories."""
+        if complexity is None:
+            complexity = self.shape.complexity
+        if complexity <= 1:
+            name = self.random.choice(self.category_names)
+            return '!' + name if self.random.random() < 0.2 else name
+
+        left_size = self.random.randint(1, complexity - 1)
+        left = self.make_rule(left_size)
+        right = self.make_rule(complexity - left_size)
+        operator = self.random.choice(('&&', '||'))
+        return '(%s %s %s)' % (left, operator, right)
+
+    # Source files
+    # ------------
+
+    def make_lines(self, budget, depth=0, variables=()):
+        """Generate at most ``budget`` source lines.
+
+        Returns:
+            str list
+        """
+        lines = []
+        while len(lines) < budget:
+            remaining = budget - len(lines)
+            roll = self.random.random()
+            if depth < self.shape.depth and remaining >= 6 and roll < 0.15:
+                lines.extend(self._make_if_block(remaining, depth, variables))
+            elif depth < self.shape.depth and remaining >= 4 and roll < 0.25:
+                lines.extend(self._make_with_block(remaining, depth, variables))
+            elif variables and roll < 0.4:
+                lines.append('value_%d = @@%s@@' % (len(lines), self.random.choice(variables)))
+            else:
+                lines.append('key_%d = some text for line %d' % (len(lines), len(lines)))
+        return lines
+
+    def _make_if_block(self, remaining, depth, variables):
+        size = self.random.randint(2, min(remaining - 4, 40))
+        lines = ['#@if %s' % self.make_rule()]
+        branches = self.random.randint(1, 3)
+        for branch in range(branches):
+            if branch == branches - 1 and branch > 0:
+                lines.append('#@else')
+            elif branch > 0:
+                lines.append('#@elif %s' % self.make_rule())
+            lines.extend(self.make_lines(max(1, size // branches), depth + 1, variables))
+        lines.append('#@endif')
+        return lines
+
+    def _make_with_block(self, remaining, depth, variables):
+        size = self.random.randint(1, min(remaining - 2, 40))
+        name = 'var%d' % depth
+        lines = ['#@with %s=value%d' % (name, self.random.randint(0, 100))]
+        lines.extend(self.make_lines(size, depth + 1, tuple(variables) + (name,)))
+        lines.append('#@endwith')
+        return lines
+
+    def make_file(self):
+        return self.make_lines(self.shape.lines)
+
+    # Configuration
+    # -------------
+
+    def make_config(self, target):
+        config = [
+            '[core]',
+            'target = %s' % target,
+            'initial = %s' % HOST,
+            '',
+            '[categories]',
+            '%s: %s' % (HOST, ' '.join(self.host_categories)),
+        ]
+        for _i in range(self.shape.category_rules):
+            config.append('%s: %s' % (self.make_rule(), self.random.choice(self.category_names)))
+
+        config.extend(['', '[files]'])
+        filenames = self.get_filenames()
+        for start in range(0, len(filenames), 10):
+            # Always enable files, while still parsing complex rules
+            config.append('%s || %s: %s' % (
+                self.make_rule(), HOST, ' '.join(filenames[start:start + 10])))
+
+        config.extend([
+            '',
+            '[actions]',
+            '*.conf = parse',
+            'dir0/* = parse',
+            '',
+        ])
+        return config
+
+    def get_filenames(self):
+        return ['dir%d/file%d.conf' % (i % 10, i) for i in range(self.shape.files)]
+
+
+def write_lines(path, lines):
+    with open(path, 'w') as f:
+        for line in lines:
+            f.write(line + '\n')
+
+
+def make_repository(root, target, shape):
+    """Write a synthetic repository to ``root``, installing to ``target``.
+
+    Returns:
+        Generator: the generator used to build the repository
+    """
+    generator = Generator(shape)
+    os.makedirs(os.path.join(root, '.uconf'), exist_ok=True)
+    os.makedirs(target, exist_ok=True)
+
+    write_lines(os.path.join(root, '.uconf', 'config'), generator.make_config(target))
+    for filename in generator.get_filenames():
+        path = os.path.join(root, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_lines(path, generator.make_file())
+
+    return generator
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2013 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+from uconf import actions
+from uconf import cache
+from uconf import config
+from uconf import constants
+from uconf import fs
+from uconf import manifest
+
+
+class FakeEnv:
+    def __init__(self, target, build_state=None, **options):
+        self.options = options
+        self.forward_fs = fs.FSLoader(target)
+        self.hash_cache = manifest.HashCache()
+        self.build_state = build_state
+        self.repository = config.Repository()
+
+    def get(self, key, default=None):
+        return self.options.get(key, default)
+
+    def getbool(self, key, default=False):
+        return bool(self.options.get(key, default))
+
+    def getint(self, key, default=0):
+        return int(self.options.get(key, default))
+
+    def get_build_state(self):
+        return self.build_state
+
+    def get_template_cache(self):
+        return None
+
+    def get_forward_fs(self):
+        return self.forward_fs
+
+    def get_hash_cache(self):
+        return self.hash_cache
+
+
+class CopyActionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.source = os.path.join(self.tmpdir, 'source')
+        self.target = os.path.join(self.tmpdir, 'target')
+        os.mkdir(self.target)
+        self.destination = os.path.join(self.target, 'blob')
+
+        with open(self.source, 'wb') as f:
+            f.write(os.urandom(100000))
+        os.chmod(self.source, 0o640)
+
+    def make_action(self, **options):
+        return actions.CopyAction(self.source, self.destination, env=FakeEnv(self.target, **options))
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_copy(self):
+        for reflink in (False, True):
+            self.make_action(reflink=reflink).forward([])
+            self.assertEqual(self.read(self.source), self.read(self.destination))
+            self.assertEqual(0o640, stat.S_IMODE(os.stat(self.destination).st_mode))
+            os.unlink(self.destination)
+
+    def test_skip_identical(self):
+        self.make_action().forward([])
+        os.chmod(self.destination, 0o600)
+        inode = os.stat(self.destination).st_ino
+
+        action = self.make_action()
+        action.env.forward_fs.fs.copy = lambda *args, **kwargs: self.fail("File copied again")
+        with self.assertLogs('uconf.actions', level='INFO'):
+            action.forward([])
+        self.assertEqual(inode, os.stat(self.destination).st_ino)
+        # Mode was still updated
+        self.assertEqual(0o640, stat.S_IMODE(os.stat(self.destination).st_mode))
+
+    def test_status(self):
+        self.assertEqual(constants.MISSING, self.make_action().status([]))
+        self.make_action().forward([])
+        self.assertEqual(constants.UP_TO_DATE, self.make_action().status([]))
+        with open(self.destination, 'ab') as f:
+            f.write(b'x')
+        self.assertEqual(constants.MODIFIED, self.make_action().status([]))
+
+    def test_replace_different(self):
+        with open(self.destination, 'wb') as f:
+            f.write(b'x' * 100000)
+        self.make_action().forward([])
+        self.assertEqual(self.read(self.source), self.read(self.destination))
+
+
+class FileStatusTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.source = os.path.join(self.tmpdir, 'source')
+        self.target = os.path.join(self.tmpdir, 'target')
+        os.mkdir(self.target)
+        self.destination = os.path.join(self.target, 'file')
+        self.build_state = manifest.BuildState(cache.DiskCache(os.path.join(self.tmpdir, 'state')))
+        self.write(self.source, ['foo', '#@if a', 'bar', '#@endif'])
+
+    def write(self, path, lines):
+        with open(path, 'w') as f:
+            f.write(''.join('%s\n' % line for line in lines))
+
+    def get_status(self, **options):
+        env = FakeEnv(self.target, build_state=self.build_state, **options)
+        action = actions.FileProcessingAction(self.source, self.destination, env=env)
+        return action.status(['a'])
+
+    def make(self):
+        env = FakeEnv(self.target, build_state=self.build_state)
+        actions.FileProcessingAction(self.source, self.destination, env=env).forward(['a'])
+
+    def test_status(self):
+        self.assertEqual(constants.MISSING, self.get_status())
+        self.make()
+        self.assertEqual(constants.UP_TO_DATE, self.get_status())
+
+        self.write(self.destination, ['foo', 'baz'])
+        self.assertEqual(constants.MODIFIED_DESTINATION, self.get_status())
+        self.write(self.source, ['foo', 'baz'])
+        self.assertEqual(constants.UP_TO_DATE, self.get_status())
+
+        self.write(self.source, ['foo'])
+        self.assertEqual(constants.MODIFIED_SOURCE, self.get_status())
+        self.write(self.destination, ['bar'])
+        self.assertEqual(constants.MODIFIED, self.get_status())
+
+    def test_stat_only(self):
+        self.make()
+        action_class = actions.FileProcessingAction
+        with mock.patch.object(action_class, 'forward_content', side_effect=AssertionError("Rendered")):
+            self.assertEqual(constants.UP_TO_DATE, self.get_status())
+
+    def test_no_record(self):
+        self.build_state = None
+        self.make()
+        self.assertEqual(constants.UP_TO_DATE, self.get_status())
+        self.write(self.destination, ['bar'])
+        self.assertEqual(constants.MODIFIED, self.get_status())
+
+
+if __name__ == '__main__':
+    unittest.main()
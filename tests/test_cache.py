@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2013 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from uconf import cache
+
+
+class DiskCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.store = cache.DiskCache(os.path.join(self.tmpdir, 'cache'))
+
+    def test_roundtrip(self):
+        self.store.set('foo', {'a': [1, 2]})
+        self.assertEqual({'a': [1, 2]}, self.store.get('foo'))
+        self.assertIsNone(self.store.get('bar'))
+
+    def test_read_only(self):
+        store = cache.DiskCache(self.store.root, read_only=True)
+        store.set('foo', 1)
+        self.assertIsNone(store.get('foo'))
+
+    def test_unpicklable(self):
+        class Local:
+            pass
+
+        for value in (lambda: None, Local(), (i for i in [])):
+            self.store.set('foo', value)
+            self.assertIsNone(self.store.get('foo'))
+        # No temporary file is left behind.
+        self.assertEqual([], os.listdir(self.store.root))
+
+    def test_evict(self):
+        for i in range(4):
+            self.store.set('key%d' % i, i)
+            os.utime(self.store.get_path('key%d' % i), (i, i))
+        self.store.touch('key0')
+        self.store.evict(2)
+        self.assertEqual([0, None, None, 3], [self.store.get('key%d' % i) for i in range(4)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2013 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from uconf import cli
+
+
+class ParserTestCase(unittest.TestCase):
+    def test_lazy_subparsers(self):
+        uconf_cli = cli.CLI('uconf')
+        self.assertIn('make', uconf_cli.pending_commands)
+
+        args = uconf_cli.parse_args(['make', '--jobs', '2', 'foo'])
+        self.assertEqual(2, args.jobs)
+        self.assertEqual(['foo'], args.files)
+        self.assertNotIn('make', uconf_cli.pending_commands)
+        self.assertIn('diff', uconf_cli.pending_commands)
+
+
+class StartupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        os.makedirs(os.path.join(self.root, '.uconf'))
+        with open(os.path.join(self.root, '.uconf', 'config'), 'w') as f:
+            f.write("[categories]\nbar = foo\n")
+
+    def test_lazy_imports(self):
+        code = (
+            "import sys; from uconf import cli; cli.main(['uconf', 'categories', '-i', 'bar']);"
+            "print(' '.join(sorted(sys.modules)))"
+        )
+        package_root = os.path.dirname(os.path.dirname(os.path.abspath(cli.__file__)))
+        output = subprocess.run(
+            [sys.executable, '-c', code],
+            cwd=self.root, env=dict(os.environ, PYTHONPATH=package_root), check=True,
+            stdout=subprocess.PIPE, universal_newlines=True,
+        ).stdout
+        categories, modules = output.splitlines()[:-1], output.splitlines()[-1].split()
+
+        self.assertEqual(['bar', 'foo'], sorted(categories))
+        # Lazily imported modules are registered, but their own imports
+        # only happen once they are used.
+        for name in ('fslib', 'multiprocessing.context', 'uconf.diffing'):
+            self.assertNotIn(name, modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2013 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from uconf import commands
+from uconf import config
+from uconf import porcelain
+
+
+class FleetMakeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.root = os.path.join(self.tmpdir, 'repo')
+        self.output_root = os.path.join(self.tmpdir, 'output')
+        self.hosts_file = os.path.join(self.tmpdir, 'hosts')
+        os.makedirs(os.path.join(self.root, '.uconf'))
+
+        self.write('.uconf/config', "[categories]\nweb = server\n[files]\nserver = nginx\nwork = gitconfig\n")
+        self.write('nginx', "#@if web\nlisten 80\n#@endif\nroot /srv\n")
+        self.write('gitconfig', "email = me@work\n")
+
+    def write(self, name, content):
+        with open(os.path.join(self.root, name), 'w') as f:
+            f.write(content)
+
+    def write_hosts(self, *lines):
+        with open(self.hosts_file, 'w') as f:
+            f.write(''.join('%s\n' % line for line in lines))
+
+    def make_command(self, **extra):
+        extra.update(
+            target=os.path.join(self.tmpdir, 'target'), hosts_file=self.hosts_file, output_root=self.output_root)
+        env = config.Env.from_files(repo_root=self.root, config_files=(), extra=extra)
+        return commands.FleetMake(env, parser=None)
+
+    def run_command(self, **extra):
+        command = self.make_command(**extra)
+        with self.assertLogs(commands.__name__, level='INFO'):
+            command.run()
+
+    def read_output(self):
+        files = {}
+        for folder, _dirs, filenames in os.walk(self.output_root):
+            for filename in filenames:
+                path = os.path.join(folder, filename)
+                with open(path) as f:
+                    files[os.path.relpath(path, self.output_root)] = f.read()
+        return files
+
+    def test_read_hosts(self):
+        self.write_hosts(
+            "# Production",
+            "",
+            "web.example.org  server web",
+            "   ",
+            "laptop work",
+        )
+        command = self.make_command()
+        self.assertEqual([
+            ('web.example.org', ['web.example.org', 'web', 'server']),
+            ('laptop', ['laptop', 'work']),
+        ], list(command._read_hosts(self.hosts_file)))
+
+    def test_read_hosts_initial(self):
+        self.write_hosts("db.example.org work", "laptop")
+        command = self.make_command()
+        self.assertEqual([
+            ('db.example.org', ['db.example.org', 'db', 'work', 'server']),
+            ('laptop', ['laptop', 'work', 'server']),
+        ], list(command._read_hosts(self.hosts_file, initial=['work', 'server'])))
+
+    def test_invalid_hosts(self):
+        for host in ('../escape', '..', '.', 'a/b', '/abs', 'foo..bar'):
+            self.write_hosts("laptop", host)
+            command = self.make_command()
+            with self.assertRaises(commands.ConfigError, msg=host):
+                list(command._read_hosts(self.hosts_file))
+
+    def test_invalid_host_before_build(self):
+        self.write_hosts("web", "../escape")
+        command = self.make_command()
+        self.assertRaises(commands.ConfigError, command.run)
+        self.assertFalse(os.path.exists(self.output_root))
+
+    def test_run(self):
+        self.write_hosts("web.example.org", "laptop work")
+        self.run_command()
+        self.assertEqual({
+            os.path.join('web.example.org', 'nginx'): "listen 80\nroot /srv\n",
+            os.path.join('laptop', 'gitconfig'): "email = me@work\n",
+        }, self.read_output())
+
+    def test_single_runner(self):
+        self.write_hosts("web", "db.example.org server", "laptop work")
+        with mock.patch.object(porcelain, 'FileRunner', wraps=porcelain.FileRunner) as runner:
+            self.run_command(jobs=2)
+        self.assertEqual(1, runner.call_count)
+        self.assertEqual({
+            os.path.join('web', 'nginx'): "listen 80\nroot /srv\n",
+            os.path.join('db.example.org', 'nginx'): "root /srv\n",
+            os.path.join('laptop', 'gitconfig'): "email = me@work\n",
+        }, self.read_output())
+
+    def test_no_build_state(self):
+        # Outputs of the fleet don't evict records of the main target.
+        self.write_hosts("web", "laptop work")
+        self.run_command()
+        state = os.path.join(self.root, '.uconf', 'state')
+        self.assertEqual([], os.listdir(state) if os.path.exists(state) else [])
+
+    def test_dry_run(self):
+        self.write_hosts("web", "laptop work")
+        self.run_command(dry_run=True)
+        self.assertFalse(os.path.exists(self.output_root))
+
+    def test_run_initial(self):
+        # Configured initial categories apply to every host.
+        self.write_hosts("web", "laptop")
+        self.run_command(initial=['work'])
+        self.assertEqual({
+            os.path.join('web', 'nginx'): "listen 80\nroot /srv\n",
+            os.path.join('web', 'gitconfig'): "email = me@work\n",
+            os.path.join('laptop', 'gitconfig'): "email = me@work\n",
+        }, self.read_output())
+
+
+if __name__ == '__main__':
+    unittest.main()
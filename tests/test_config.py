@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2013 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+import fnmatch
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import confutils
+
+from uconf import cache
+from uconf import config
+from uconf import helpers
+from uconf import rule_parser
+
+
+class RepositoryTestCase(unittest.TestCase):
+    def make_repository(self, category_rules=(), file_rules=()):
+        repository = config.Repository()
+        repository._read_category_rules(dict(category_rules))
+        repository._read_file_rules(dict(file_rules))
+        return repository
+
+    def test_expansion(self):
+        repository = self.make_repository([
+            ('laptop', ['x11 mobile']),
+            ('x11', ['fonts']),
+        ])
+        view = repository.extract(['laptop'])
+        self.assertEqual(frozenset(['laptop', 'x11', 'mobile', 'fonts']), view.categories)
+
+    def test_expansion_order(self):
+        # Rules enabled by a later rule are still applied.
+        repository = self.make_repository([
+            ('x11', ['fonts']),
+            ('laptop', ['x11']),
+            ('fonts && !server', ['desktop']),
+        ])
+        view = repository.extract(['laptop'])
+        self.assertEqual(frozenset(['laptop', 'x11', 'fonts', 'desktop']), view.categories)
+
+    def test_expansion_cached(self):
+        repository = self.make_repository([('laptop', ['x11'])])
+        mask = repository.universe.mask(['laptop'])
+        expanded = repository.expand_categories(mask)
+        self.assertIn(mask, repository._expansions)
+        self.assertEqual(expanded, repository.expand_categories(mask))
+
+    def test_iter_files(self):
+        repository = self.make_repository(
+            [('laptop', ['x11'])],
+            [('x11', ['xinitrc Xresources']), ('server', ['sshd_config'])],
+        )
+        view = repository.extract(['laptop'])
+        self.assertEqual(['Xresources', 'xinitrc'], sorted(view.iter_files()))
+
+
+class RepositoryCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        os.mkdir(os.path.join(self.root, '.uconf'))
+        self.store = cache.DiskCache(os.path.join(self.root, '.uconf', 'cache'))
+        self.write_config('laptop = x11', 'x11 = xinitrc')
+
+    def write_config(self, category_rule, file_rule):
+        with open(os.path.join(self.root, '.uconf', 'config'), 'w') as f:
+            f.write('[core]\ntarget = /tmp/x\n[categories]\n%s\n[files]\n%s\n[actions]\nxinitrc = copy\n' % (
+                category_rule, file_rule))
+
+    def load(self):
+        return config.Repository(root=self.root, store=self.store)
+
+    def test_cached(self):
+        self.load()
+        with mock.patch.object(rule_parser.RuleLexer, 'get_rule', side_effect=AssertionError("Parsed")):
+            repository = self.load()
+        view = repository.extract(['laptop'])
+        self.assertEqual(['xinitrc'], list(view.iter_files()))
+        self.assertEqual('copy', view.get_file_config('xinitrc').action)
+        # The configuration is still available
+        self.assertEqual(['x11'], list(repository.files_config))
+
+    def test_cached_options(self):
+        user_config = os.path.join(self.root, 'user-config')
+        with open(user_config, 'w') as f:
+            f.write('[core]\ninitial = laptop\n[make]\ntarget = /tmp/y\n')
+
+        config.Env.from_files(repo_root=self.root, config_files=[user_config])
+        with mock.patch.object(
+                confutils.ConfigFile, 'parse', autospec=True, side_effect=confutils.ConfigFile.parse) as parse:
+            env = config.Env.from_files(repo_root=self.root, config_files=[user_config])
+            make_env = config.Env.from_files(
+                repo_root=self.root, config_files=[user_config], sections=['make'], extra={'dry_run': True})
+        # Only the user configuration was parsed.
+        self.assertEqual(2, parse.call_count)
+
+        self.assertEqual('/tmp/x', env.get('target'))
+        self.assertEqual('laptop', env.get('initial'))
+        self.assertEqual('/tmp/y', make_env.get('target'))
+        self.assertTrue(make_env.get('dry_run'))
+
+    def test_invalidated(self):
+        self.load()
+        self.write_config('laptop = x11', 'laptop = xinitrc')
+        repository = self.load()
+        self.assertEqual([], list(repository.extract(['x11']).iter_files()))
+        self.assertEqual(['xinitrc'], list(repository.extract(['laptop']).iter_files()))
+
+
+class EnvTestCase(unittest.TestCase):
+    def make_env(self, **options):
+        repository = config.Repository()
+        repository._read_category_rules({'laptop': ['x11']})
+        options.setdefault('target', '')
+        return config.Env(root=None, repository=repository, config=confutils.MergedConfig(options))
+
+    def test_memoized_views(self):
+        env = self.make_env()
+        view = env.get_active_repository(['laptop', 'host'])
+        self.assertIs(view, env.get_active_repository(('host', 'laptop')))
+        self.assertIsNot(view, env.get_active_repository(['host']))
+
+    def test_bounded_views(self):
+        env = self.make_env(view_cache_size=2)
+        view = env.get_active_repository(['a'])
+        env.get_active_repository(['b'])
+        env.get_active_repository(['c'])
+        self.assertIsNot(view, env.get_active_repository(['a']))
+
+
+class GlobStoreTestCase(unittest.TestCase):
+    def naive_get(self, store, key):
+        for glob, value in store.entries:
+            if fnmatch.fnmatchcase(key, glob):
+                return value
+        return None
+
+    def test_first_match(self):
+        store = config.GlobStore()
+        store['ssh/config'] = 1
+        store['ssh/*'] = 2
+        store['*'] = 3
+        store['*.conf'] = 4
+        self.assertEqual(1, store['ssh/config'])
+        self.assertEqual(2, store['ssh/known_hosts'])
+        self.assertEqual(2, store['ssh/foo.conf'])
+        self.assertEqual(3, store['foo.conf'])
+        self.assertEqual(3, store[''])
+
+    def test_missing(self):
+        store = config.GlobStore([('ssh/*', 1), ('*.conf', 2), ('bashrc', 3)])
+        self.assertRaises(KeyError, store.__getitem__, 'zshrc')
+        self.assertIsNone(store.get('ssh'))
+
+    def test_replace(self):
+        store = config.GlobStore()
+        store['ssh/*'] = 1
+        self.assertEqual(1, store['ssh/config'])
+        store['ssh/*'] = 2
+        self.assertEqual([('ssh/*', 2)], store.entries)
+        self.assertEqual(2, store['ssh/config'])
+
+    def test_random(self):
+        rng = random.Random(42)
+        parts = ['a', 'b', 'ab', 'a/', 'b/']
+        globs = ['*', '?', '[ab]', 'a*', 'b/*', '*b', 'a?b*', '[!a]*']
+        store = config.GlobStore()
+        for i in range(60):
+            glob = ''.join(rng.choice(parts + globs) for _j in range(rng.randint(1, 3)))
+            store[glob] = i
+
+        for _i in range(500):
+            key = ''.join(rng.choice(parts) for _j in range(rng.randint(0, 4)))
+            self.assertEqual(self.naive_get(store, key), store.get(key), key)
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def test_eviction(self):
+        cache = helpers.LRUCache(maxsize=2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(1, cache.get('a'))
+        cache['c'] = 3
+        self.assertEqual(2, len(cache))
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIsNone(cache.get('b'))
+
+
+if __name__ == '__main__':
+    unittest.main()
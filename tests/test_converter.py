@@ -3,9 +3,15 @@
 # Copyright (c) 2010-2013 Raphaël Barrois
 # This software is distributed under the two-clause BSD license.
 
+import os
+import random
+import shutil
+import tempfile
 import unittest
 
+from uconf import cache
 from uconf import converter
+from uconf import diffing
 
 
 class LineTestCase(unittest.TestCase):
@@ -163,6 +169,20 @@ class BlockStackTestCase(unittest.TestCase):
         self.assertIsNone(s.merged_context.get('baz'))
         self.assertEqual(1, s.merged_context.get('bar'))
 
+    def test_substitute(self):
+        s = converter.BlockStack()
+        self.assertEqual('@@foo@@', s.substitute('@@foo@@'))
+        s.enter(converter.Block.KIND_WITH, context={'foo': '@@bar@@'}, start_line=1)
+        s.enter(converter.Block.KIND_IF, published=False, start_line=2)
+        s.enter(converter.Block.KIND_WITH, context={'bar': 'x'}, start_line=3)
+        self.assertFalse(s.published)
+        # Single pass: values are not substituted again
+        self.assertEqual('@@bar@@ x @@baz@@', s.substitute('@@foo@@ @@bar@@ @@baz@@'))
+        s.leave(converter.Block.KIND_WITH)
+        s.leave(converter.Block.KIND_IF)
+        self.assertTrue(s.published)
+        self.assertEqual('@@bar@@ @@bar@@', s.substitute('@@foo@@ @@bar@@'))
+
 
 class GeneratorTestCase(unittest.TestCase):
     def make_generator(self, lines, categories):
@@ -285,6 +305,248 @@ class GeneratorTestCase(unittest.TestCase):
         out = list(g)
         self.assertEqual(expected, out)
 
+    def test_iter_output(self):
+        txt = [
+            'foo',
+            '#@if blah',
+            'bar',
+            '#@endif',
+            '#@with x=1',
+            '@@x@@',
+            '#@endwith',
+            '#@@escaped',
+            'baz',
+            'bazbaz',
+        ]
+        for categories in ([], ['blah']):
+            expected = [line.output for line in self.make_generator(txt, categories) if line.output is not None]
+            self.assertEqual(expected, list(self.make_generator(txt, categories).iter_output()))
+            streaming = self.make_generator(iter(txt), categories)
+            streaming.streaming = True
+            self.assertEqual(expected, list(streaming.iter_output()))
+
+    def test_compiled_template(self):
+        txt = [
+            'foo',
+            '#@if blah',
+            'bar',
+            '#@endif',
+            'baz',
+        ]
+        config = converter.GeneratorConfig(
+            categories=['blah'],
+            commands=[cmd_class() for cmd_class in converter.DEFAULT_COMMANDS],
+            fs=None,
+        )
+        template = config.load([]).compile(txt)
+        expected = [
+            converter.Line('foo', 'foo'),
+            converter.Line(None, '#@if blah'),
+            converter.Line('bar', 'bar'),
+            converter.Line(None, '#@endif'),
+            converter.Line('baz', 'baz'),
+        ]
+        self.assertEqual(expected, list(config.load(template)))
+        # Templates can be reused
+        self.assertEqual(expected, list(config.load(template)))
+
+    def test_block_mismatch(self):
+        txt = [
+            '#@with x=1',
+            '#@endif',
+        ]
+        self.assertRaises(ValueError, list, self.make_generator(txt, []))
+
+    def test_unknown_command(self):
+        g = self.make_generator(['foo', '#@blah'], categories=[])
+        self.assertRaises(converter.CommandError, list, g)
+
+
+class FileProcessorTestCase(unittest.TestCase):
+    txt = [
+        'foo',
+        '#@if blah',
+        'bar',
+        '#@else',
+        'baz',
+        '#@endif',
+        '#@with x=1',
+        'x=@@x@@',
+        '#@endwith',
+    ]
+
+    def test_streaming(self):
+        expected = list(converter.FileProcessor(self.txt, fs=None).forward(['blah']))
+        self.assertEqual(['foo', 'bar', 'x=1'], expected)
+
+        processor = converter.FileProcessor(iter(self.txt), fs=None, streaming=True)
+        self.assertEqual(expected, list(processor.forward(['blah'])))
+
+    def test_backward(self):
+        modified = ['foo', 'bar2', 'x=1', 'new']
+        for algorithm in diffing.ALGORITHMS:
+            processor = converter.FileProcessor(self.txt, fs=None, diff_algorithm=algorithm)
+            self.assertEqual(
+                [
+                    'foo',
+                    '#@if blah',
+                    'bar2',
+                    '#@else',
+                    'baz',
+                    '#@endif',
+                    '#@with x=1',
+                    'x=@@x@@',
+                    '#@endwith',
+                    'new',
+                ],
+                list(processor.backward(['blah'], modified)),
+            )
+
+    def test_unknown_placeholder(self):
+        txt = [
+            '#@with x=1',
+            '@@x@@ @@y@@',
+            '#@endwith',
+        ]
+        processor = converter.FileProcessor(txt, fs=None)
+        self.assertEqual(['1 @@y@@'], list(processor.forward([])))
+
+        processor = converter.FileProcessor(txt, fs=None, strict=True)
+        with self.assertRaises(ValueError) as context:
+            list(processor.forward([]))
+        self.assertIn("Unknown placeholder y", str(context.exception))
+
+    def test_streaming_backward(self):
+        processor = converter.FileProcessor(iter(self.txt), fs=None, streaming=True)
+        self.assertRaises(ValueError, list, processor.backward(['blah'], []))
+
+
+class BackporterTestCase(unittest.TestCase):
+    def make_source(self, rnd, size):
+        lines = []
+        while len(lines) < size:
+            roll = rnd.random()
+            if roll < 0.1:
+                lines.extend(['#@if %s' % rnd.choice('ab'), 'if_%d' % len(lines), '#@else', 'else', '#@endif'])
+            elif roll < 0.2:
+                lines.extend(['#@with x=%d' % len(lines), 'x=@@x@@', '#@endwith'])
+            elif roll < 0.25:
+                lines.append('#@#@ escaped')
+            elif roll < 0.3:
+                lines.append('# comment')
+            else:
+                lines.append('line %d' % rnd.randint(0, 10))
+        return lines
+
+    def modify(self, rnd, lines):
+        modified = list(lines)
+        for _i in range(rnd.randint(0, 5)):
+            position = rnd.randint(0, len(modified))
+            action = rnd.choice(['insert', 'delete', 'replace'])
+            if action == 'insert' or position == len(modified):
+                modified.insert(position, rnd.choice(['new %d' % position, '#@new']))
+            elif action == 'delete':
+                del modified[position]
+            else:
+                modified[position] = 'changed %d' % position
+        return modified
+
+    def test_hunks_match_lines(self):
+        rnd = random.Random(42)
+        for _i in range(300):
+            source = self.make_source(rnd, rnd.randint(0, 30))
+            categories = rnd.choice([[], ['a'], ['a', 'b']])
+            processor = converter.FileProcessor(source, fs=None)
+            output = list(processor.forward(categories))
+            modified = self.modify(rnd, output)
+
+            for algorithm in diffing.ALGORITHMS:
+                diff = converter.Differ(output, modified, algorithm)
+                generator = processor._get_gen_config(categories).load(source)
+                expected = list(converter.Backporter(diff, generator))
+
+                processor.diff_algorithm = algorithm
+                self.assertEqual(expected, list(processor.backward(categories, modified)))
+
+
+class TemplateTestCase(unittest.TestCase):
+    def compile(self, lines):
+        commands = [cmd_class() for cmd_class in converter.DEFAULT_COMMANDS]
+        commands_by_key = {key: cmd for cmd in commands for key in cmd.get_keys()}
+        return converter.Template.compile(lines, commands_by_key)
+
+    def test_ops(self):
+        template = self.compile([
+            'foo',
+            'bar',
+            '#@if blah',
+            'x=@@x@@',
+            '#@#comment',
+            '#@@escaped',
+            '#@endif',
+            'baz',
+        ])
+        T = converter.Template
+        self.assertEqual([
+            (T.OP_TEXT, 0, 2),
+            (T.OP_COMMAND, 2, 'if', template.ops[1][3]),
+            (T.OP_SUBST, 3),
+            (T.OP_MASKED, 4),
+            (T.OP_ESCAPED, 5, '#@escaped'),
+            (T.OP_COMMAND, 6, 'endif', ''),
+            (T.OP_TEXT, 7, 8),
+        ], list(template.ops))
+        # Rules are parsed at compile time
+        self.assertTrue(template.ops[1][3].test(['blah']))
+
+    def test_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        store = cache.DiskCache(os.path.join(tmpdir, 'templates'))
+        lines = ['foo', '#@if blah', 'bar', '#@endif']
+
+        compiled = []
+
+        def compiler(lines):
+            compiled.append(lines)
+            return self.compile(lines)
+
+        template = converter.TemplateCache(store).get(lines, compiler)
+        self.assertEqual(1, len(compiled))
+
+        # A fresh in-memory cache reuses the stored template
+        other = converter.TemplateCache(store).get(lines, compiler)
+        self.assertEqual(1, len(compiled))
+        self.assertEqual(template.lines, other.lines)
+        self.assertEqual(len(template.ops), len(other.ops))
+
+        # Changing the source invalidates the cache
+        converter.TemplateCache(store).get(lines + ['baz'], compiler)
+        self.assertEqual(2, len(compiled))
+
+    def test_memory_bounded(self):
+        template_cache = converter.TemplateCache(memory_size=2)
+        for i in range(5):
+            template_cache.get(['foo%d' % i], self.compile)
+        self.assertEqual(2, len(template_cache.templates))
+        self.assertIn(cache.hash_lines(['foo4']), template_cache.templates)
+
+    def test_cache_eviction(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        store = cache.DiskCache(os.path.join(tmpdir, 'templates'))
+        sources = [['foo%d' % i] for i in range(4)]
+
+        template_cache = converter.TemplateCache(store, max_entries=2)
+        for i, lines in enumerate(sources[:3]):
+            template_cache.get(lines, self.compile)
+            os.utime(store.get_path(cache.hash_lines(lines)), (i, i))
+
+        # Reading an entry marks it as recently used.
+        converter.TemplateCache(store, max_entries=2).get(sources[0], self.compile)
+        converter.TemplateCache(store, max_entries=2).get(sources[3], self.compile)
+        kept = [lines for lines in sources if store.get(cache.hash_lines(lines)) is not None]
+        self.assertEqual([sources[0], sources[3]], kept)
 
 
 if __name__ == '__main__':
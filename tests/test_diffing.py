@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2013 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+import random
+import unittest
+from unittest import mock
+
+from uconf import converter
+from uconf import diffing
+
+
+def lcs_length(a, b):
+    lengths = [[0] * (len(b) + 1) for _i in range(len(a) + 1)]
+    for i in range(len(a) - 1, -1, -1):
+        for j in range(len(b) - 1, -1, -1):
+            if a[i] == b[j]:
+                lengths[i][j] = lengths[i + 1][j + 1] + 1
+            else:
+                lengths[i][j] = max(lengths[i + 1][j], lengths[i][j + 1])
+    return lengths[0][0]
+
+
+class OpcodesTestCase(unittest.TestCase):
+    def apply(self, original, modified, opcodes):
+        """Check that opcodes are contiguous, and rebuild the modified list."""
+        result = []
+        i = j = 0
+        for tag, i1, i2, j1, j2 in opcodes:
+            self.assertEqual((i, j), (i1, j1))
+            if tag == 'equal':
+                self.assertEqual(original[i1:i2], modified[j1:j2])
+            i, j = i2, j2
+            result.extend(modified[j1:j2])
+        self.assertEqual((len(original), len(modified)), (i, j))
+        return result
+
+    def test_empty(self):
+        for algorithm in diffing.ALGORITHMS:
+            self.assertEqual([], diffing.get_opcodes([], [], algorithm))
+            self.assertEqual([('insert', 0, 0, 0, 1)], diffing.get_opcodes([], ['a'], algorithm))
+            self.assertEqual([('delete', 0, 1, 0, 0)], diffing.get_opcodes(['a'], [], algorithm))
+
+    def test_simple(self):
+        original = ['a', 'b', 'c', 'd']
+        modified = ['a', 'x', 'c', 'd', 'e']
+        for algorithm in diffing.ALGORITHMS:
+            self.assertEqual(
+                [
+                    ('equal', 0, 1, 0, 1),
+                    ('replace', 1, 2, 1, 2),
+                    ('equal', 2, 4, 2, 4),
+                    ('insert', 4, 4, 4, 5),
+                ],
+                diffing.get_opcodes(original, modified, algorithm),
+            )
+
+    def test_random(self):
+        rnd = random.Random(42)
+        for _i in range(500):
+            original = [rnd.choice('abcde') for _j in range(rnd.randint(0, 20))]
+            modified = [rnd.choice('abcde') for _j in range(rnd.randint(0, 20))]
+            for algorithm in diffing.ALGORITHMS:
+                opcodes = diffing.get_opcodes(original, modified, algorithm)
+                self.assertEqual(modified, self.apply(original, modified, opcodes))
+
+            # Myers finds a minimal diff
+            blocks = diffing.get_matching_blocks(original, modified, diffing.MYERS)
+            self.assertEqual(lcs_length(original, modified), sum(size for _i, _j, size in blocks))
+
+    def test_patience_anchors(self):
+        # Unique lines are matched first, even at the cost of a longer diff
+        original = ['foo', '}', '}', '}']
+        modified = ['}', '}', '}', 'foo']
+        self.assertEqual([(0, 3, 1)], diffing.get_matching_blocks(original, modified, diffing.PATIENCE))
+        self.assertEqual([(1, 0, 3)], diffing.get_matching_blocks(original, modified, diffing.MYERS))
+
+    def test_repetitive(self):
+        original = ['allow %d' % (i % 7) for i in range(5000)]
+        modified = original[:2500] + ['allow new'] + original[2500:]
+        for algorithm in (diffing.MYERS, diffing.PATIENCE):
+            self.assertEqual(
+                [
+                    ('equal', 0, 2500, 0, 2500),
+                    ('insert', 2500, 2500, 2500, 2501),
+                    ('equal', 2500, 5000, 2501, 5001),
+                ],
+                diffing.get_opcodes(original, modified, algorithm),
+            )
+
+    def test_unrelated(self):
+        original = ['a%d' % i for i in range(1000)]
+        modified = ['b%d' % i for i in range(1000)]
+        with mock.patch.object(diffing, '_bisect', side_effect=AssertionError("Searched")):
+            for algorithm in (diffing.MYERS, diffing.PATIENCE):
+                self.assertEqual([('replace', 0, 1000, 0, 1000)], diffing.get_opcodes(original, modified, algorithm))
+
+    def test_budget(self):
+        # Out of budget, only unique lines are matched.
+        rnd = random.Random(42)
+        original = [rnd.choice('abc') for _i in range(200)] + ['unique'] + [rnd.choice('abc') for _i in range(200)]
+        modified = [rnd.choice('abc') for _i in range(200)] + ['unique'] + [rnd.choice('abc') for _i in range(200)]
+        with mock.patch.object(diffing, 'MIN_BUDGET', 0), mock.patch.object(diffing, 'COST_PER_LINE', 0):
+            for algorithm in (diffing.MYERS, diffing.PATIENCE):
+                opcodes = diffing.get_opcodes(original, modified, algorithm)
+                self.assertEqual(modified, self.apply(original, modified, opcodes))
+                self.assertIn(('equal', 200, 201, 200, 201), opcodes)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, diffing.get_opcodes, [], [], 'foo')
+        self.assertRaises(ValueError, converter.Differ, [], [], 'foo')
+
+
+class DifferTestCase(unittest.TestCase):
+    def test_atomic(self):
+        original = ['a', 'b', 'c', 'd']
+        modified = ['a', 'x', 'y', 'c']
+        for algorithm in diffing.ALGORITHMS:
+            self.assertEqual(
+                [
+                    ('equal', 'a'),
+                    ('replace', 'x'),
+                    ('insert', 'y'),
+                    ('equal', 'c'),
+                    ('delete', 'd'),
+                ],
+                list(converter.Differ(original, modified, algorithm)),
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2013 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+import errno
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+from uconf import fs
+
+
+class FSLoaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.fs = fs.FSLoader(self.tmpdir)
+
+    def test_writelines(self):
+        path = os.path.join(self.tmpdir, 'foo')
+        self.fs.writelines(path, iter(['a', 'b']))
+        with open(path) as f:
+            self.assertEqual('a\nb\n', f.read())
+        self.assertEqual(['foo'], os.listdir(self.tmpdir))
+
+    def test_writelines_keeps_mode(self):
+        path = os.path.join(self.tmpdir, 'foo')
+        with open(path, 'w') as f:
+            f.write('old\n')
+        os.chmod(path, 0o600)
+
+        self.fs.writelines(path, ['new'])
+        with open(path) as f:
+            self.assertEqual('new\n', f.read())
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(path).st_mode))
+
+    def test_writelines_follows_symlinks(self):
+        path = os.path.join(self.tmpdir, 'foo')
+        link = os.path.join(self.tmpdir, 'link')
+        with open(path, 'w') as f:
+            f.write('old\n')
+        os.symlink(path, link)
+
+        self.fs.writelines(link, ['new'])
+        self.assertTrue(os.path.islink(link))
+        with open(path) as f:
+            self.assertEqual('new\n', f.read())
+
+    def test_writelines_failure(self):
+        path = os.path.join(self.tmpdir, 'foo')
+        with open(path, 'w') as f:
+            f.write('old\n')
+
+        def lines():
+            yield 'new'
+            raise ValueError()
+
+        self.assertRaises(ValueError, self.fs.writelines, path, lines())
+        with open(path) as f:
+            self.assertEqual('old\n', f.read())
+        self.assertEqual(['foo'], os.listdir(self.tmpdir))
+
+    def test_read_one_line(self):
+        path = os.path.join(self.tmpdir, 'secret')
+        with open(path, 'w') as f:
+            f.write('foo\nbar\n')
+        self.assertEqual('foo', self.fs.read_one_line(path))
+
+        # Cached while the file is unchanged
+        with mock.patch.object(self.fs.fs, 'read_one_line', side_effect=AssertionError("File read again")):
+            self.assertEqual('foo', self.fs.read_one_line(path))
+
+        with open(path, 'w') as f:
+            f.write('blah\n')
+        self.assertEqual('blah', self.fs.read_one_line(path))
+
+        os.unlink(path)
+        self.assertRaises(OSError, self.fs.read_one_line, path)
+
+
+class OSFileSystemTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.writable = os.path.join(self.tmpdir, 'writable')
+        os.mkdir(self.writable)
+        self.fs = fs.OSFileSystem([self.writable])
+
+    def test_check_writable(self):
+        self.fs.check_writable(self.writable)
+        self.fs.check_writable(os.path.join(self.writable, 'foo', 'bar'))
+        for path in (self.tmpdir, self.writable + 'x', os.path.join(self.writable, '..', 'foo')):
+            with self.assertRaises(OSError) as context:
+                self.fs.check_writable(path)
+            self.assertEqual(errno.EROFS, context.exception.errno)
+
+    def test_read_only(self):
+        path = os.path.join(self.tmpdir, 'foo')
+        with open(path, 'w') as f:
+            f.write('foo\n')
+
+        self.assertTrue(self.fs.file_exists(path))
+        self.assertEqual(['foo'], list(self.fs.readlines(path)))
+        self.assertRaises(OSError, self.fs.writelines, path, ['bar'])
+        self.assertRaises(OSError, self.fs.open, path, 'w')
+        self.assertRaises(OSError, self.fs.remove, path)
+        self.assertRaises(OSError, self.fs.copy, path, os.path.join(self.tmpdir, 'bar'))
+        self.assertEqual(['foo'], list(self.fs.readlines(path)))
+
+    def test_write_through_symlink(self):
+        # Writing to a link within the writable folder updates its target
+        path = os.path.join(self.tmpdir, 'foo')
+        with open(path, 'w') as f:
+            f.write('foo\n')
+        link = os.path.join(self.writable, 'link')
+        os.symlink(path, link)
+
+        self.fs.writelines(link, ['bar'])
+        self.assertEqual(['bar'], list(self.fs.readlines(path)))
+
+    def test_copy(self):
+        source = os.path.join(self.tmpdir, 'foo')
+        with open(source, 'w') as f:
+            f.write('foo\n')
+        os.chmod(source, 0o640)
+
+        destination = os.path.join(self.writable, 'foo')
+        self.fs.copy(source, destination)
+        self.assertEqual(self.fs.get_hash(source).digest(), self.fs.get_hash(destination).digest())
+        self.assertEqual(0o640, stat.S_IMODE(os.stat(destination).st_mode))
+
+    def test_symlinks(self):
+        link = os.path.join(self.writable, 'link')
+        self.fs.create_symlink(link, '/foo')
+        self.assertTrue(self.fs.symlink_exists(link))
+        self.assertEqual('/foo', self.fs.readlink(link))
+
+        self.fs.create_symlink(link, '/bar')
+        self.assertEqual('/bar', self.fs.readlink(link))
+
+        self.fs.remove(link)
+        self.assertFalse(self.fs.symlink_exists(link))
+
+
+class DryRunFileSystemTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.fs = fs.DryRunFileSystem([self.tmpdir])
+        self.existing = os.path.join(self.tmpdir, 'existing')
+        with open(self.existing, 'w') as f:
+            f.write('old\n')
+
+    def test_writelines(self):
+        self.fs.writelines(self.existing, ['new'])
+        path = os.path.join(self.tmpdir, 'foo', 'bar')
+        self.fs.makedirs(os.path.dirname(path))
+        self.fs.writelines(path, ['a', 'b'])
+
+        # Nothing written
+        self.assertEqual(['existing'], os.listdir(self.tmpdir))
+        with open(self.existing) as f:
+            self.assertEqual('old\n', f.read())
+
+        # But visible through the filesystem
+        self.assertTrue(self.fs.file_exists(path))
+        self.assertEqual(4, self.fs.stat(path).st_size)
+        self.assertEqual(
+            self.fs.get_hash(path).hexdigest(),
+            hashlib.md5(b'a\nb\n').hexdigest(),
+        )
+
+        changes = self.fs.get_changes()
+        self.assertEqual(
+            [self.existing, os.path.dirname(path), path],
+            [change.path for change in changes],
+        )
+        update, mkdir, create = changes
+        self.assertEqual(hashlib.md5(b'old\n').hexdigest(), update.old_hash)
+        self.assertEqual(hashlib.md5(b'new\n').hexdigest(), update.new_hash)
+        self.assertEqual(fs.DryRunChange.DIRECTORY, mkdir.kind)
+        self.assertIsNone(create.old_hash)
+        self.assertEqual(4, create.size)
+
+    def test_writelines_failure(self):
+        def lines():
+            yield 'new'
+            raise ValueError()
+
+        self.assertRaises(ValueError, self.fs.writelines, self.existing, lines())
+        self.assertEqual([], self.fs.get_changes())
+
+    def test_read_back(self):
+        self.fs.writelines(self.existing, ['new'])
+        self.assertRaises(OSError, list, self.fs.readlines(self.existing))
+
+        spilling_fs = fs.DryRunFileSystem([self.tmpdir], spill=True)
+        spilling_fs.writelines(self.existing, ['new'])
+        self.assertEqual(['new'], list(spilling_fs.readlines(self.existing)))
+        self.assertEqual(['existing'], os.listdir(self.tmpdir))
+
+    def test_copy_and_rename(self):
+        source = os.path.join(self.tmpdir, 'source')
+        self.fs.writelines(source, ['foo'])
+        self.fs.chmod(source, 0o600)
+        self.fs.copy(source, os.path.join(self.tmpdir, 'copy'))
+        self.fs.rename(self.existing, os.path.join(self.tmpdir, 'moved'))
+        self.fs.remove(source)
+
+        changes = {os.path.basename(change.path): change for change in self.fs.get_changes()}
+        self.assertEqual(['copy', 'existing', 'moved'], sorted(changes))
+        self.assertEqual(hashlib.md5(b'foo\n').hexdigest(), changes['copy'].new_hash)
+        self.assertEqual(0o600, changes['copy'].mode)
+        self.assertEqual(fs.DryRunChange.REMOVED, changes['existing'].kind)
+        self.assertEqual(changes['existing'].old_hash, changes['moved'].new_hash)
+        self.assertFalse(self.fs.file_exists(self.existing))
+        self.assertTrue(os.path.exists(self.existing))
+
+    def test_symlinks(self):
+        link = os.path.join(self.tmpdir, 'link')
+        self.fs.create_symlink(link, self.existing)
+        self.assertTrue(self.fs.symlink_exists(link))
+        self.assertEqual(self.existing, self.fs.readlink(link))
+        self.assertEqual(['old'], list(self.fs.readlines(link)))
+        self.assertFalse(os.path.lexists(link))
+
+    def test_read_only(self):
+        path = os.path.join(tempfile.gettempdir(), 'foo')
+        self.assertRaises(OSError, self.fs.writelines, path, ['bar'])
+
+
+class CopyDataTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.data = os.urandom(300000)
+        self.source = os.path.join(self.tmpdir, 'source')
+        with open(self.source, 'wb') as f:
+            f.write(self.data)
+
+    def copy(self, **kwargs):
+        destination = os.path.join(self.tmpdir, 'destination')
+        with open(self.source, 'rb') as src, open(destination, 'wb') as dst:
+            fs.copy_data(src.fileno(), dst.fileno(), len(self.data), **kwargs)
+        with open(destination, 'rb') as f:
+            self.assertEqual(self.data, f.read())
+
+    def unsupported(self, *args, **kwargs):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    def test_copy(self):
+        self.copy()
+
+    def test_reflink(self):
+        # Falls back to a regular copy on filesystems without reflinks
+        self.copy(reflink=True)
+
+    def test_fallbacks(self):
+        with mock.patch('os.copy_file_range', self.unsupported, create=True):
+            self.copy()
+            with mock.patch('os.sendfile', self.unsupported, create=True):
+                self.copy()
+
+    def test_nothing_copied(self):
+        # Some filesystems report a copy of 0 bytes instead of an error.
+        self.assertFalse(fs._copy_with(lambda count, offset: 0, 10))
+        with mock.patch('os.copy_file_range', return_value=0, create=True):
+            self.copy()
+            with mock.patch('os.sendfile', return_value=0, create=True):
+                self.copy()
+
+    def test_shrunk(self):
+        chunks = iter([4, 0])
+        self.assertTrue(fs._copy_with(lambda count, offset: next(chunks), 10))
+
+    def test_failure(self):
+        def failing(*args, **kwargs):
+            raise OSError(errno.EIO, "I/O error")
+
+        with mock.patch('os.copy_file_range', failing, create=True):
+            self.assertRaises(OSError, self.copy)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2013 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import fslib
+
+from uconf import cache
+from uconf import manifest
+
+
+class BuildStateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.fs = fslib.FileSystem(fslib.OSFS())
+        self.state = manifest.BuildState(cache.DiskCache(os.path.join(self.tmpdir, 'state')))
+
+        self.source = self.write('source', 'foo')
+        self.destination = self.write('destination', 'bar')
+        self.dependency = self.write('dependency', 'baz')
+        self.params = self.state.get_params('parse', {}, ['a', 'b'])
+        self.state.record(self.fs, self.source, self.destination, self.params, [self.dependency])
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def is_fresh(self, params=None):
+        return self.state.is_fresh(self.fs, self.source, self.destination, params or self.params)
+
+    def test_fresh(self):
+        self.assertTrue(self.is_fresh())
+
+    def test_touched(self):
+        os.utime(self.source, ns=(0, 0))
+        self.assertTrue(self.is_fresh())
+
+    def test_changed_params(self):
+        self.assertFalse(self.is_fresh(self.state.get_params('parse', {}, ['a'])))
+        self.assertFalse(self.is_fresh(self.state.get_params('parse', {'dest': 'x'}, ['a', 'b'])))
+
+    def test_changed_files(self):
+        for path in (self.source, self.destination, self.dependency):
+            original = open(path).read()
+            self.write(os.path.basename(path), 'modified')
+            self.assertFalse(self.is_fresh(), path)
+            self.write(os.path.basename(path), original)
+
+    def test_removed_destination(self):
+        os.unlink(self.destination)
+        self.assertFalse(self.is_fresh())
+
+    def test_unknown_destination(self):
+        self.assertFalse(self.state.is_fresh(self.fs, self.source, self.dependency, self.params))
+
+    def test_drift(self):
+        def get_drift():
+            return self.state.get_drift(self.fs, self.source, self.destination, self.params)
+
+        self.assertEqual((False, False), get_drift())
+        self.write('dependency', 'modified')
+        self.assertEqual((True, False), get_drift())
+        self.write('destination', 'modified')
+        self.assertEqual((True, True), get_drift())
+        self.write('dependency', 'baz')
+        self.assertEqual((False, True), get_drift())
+        self.assertIsNone(self.state.get_drift(self.fs, self.source, self.dependency, self.params))
+
+    def test_dependencies(self):
+        self.assertEqual([self.dependency], self.state.get_dependencies(self.destination))
+        self.assertEqual([], self.state.get_dependencies(self.dependency))
+
+    def test_racy(self):
+        # Same size and mtime, but recorded too soon after the write to trust them.
+        stats = os.stat(self.source)
+        self.write('source', 'bar')
+        os.utime(self.source, ns=(stats.st_atime_ns, stats.st_mtime_ns))
+        self.assertFalse(self.is_fresh())
+
+    def test_racy_settled(self):
+        for path in (self.source, self.destination, self.dependency):
+            os.utime(path, (0, 0))
+        self.assertTrue(self.is_fresh())
+        # Old enough: signatures are now trusted.
+        with mock.patch.object(self.fs, 'get_hash', side_effect=AssertionError("File hashed again")):
+            self.assertTrue(self.is_fresh())
+
+    def test_eviction(self):
+        destinations = [self.write('destination%d' % i, 'bar') for i in range(3)]
+        for i, destination in enumerate(destinations):
+            self.state.record(self.fs, self.source, destination, self.params)
+            os.utime(self.state.store.get_path(self.state._get_key(destination)), (i + 1, i + 1))
+
+        # Eviction happens once per run, before recording new entries.
+        state = manifest.BuildState(self.state.store, max_entries=2)
+        state.is_fresh(self.fs, self.source, destinations[0], self.params)
+        state.record(self.fs, self.source, self.destination, self.params)
+        kept = [
+            path for path in destinations + [self.destination]
+            if state.store.get(state._get_key(path)) is not None
+        ]
+        self.assertEqual([destinations[0], self.destination], kept)
+
+    def test_fingerprints(self):
+        # Inputs changed while building: the next build must see the change.
+        fingerprints = {
+            self.source: manifest.Fingerprint.from_file(self.fs, self.source),
+            self.dependency: manifest.Fingerprint.from_file(self.fs, self.dependency),
+        }
+        self.write('dependency', 'modified')
+        self.state.record(
+            self.fs, self.source, self.destination, self.params, [self.dependency], fingerprints=fingerprints)
+        self.assertFalse(self.is_fresh())
+
+
+class DependenciesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.fs = fslib.FileSystem(fslib.OSFS())
+        self.path = os.path.join(self.tmpdir, 'dependency')
+        with open(self.path, 'w') as f:
+            f.write('foo')
+
+    def test_first_add(self):
+        dependencies = manifest.Dependencies(self.fs)
+        dependencies.add(self.path)
+        fingerprint = dependencies.fingerprints[self.path]
+        with open(self.path, 'w') as f:
+            f.write('bar')
+        dependencies.add(self.path)
+        self.assertIs(fingerprint, dependencies.fingerprints[self.path])
+        self.assertEqual([self.path], list(dependencies))
+        self.assertEqual(hashlib.md5(b'foo').hexdigest(), fingerprint.digest)
+
+    def test_no_fs(self):
+        dependencies = manifest.Dependencies()
+        dependencies.update([self.path])
+        self.assertIn(self.path, dependencies)
+        self.assertEqual({}, dependencies.fingerprints)
+
+
+class HashCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.fs = fslib.FileSystem(fslib.OSFS())
+        self.store = cache.DiskCache(os.path.join(self.tmpdir, 'hashes'))
+        self.path = self.write('blob', 'foo')
+
+    def write(self, name, content, age=10):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        # Old enough not to be racy
+        mtime = os.stat(path).st_mtime - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_cached(self):
+        hash_cache = manifest.HashCache(self.store)
+        self.assertEqual(hashlib.md5(b'foo').hexdigest(), hash_cache.get_hexdigest(self.fs, self.path))
+
+        # Not hashed again, even by another instance
+        hash_cache = manifest.HashCache(self.store)
+        with mock.patch.object(self.fs, 'get_hash', side_effect=AssertionError("File hashed again")):
+            self.assertEqual(hashlib.md5(b'foo').hexdigest(), hash_cache.get_hexdigest(self.fs, self.path))
+
+    def test_modified(self):
+        hash_cache = manifest.HashCache(self.store)
+        hash_cache.get_hexdigest(self.fs, self.path)
+        self.write('blob', 'bar', age=20)
+        self.assertEqual(hashlib.md5(b'bar').hexdigest(), hash_cache.get_hexdigest(self.fs, self.path))
+
+    def test_racy(self):
+        hash_cache = manifest.HashCache(self.store)
+        path = self.write('new', 'foo', age=0)
+        hash_cache.get_hexdigest(self.fs, path)
+        self.assertEqual(None, self.store.get(hash_cache._get_key(path)))
+
+    def test_algorithm(self):
+        hash_cache = manifest.HashCache(self.store, algorithm='blake2b')
+        self.assertEqual(hashlib.blake2b(b'foo').hexdigest(), hash_cache.get_hexdigest(self.fs, self.path))
+        self.assertRaises(ValueError, manifest.HashCache, self.store, algorithm='foo')
+
+    def test_no_store(self):
+        hash_cache = manifest.HashCache()
+        self.assertEqual(hashlib.md5(b'foo').hexdigest(), hash_cache.get_hexdigest(self.fs, self.path))
+
+    def test_eviction(self):
+        hash_cache = manifest.HashCache(self.store, max_entries=2)
+        paths = [self.write('file%d' % i, 'foo%d' % i) for i in range(4)]
+        for i, path in enumerate(paths[:3]):
+            hash_cache.get_hexdigest(self.fs, path)
+            entry_path = self.store.get_path(hash_cache._get_key(path))
+            os.utime(entry_path, (i, i))
+
+        # Eviction happens once per run, before adding new entries.
+        hash_cache = manifest.HashCache(self.store, max_entries=2)
+        hash_cache.get_hexdigest(self.fs, paths[3])
+        kept = [path for path in paths if self.store.get(hash_cache._get_key(path)) is not None]
+        self.assertEqual(paths[2:], kept)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,8 @@
 # Copyright (c) 2010-2013 Raphaël Barrois
 # This software is distributed under the two-clause BSD license.
 
+import itertools
+import pickle
 import re
 import unittest
 
@@ -37,6 +39,118 @@ class RuleLexerTestCase(unittest.TestCase):
             rule = self.rule_lexer.get_rule(rule_text)
             self.assertEqual(expected_node, rule.node)
 
+    def test_compiled(self):
+        rules = (
+            'a',
+            'a b c',
+            'a && b',
+            'a || b',
+            '!a',
+            '!(a || b)',
+            'a || (b && !c)',
+            '(a && b) || (!b && c)',
+            'a && !b && !(c || a)',
+        )
+        all_categories = [
+            frozenset(categories)
+            for size in range(4)
+            for categories in itertools.combinations('abc', size)
+        ]
+
+        universe = rule_parser.CategoryUniverse(['c', 'x'])
+
+        for rule_text in rules:
+            rule = self.rule_lexer.get_rule(rule_text)
+            for categories in all_categories:
+                expected = rule.node.eval(categories)
+                self.assertEqual(
+                    expected, rule.test(categories),
+                    "Mismatch for %r on %r" % (rule_text, sorted(categories)),
+                )
+                self.assertEqual(
+                    expected, rule.test_mask(universe.mask(categories), universe),
+                    "Mask mismatch for %r on %r" % (rule_text, sorted(categories)),
+                )
+
+    def test_implicit_or(self):
+        a, b, c = (rule_parser._TextNode(name) for name in 'abc')
+        rules = (
+            ('a b c', rule_parser._OrNode([a, b, c])),
+            ('a && b c', rule_parser._AndNode([a, rule_parser._OrNode([b, c])])),
+            ('!a b', rule_parser._OrNode([rule_parser._NegateNode(a), b])),
+            ('(a b) && c', rule_parser._AndNode([rule_parser._OrNode([a, b]), c])),
+        )
+
+        for rule_text, expected_node in rules:
+            rule = self.rule_lexer.get_rule(rule_text)
+            self.assertEqual(expected_node, rule.node, rule_text)
+
+    def test_invalid(self):
+        rules = (
+            ('', 0),
+            ('a &&', 4),
+            ('(a', 2),
+            ('a )', 2),
+            ('a !b', 2),
+            ('a & b', 2),
+            ('a || é', 5),
+        )
+
+        for rule_text, position in rules:
+            with self.assertRaises(rule_parser.RuleSyntaxError, msg=rule_text) as cm:
+                self.rule_lexer.get_rule(rule_text)
+            self.assertEqual(position, cm.exception.position, rule_text)
+
+    def test_interned(self):
+        rule = self.rule_lexer.get_rule('a && !b')
+        self.assertIs(rule, rule_parser.RuleLexer().get_rule('a && !b'))
+        self.assertIsNot(rule, self.rule_lexer.get_rule('a&&!b'))
+
+    def test_lazy_compile(self):
+        # Not interned: the rule must not have been evaluated yet.
+        rule = rule_parser.Rule('a && !(b || c)', self.rule_lexer.parse('a && !(b || c)'))
+        universe = rule_parser.CategoryUniverse(['a', 'b'])
+        for i in range(rule.COMPILE_THRESHOLD // 2):
+            self.assertTrue(rule.test(frozenset(['a'])))
+            self.assertTrue(rule.test_mask(universe.mask(['a']), universe))
+        # Categories are only allocated a bit when compiling.
+        self.assertEqual(2, len(universe))
+        self.assertIsNone(rule._test)
+        self.assertIsNone(rule._mask_test)
+
+        self.assertFalse(rule.test(frozenset(['a', 'c'])))
+        self.assertFalse(rule.test_mask(universe.mask(['a', 'b']), universe))
+        self.assertIsNotNone(rule._test)
+        self.assertIsNotNone(rule._mask_test)
+        self.assertFalse(rule.test_mask(universe.mask(['a', 'c']), universe))
+
+    def test_pickle(self):
+        rule = self.rule_lexer.get_rule('a && !b')
+        self.assertTrue(rule.test(frozenset(['a'])))
+        unpickled = pickle.loads(pickle.dumps(rule))
+        self.assertEqual(rule, unpickled)
+        self.assertTrue(unpickled.test(frozenset(['a'])))
+        self.assertFalse(unpickled.test(frozenset(['a', 'b'])))
+
+
+class CategoryUniverseTestCase(unittest.TestCase):
+    def test_intern(self):
+        universe = rule_parser.CategoryUniverse(['a', 'b'])
+        self.assertEqual(2, len(universe))
+        self.assertEqual(1, universe.intern('a'))
+        self.assertEqual(2, universe.intern('b'))
+        self.assertEqual(4, universe.intern('c'))
+        self.assertEqual(4, universe.intern('c'))
+        self.assertEqual(3, len(universe))
+
+    def test_mask(self):
+        universe = rule_parser.CategoryUniverse()
+        mask = universe.mask(['a', 'c'])
+        self.assertEqual(0, universe.mask([]))
+        self.assertEqual(mask, universe.mask(['c', 'a', 'c']))
+        self.assertEqual(frozenset(['a', 'c']), universe.unmask(mask))
+        self.assertEqual(frozenset(), universe.unmask(0))
+
 
 class ActionLexerTestCase(unittest.TestCase):
     def setUp(self):
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2013 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from uconf import config
+from uconf import porcelain
+
+
+class FakeEnv:
+    def __init__(self, **options):
+        self.options = options
+
+    def get(self, key, default=None):
+        return self.options.get(key, default)
+
+
+class FakePorcelain:
+    logger = logging.getLogger('tests.porcelain')
+
+    def __init__(self, env):
+        self.env = env
+
+    def handle(self, filename):
+        if filename == 'crash':
+            self.logger.info("Crashing on %s", filename)
+            raise RuntimeError("Unexpected")
+        if filename.startswith('bad'):
+            raise porcelain.PorcelainError("Invalid file %s" % filename)
+        self.logger.info("Handled %s", filename)
+
+
+class FileRunnerTestCase(unittest.TestCase):
+    filenames = ['a', 'b', 'bad1', 'c', 'd', 'bad2', 'e']
+    expected = [
+        'Handled a',
+        'Handled b',
+        "Error while handling bad1: PorcelainError()",
+        'Handled c',
+        'Handled d',
+        "Error while handling bad2: PorcelainError()",
+        'Handled e',
+    ]
+
+    def run_files(self, jobs, **options):
+        p = FakePorcelain(FakeEnv(**options))
+        runner = porcelain.FileRunner(p, jobs=jobs, logger=logging.getLogger('tests.runner'))
+        with self.assertLogs('tests', level='INFO') as logs:
+            runner.run(self.filenames)
+        return [record.getMessage() for record in logs.records]
+
+    def test_sequential(self):
+        self.assertEqual(self.expected, self.run_files(jobs=1))
+
+    def test_parallel(self):
+        self.assertEqual(self.expected, self.run_files(jobs=3))
+
+    def test_parallel_dry_run(self):
+        self.assertEqual(self.expected, self.run_files(jobs=3, dry_run=True))
+
+    def test_parallel_crash(self):
+        runner = porcelain.FileRunner(FakePorcelain(FakeEnv()), jobs=2, logger=logging.getLogger('tests.runner'))
+        with self.assertLogs('tests', level='INFO') as logs:
+            with self.assertRaises(porcelain.WorkerError) as context:
+                runner.run(['a', 'b', 'crash', 'c'])
+
+        # Records are kept up to the failing file, included.
+        self.assertEqual(
+            ['Handled a', 'Handled b', 'Crashing on crash'],
+            [record.getMessage() for record in logs.records])
+        self.assertEqual('crash', context.exception.filename)
+        self.assertIn("RuntimeError: Unexpected", context.exception.formatted)
+
+
+
+class MakeFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.root = os.path.join(self.tmpdir, 'repo')
+        self.target = os.path.join(self.tmpdir, 'target')
+        os.makedirs(os.path.join(self.root, '.uconf'))
+        os.makedirs(self.target)
+        with open(os.path.join(self.root, '.uconf', 'config'), 'w') as f:
+            f.write("[files]\nfoo = a\n")
+        with open(os.path.join(self.root, 'a'), 'w') as f:
+            f.write("#@if foo\na\n#@endif\n")
+
+    def make(self, **extra):
+        extra.update(target=self.target)
+        env = config.Env.from_files(repo_root=self.root, config_files=(), extra=extra)
+        p = porcelain.MakeFile(env, env.get_active_repository(['foo']))
+        with self.assertLogs(porcelain.__name__, level='INFO'):
+            p.handle('a')
+
+    def test_dry_run_hash_algorithm(self):
+        self.make(dry_run=True, hash_algorithm='sha256')
+        self.assertEqual([], os.listdir(self.target))
+        self.assertFalse(os.path.exists(os.path.join(self.root, '.uconf', 'state')))
+
+        # Built files are recorded with the configured digest.
+        self.make(hash_algorithm='sha256')
+        self.make(dry_run=True, hash_algorithm='sha256')
+        with open(os.path.join(self.target, 'a')) as f:
+            self.assertEqual("a\n", f.read())
+
+
+class WatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.root = os.path.join(self.tmpdir, 'repo')
+        self.target = os.path.join(self.tmpdir, 'target')
+        self.dependency = os.path.join(self.tmpdir, 'dependency')
+        os.makedirs(os.path.join(self.root, '.uconf'))
+
+        self.write('.uconf/config', "[files]\nfoo = a b\n")
+        self.write('a', "a\n")
+        self.write('b', "#@withfile x=%s\nb=@@x@@\n#@endwith\n" % self.dependency)
+        with open(self.dependency, 'w') as f:
+            f.write("1\n")
+
+        env = config.Env.from_files(repo_root=self.root, config_files=(), extra={'target': self.target})
+        try:
+            self.watcher = porcelain.Watcher(env, ['foo'], delay=0.05)
+        except OSError as e:
+            self.skipTest("inotify is not available: %s" % e)
+        self.addCleanup(self.watcher.close)
+        with self.assertLogs(porcelain.__name__, level='INFO'):
+            self.watcher.load()
+
+    def write(self, name, content):
+        with open(os.path.join(self.root, name), 'w') as f:
+            f.write(content)
+
+    def read(self, name):
+        with open(os.path.join(self.target, name)) as f:
+            return f.read()
+
+    def poll(self):
+        with self.assertLogs(porcelain.__name__, level='INFO') as logs:
+            self.assertTrue(self.watcher.poll(timeout=5))
+        return [record.getMessage() for record in logs.records]
+
+    def test_inputs(self):
+        self.assertEqual(['b=1\n'], [self.read('b')])
+        self.assertEqual({self.dependency, os.path.join(self.root, 'b')}, self.watcher.inputs['b'])
+        self.assertEqual(['b'], self.watcher.get_affected({self.dependency}))
+        self.assertEqual(['a', 'b'], sorted(self.watcher.get_affected({self.root})))
+
+    def test_source_changed(self):
+        self.write('a', "a2\n")
+        self.assertEqual(["Building file a (FileProcessingAction)"], self.poll())
+        self.assertEqual("a2\n", self.read('a'))
+
+    def test_dependency_changed(self):
+        with open(self.dependency, 'w') as f:
+            f.write("2\n")
+        self.assertEqual(["Building file b (FileProcessingAction)"], self.poll())
+        self.assertEqual("b=2\n", self.read('b'))
+
+    def test_config_changed(self):
+        self.write('c', "c\n")
+        self.write('.uconf/config', "[files]\nfoo = a c\n")
+        self.assertIn("Building file c (FileProcessingAction)", self.poll())
+        self.assertEqual("c\n", self.read('c'))
+        self.assertEqual(['a', 'c'], sorted(self.watcher.inputs))
+
+    def test_timeout(self):
+        self.assertFalse(self.watcher.poll(timeout=0.01))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,10 +7,17 @@ from __future__ import absolute_import, unicode_literals
 """Common action code."""
 
 import functools
+import logging
 import os.path
 
+from . import constants
 from . import converter
+from . import diffing
 from . import fs
+from . import manifest
+
+
+logger = logging.getLogger(__name__)
 
 
 def catch_fs_exceptions(fun):
@@ -32,6 +39,7 @@ class BaseAction:
         self.source = source
         self.destination = destination
         self.env = env
+        self.options = kwargs
         self.fs = None
 
     @catch_fs_exceptions
@@ -72,6 +80,26 @@ class BaseAction:
     def _backdiff(self, categories):
         raise NotImplementedError()
 
+    @catch_fs_exceptions
+    def status(self, categories):
+        """Check whether the destination matches the source, as cheaply as possible.
+
+        Returns:
+            str: a status from constants: UP_TO_DATE, MODIFIED_SOURCE,
+                MODIFIED_DESTINATION, MODIFIED or MISSING
+        """
+        self.fs = self.env.get_forward_fs()
+        if not self.fs.access(self.destination, read=False, follow=False):
+            return constants.MISSING
+        return self._status(categories)
+
+    def _status(self, categories):
+        planned, actual = self._diff(categories)
+        return constants.UP_TO_DATE if planned == actual else constants.MODIFIED
+
+    def _get_hexdigest(self, path):
+        return self.env.get_hash_cache().get_hexdigest(self.fs, path)
+
     def _ensure_dir_exists(self, path):
         dirname = os.path.dirname(path)
         self.fs.makedirs(dirname)
@@ -81,12 +109,25 @@ class BaseAction:
 
 
 class CopyAction(BaseAction):
+    def _is_identical(self, source, destination):
+        """Whether a regular destination file already has the source's content."""
+        if self.fs.symlink_exists(destination) or not self.fs.file_exists(destination):
+            return False
+        if self.fs.stat(source).st_size != self.fs.stat(destination).st_size:
+            return False
+        return self._get_hexdigest(source) == self._get_hexdigest(destination)
+
     def _copy_or_symlink(self, source, destination):
         if self.fs.symlink_exists(source):
             target = self.fs.readlink(source)
             self.fs.symlink(destination, target)
+        elif self._is_identical(source, destination):
+            logger.info("File %s is up to date", destination)
+            source_mode = self.fs.stat(source).st_mode
+            if self.fs.stat(destination).st_mode != source_mode:
+                self.fs.chmod(destination, source_mode)
         else:
-            self.fs.copy(source, destination)
+            self.fs.copy(source, destination, reflink=self.env.getbool('reflink'))
 
     def _forward(self, categories):
         self._copy_or_symlink(self.source, self.destination)
@@ -95,9 +136,9 @@ class CopyAction(BaseAction):
         self._copy_or_symlink(self.destination, self.source)
 
     def _diff(self, categories):
-        source_hash = self.fs.get_hash(self.source).hexdigest()
+        source_hash = self._get_hexdigest(self.source)
         if self.fs.file_exists(self.destination):
-            dest_hash = self.fs.get_hash(self.destination).hexdigest()
+            dest_hash = self._get_hexdigest(self.destination)
         else:
             dest_hash = '!' * len(source_hash)
         return [source_hash], [dest_hash]
@@ -107,6 +148,16 @@ class CopyAction(BaseAction):
         # Simply reverse the diff
         return dest, source
 
+    def _status(self, categories):
+        if self.fs.symlink_exists(self.source):
+            same = (
+                self.fs.symlink_exists(self.destination)
+                and self.fs.readlink(self.destination) == self.fs.readlink(self.source)
+            )
+        else:
+            same = self._is_identical(self.source, self.destination)
+        return constants.UP_TO_DATE if same else constants.MODIFIED
+
 
 class SymLinkAction(BaseAction):
     def _forward(self, categories):
@@ -124,7 +175,7 @@ class SymLinkAction(BaseAction):
         if self.fs.symlink_exists(self.destination):
             target = 'link: ' + self.fs.readlink(self.destination)
         elif self.fs.file_exists(self.destination):
-            target = 'reg: ' + self.fs.get_hash(self.destination).hexdigest()
+            target = 'reg: ' + self._get_hexdigest(self.destination)
         else:
             target = '<none>'
         return ['link: ' + self.source], [target]
@@ -133,22 +184,72 @@ class SymLinkAction(BaseAction):
         source, dest = self._diff(categories)
         return dest, source
 
+    def _status(self, categories):
+        if self.fs.symlink_exists(self.destination) and self.fs.readlink(self.destination) == self.source:
+            return constants.UP_TO_DATE
+        return constants.MODIFIED_DESTINATION
+
 
 class FileContentAction(BaseAction):
-    """An action based on file *contents*."""
+    """An action based on file *contents*.
+
+    Attributes:
+        dependencies (manifest.Dependencies): other files read when converting the source
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dependencies = manifest.Dependencies()
+
+    # Sources larger than this (in bytes) are streamed by default.
+    DEFAULT_STREAM_THRESHOLD = 16 * 1024 * 1024
+
+    def _should_stream(self, path):
+        """Whether a source file is large enough to be processed as a stream."""
+        threshold = self.env.getint('stream_threshold', self.DEFAULT_STREAM_THRESHOLD)
+        return self.fs.file_exists(path) and self.fs.stat(path).st_size >= threshold
 
     def _forward(self, categories):
+        build_state = self.env.get_build_state()
+        params = None
+        if build_state is not None:
+            params = build_state.get_params(self.__class__.__name__, self.options, categories)
+            if build_state.is_fresh(self.fs, self.source, self.destination, params):
+                logger.info("File %s is up to date", self.destination)
+                self.dependencies.update(build_state.get_dependencies(self.destination))
+                return
+            if not build_state.read_only:
+                self._track_inputs(build_state)
+
         source_lines = self._readlines(self.source)
-        destination_lines = self.forward_content(source_lines, categories)
+        destination_lines = self.forward_content(
+            source_lines, categories, streaming=self._should_stream(self.source))
 
         self.fs.writelines(self.destination, destination_lines)
 
-    def forward_content(self, source_lines, categories):
+        # Dry-runs don't keep records.
+        if build_state is not None and not build_state.read_only:
+            self._record(build_state, params)
+
+    def _track_inputs(self, build_state):
+        """Fingerprint the source, and dependencies as they get read."""
+        self.dependencies = manifest.Dependencies(self.fs, method=build_state.method)
+        self.source_fingerprint = manifest.Fingerprint.from_file(
+            self.fs, self.source, method=build_state.method)
+
+    def _record(self, build_state, params):
+        fingerprints = dict(self.dependencies.fingerprints)
+        fingerprints[self.source] = self.source_fingerprint
+        build_state.record(
+            self.fs, self.source, self.destination, params, self.dependencies, fingerprints=fingerprints)
+
+    def forward_content(self, source_lines, categories, streaming=False):
         """Convert the source file, based on its lines.
 
         Args:
             source_lines (str list): lines of the original file
             categories (str list): active categories
+            streaming (bool): whether source_lines should be consumed lazily
 
         Yields:
             str: lines of the destination file
@@ -195,13 +296,55 @@ class FileContentAction(BaseAction):
 
         return list(backported_lines), source_lines
 
+    def _status(self, categories):
+        drift = None
+        build_state = self.env.get_build_state()
+        if build_state is not None:
+            params = build_state.get_params(self.__class__.__name__, self.options, categories)
+            drift = build_state.get_drift(self.fs, self.source, self.destination, params)
+            if drift == (False, False):
+                return constants.UP_TO_DATE
+            elif drift == (False, True):
+                return constants.MODIFIED_DESTINATION
+            if not build_state.read_only:
+                self._track_inputs(build_state)
+
+        # Inputs changed, or no record: compare with a fresh rendering.
+        source_lines = self._readlines(self.source)
+        planned_lines = self.forward_content(
+            source_lines, categories, streaming=self._should_stream(self.source))
+        hash_cache = self.env.get_hash_cache()
+        planned_hash = hash_cache.method()
+        for line in planned_lines:
+            planned_hash.update(('%s\n' % line).encode(self.fs.default_encoding))
+        if planned_hash.hexdigest() == self._get_hexdigest(self.destination):
+            if build_state is not None and not build_state.read_only:
+                # Next checks only need to look at stat metadata.
+                self._record(build_state, params)
+            return constants.UP_TO_DATE
+        elif drift == (True, False):
+            return constants.MODIFIED_SOURCE
+        return constants.MODIFIED
+
 
 class FileProcessingAction(FileContentAction):
     """Process a file, using usual rules."""
-    def forward_content(self, source_lines, categories):
-        processor = converter.FileProcessor(source_lines, self.fs)
+    def _get_processor(self, source_lines, streaming=False):
+        return converter.FileProcessor(
+            source_lines,
+            self.fs,
+            template_cache=self.env.get_template_cache(),
+            dependencies=self.dependencies,
+            universe=self.env.repository.universe,
+            streaming=streaming,
+            diff_algorithm=self.env.get('diff_algorithm', diffing.DEFAULT_ALGORITHM),
+            strict=self.env.getbool('strict'),
+        )
+
+    def forward_content(self, source_lines, categories, streaming=False):
+        processor = self._get_processor(source_lines, streaming=streaming)
         return processor.forward(categories)
 
     def backward_content(self, source_lines, categories, modified_lines):
-        processor = converter.FileProcessor(source_lines, self.fs)
+        processor = self._get_processor(source_lines)
         return processor.backward(categories, modified_lines)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2013 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+"""Persistent caches, stored in the repository's private folder."""
+
+import hashlib
+import logging
+import os
+import pickle
+
+from . import __version__
+from . import helpers
+
+# Only needed when writing entries
+tempfile = helpers.lazy_import('tempfile')
+
+
+logger = logging.getLogger(__name__)
+
+
+def hash_lines(lines):
+    """Compute a stable hash for a list of lines."""
+    content_hash = hashlib.sha1()
+    for line in lines:
+        content_hash.update(line.encode('utf-8', 'surrogateescape'))
+        content_hash.update(b'\n')
+    return content_hash.hexdigest()
+
+
+class DiskCache:
+    """A pickle-based key/value store, one file per key.
+
+    Entries written by another uconf version are ignored.
+
+    Attributes:
+        root (str): the folder holding cache entries
+        read_only (bool): whether new entries should be discarded
+    """
+
+    def __init__(self, root, read_only=False):
+        self.root = root
+        self.read_only = read_only
+
+    def __repr__(self):
+        return '<DiskCache: %s>' % self.root
+
+    def get_path(self, key):
+        return os.path.join(self.root, '%s.pickle' % key)
+
+    def get(self, key, default=None):
+        try:
+            with open(self.get_path(key), 'rb') as f:
+                version, value = pickle.load(f)
+        except FileNotFoundError:
+            return default
+        except Exception as e:
+            # Corrupted or unreadable entry: behave as a cache miss.
+            logger.debug("Unable to load cache entry %s from %r: %r", key, self, e)
+            return default
+
+        if version != __version__:
+            return default
+        return value
+
+    def set(self, key, value):
+        if self.read_only:
+            return
+
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.root, prefix='.%s-' % key)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump((__version__, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_path, self.get_path(key))
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except Exception as e:
+            # A cache is an optimization; never fail because of it (e.g. values
+            # which can't be pickled raise TypeError or AttributeError).
+            logger.debug("Unable to store cache entry %s into %r: %r", key, self, e)
+
+    def touch(self, key):
+        """Mark an entry as recently used."""
+        if self.read_only:
+            return
+        try:
+            os.utime(self.get_path(key))
+        except OSError:
+            pass
+
+    def evict(self, max_entries):
+        """Remove the least recently used entries, keeping at most max_entries."""
+        if self.read_only:
+            return
+        try:
+            with os.scandir(self.root) as entries:
+                paths = [
+                    (entry.stat().st_mtime_ns, entry.path)
+                    for entry in entries
+                    if entry.name.endswith('.pickle')
+                ]
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.debug("Unable to list cache entries from %r: %r", self, e)
+            return
+
+        if len(paths) <= max_entries:
+            return
+        paths.sort()
+        for _mtime, path in paths[:len(paths) - max_entries]:
+            try:
+                os.unlink(path)
+            except OSError:
+                # Already removed by a concurrent run
+                pass
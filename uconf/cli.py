@@ -30,6 +30,8 @@ from . import __version__
 
 Default = confutils.Default
 
+logger = logging.getLogger(__name__)
+
 
 class CLI:
     """Command-line interface.
@@ -38,12 +40,15 @@ class CLI:
         progname (str): name to use to refer to the program
         parser (argparse.ArgumentParser): list of available CLI args & options
         subparsers (argparse.SubParser): handles action-specific subparsers
+        pending_commands (str => (argparse.ArgumentParser, type) dict):
+            subparsers whose options haven't been registered yet, by name
     """
 
     def __init__(self, progname):
         self.progname = progname
         self.parser = self.make_base_parser(self.progname)
         self.subparsers = self.parser.add_subparsers(help="Commands", dest='subcommand')
+        self.pending_commands = {}
 
         self.register_base_commands()
 
@@ -90,21 +95,36 @@ class CLI:
     # --------------------
 
     def register_command(self, command_class):
-        """Register a new command from its class."""
-        cmd_parser = self.subparsers.add_parser(
-            command_class.get_name(),
-            help=command_class.get_help(),
-        )
+        """Register a new command from its class.
+
+        Its options are only added once it gets selected, see prepare_command().
+        """
+        name = command_class.get_name()
+        cmd_parser = self.subparsers.add_parser(name, help=command_class.get_help())
+        cmd_parser.set_defaults(command=command_class)
+        self.pending_commands[name] = (cmd_parser, command_class)
 
+    def prepare_command(self, name):
+        """Register global and command-specific options for a command."""
+        if name not in self.pending_commands:
+            return
+        cmd_parser, command_class = self.pending_commands.pop(name)
         self.register_options(cmd_parser)
         command_class.register_options(cmd_parser)
-        cmd_parser.set_defaults(command=command_class)
 
     def register_base_commands(self):
         """Register all known, base commands."""
         for command_class in commands.base_commands:
             self.register_command(command_class)
 
+    def parse_args(self, argv):
+        """Parse command-line arguments, preparing only the selected command."""
+        for arg in argv:
+            if not arg.startswith('-'):
+                self.prepare_command(arg)
+                break
+        return self.parser.parse_args(argv)
+
     # Reading configuration
     # ----------------------
 
@@ -140,7 +160,7 @@ class CLI:
         """Actually run the requested command from the argv."""
         self.setup_logging()
         # Add command-specific arguments
-        args = self.parser.parse_args(argv)
+        args = self.parse_args(argv)
         command_name = args.subcommand
         if command_name is None:
             self.parser.print_help()
@@ -152,7 +172,18 @@ class CLI:
 
         # Build and run the command
         cmd = command_class(env, self.parser)
-        return cmd.run()
+        result = cmd.run()
+
+        if env.get('dry_run', False):
+            self.report_dry_run(env)
+        return result
+
+    def report_dry_run(self, env):
+        """Log the changes a dry-run would have made."""
+        changes = env.get_dry_run_changes()
+        for change in changes:
+            logger.info("[Dry-run] %s", change)
+        logger.info("[Dry-run] %d change(s)", len(changes))
 
 
 def main(argv):
@@ -10,6 +10,7 @@ import sys
 from confutils import Default
 
 from . import __version__
+from . import constants
 from . import helpers
 from . import porcelain
 
@@ -120,7 +121,7 @@ class Init(BaseCommand):
     def run(self):
         self.env.root = self.env.get('root')
         repo_fs = self.env.get_repo_fs()
-        repo_fs.makedir(self.env.uconf_dir, recursive=True, allow_recreate=True)
+        repo_fs.makedirs(self.env.uconf_dir)
         repo_fs.writelines(os.path.join(self.env.uconf_dir, 'config'), [])
 
 
@@ -130,8 +131,8 @@ class WithRepoCommand(BaseCommand):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        initial_cats = self.env.getlist('initial', helpers.get_hostnames())
-        self.active_repository = self.env.get_active_repository(initial_cats)
+        self.initial_cats = self.env.getlist('initial', helpers.get_hostnames())
+        self.active_repository = self.env.get_active_repository(self.initial_cats)
 
     def _get_files(self, files):
         """Retrieve file config for a set of file names.
@@ -143,11 +144,11 @@ class WithRepoCommand(BaseCommand):
         return helpers.filter_iter(all_files, files, empty_is_all=True)
 
 
-class Make(WithRepoCommand):
-    """Make one or more files."""
+class FilesCommand(WithRepoCommand):
+    """Run a file porcelain command over one or more files."""
 
-    name = 'make'
-    help = "Build and install one or more files."
+    porcelain_class = None
+    files_help = ''
 
     required_config_fields = ('target',)
 
@@ -155,51 +156,129 @@ class Make(WithRepoCommand):
     def register_options(cls, parser):
         parser.add_argument(
             'files', nargs='*', default=Default(tuple()),
-            help="Build selected files, all valid if empty.",
+            help=cls.files_help,
+        )
+        parser.add_argument(
+            '--jobs', '-j', type=int, default=Default(1),
+            help="Handle JOBS files in parallel (0 for one per CPU)",
         )
         super().register_options(parser)
 
     def run(self):
-        p = porcelain.MakeFile(self.env, self.active_repository)
-        for filename in self._get_files(self.env.get('files')):
-            try:
-                p.handle(filename)
-            except porcelain.PorcelainError as e:
-                logger.exception("Error while handling %s: %r", filename, e)
-                continue
+        p = self.porcelain_class(self.env, self.active_repository)
+        runner = porcelain.FileRunner(p, jobs=self.env.getint('jobs', 1), logger=logger)
+        runner.run(self._get_files(self.env.get('files')))
 
 
-class Back(WithRepoCommand):
+class Make(FilesCommand):
+    """Make one or more files."""
+
+    name = 'make'
+    help = "Build and install one or more files."
+    files_help = "Build selected files, all valid if empty."
+
+    porcelain_class = porcelain.MakeFile
+
+
+class Back(FilesCommand):
     """Backport one or more files."""
 
     name = 'back'
     help = "Build and install one or more files."
+    files_help = "Backport selected files, all valid if empty."
+
+    porcelain_class = porcelain.BackFile
+
+
+class Diff(FilesCommand):
+    """Check whether installed file are compatible with sources."""
+
+    name = 'diff'
+    help = "Compute diff between source and installed version of one or more files."
+    files_help = "Compute diff of selected files, all valid if empty."
+
+    porcelain_class = porcelain.DiffFile
+
+
+class BackDiff(FilesCommand):
+    """Check whether source file are compatible with installed version."""
+
+    name = 'backdiff'
+    help = "Compute diff between source and installed version of one or more files."
+    files_help = "Compute backward diff of selected files, all valid if empty."
+
+    porcelain_class = porcelain.BackDiffFile
+
+
+class Status(WithRepoCommand):
+    """Check whether installed files match their sources."""
+
+    name = 'status'
+    help = "Report files modified at their source or destination, or missing."
 
     required_config_fields = ('target',)
 
+    # Labels of statuses, in display order
+    STATUSES = (
+        (constants.UP_TO_DATE, "up to date"),
+        (constants.MODIFIED_SOURCE, "modified at source"),
+        (constants.MODIFIED_DESTINATION, "modified at destination"),
+        (constants.MODIFIED, "modified"),
+        (constants.MISSING, "missing"),
+    )
+
     @classmethod
     def register_options(cls, parser):
         parser.add_argument(
             'files', nargs='*', default=Default(tuple()),
-            help="Backport selected files, all valid if empty.",
+            help="Check selected files, all valid if empty.",
+        )
+        parser.add_argument(
+            '--all', '-a', action='store_true', default=Default(False),
+            help="Also list files which are up to date",
         )
         super().register_options(parser)
 
     def run(self):
-        p = porcelain.BackFile(self.env, self.active_repository)
-        for filename in self._get_files(self.env.get('files')):
+        """Print the status of files.
+
+        Returns:
+            int: 1 if any file is not up to date, 0 otherwise
+        """
+        p = porcelain.StatusFile(self.env, self.active_repository)
+        show_all = self.env.getbool('all')
+        counts = dict.fromkeys((status for status, _label in self.STATUSES), 0)
+        errors = 0
+
+        for filename in sorted(self._get_files(self.env.get('files'))):
             try:
-                p.handle(filename)
+                status = p.handle(filename)
             except porcelain.PorcelainError as e:
-                logger.exception("Error while handling %s: %r", filename, e)
+                logger.error("Error while handling %s: %s", filename, e.user_message)
+                errors += 1
                 continue
+            counts[status] += 1
+            if show_all or status != constants.UP_TO_DATE:
+                self.info("%-21s %s", status, filename)
+
+        summary = ', '.join(
+            '%d %s' % (counts[status], label)
+            for status, label in self.STATUSES
+            if counts[status] or status == constants.UP_TO_DATE
+        )
+        if errors:
+            summary += ', %d error(s)' % errors
+        self.info("%d files: %s", sum(counts.values()) + errors, summary)
 
+        drift = errors or any(counts[status] for status in counts if status != constants.UP_TO_DATE)
+        return 1 if drift else 0
 
-class Diff(WithRepoCommand):
-    """Check whether installed file are compatible with sources."""
 
-    name = 'diff'
-    help = "Compute diff between source and installed version of one or more files."
+class Watch(WithRepoCommand):
+    """Rebuild files whenever they change."""
+
+    name = 'watch'
+    help = "Build files, then rebuild them whenever their source, dependencies or the configuration change."
 
     required_config_fields = ('target',)
 
@@ -207,44 +286,118 @@ class Diff(WithRepoCommand):
     def register_options(cls, parser):
         parser.add_argument(
             'files', nargs='*', default=Default(tuple()),
-            help="Compute diff of selected files, all valid if empty.",
+            help="Watch selected files, all valid if empty.",
+        )
+        parser.add_argument(
+            '--delay', type=float, default=Default(0.2),
+            help="Wait for DELAY seconds without changes before rebuilding",
         )
         super().register_options(parser)
 
     def run(self):
-        p = porcelain.DiffFile(self.env, self.active_repository)
-        for filename in self._get_files(self.env.get('files')):
-            try:
-                p.handle(filename)
-            except porcelain.PorcelainError as e:
-                logger.exception("Error while handling %s: %r", filename, e)
-                continue
-
-
-class BackDiff(WithRepoCommand):
-    """Check whether source file are compatible with installed version."""
-
-    name = 'backdiff'
-    help = "Compute diff between source and installed version of one or more files."
-
-    required_config_fields = ('target',)
+        try:
+            watcher = porcelain.Watcher(
+                self.env, self.initial_cats,
+                files=self.env.get('files'),
+                delay=float(self.env.get('delay', 0.2)),
+                logger=logger,
+            )
+        except OSError as e:
+            raise UConfError("Unable to watch files: %s" % e)
+
+        try:
+            watcher.load()
+            logger.info("Watching %d files for changes", len(watcher.inputs))
+            while True:
+                watcher.poll()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+
+
+class FleetMake(BaseCommand):
+    """Build files for many hosts at once."""
+
+    name = 'fleet-make'
+    help = "Build one or more files for each host of a list, into separate folders."
+
+    required_config_fields = ('hosts_file', 'output_root')
 
     @classmethod
     def register_options(cls, parser):
         parser.add_argument(
             'files', nargs='*', default=Default(tuple()),
-            help="Compute backward diff of selected files, all valid if empty.",
+            help="Build selected files, all valid if empty.",
+        )
+        parser.add_argument(
+            '--hosts-file', required=True,
+            help="Read hosts from HOSTS_FILE: one per line, optionally followed by extra initial categories",
+        )
+        parser.add_argument(
+            '--output-root', required=True,
+            help="Write files for each host into OUTPUT_ROOT/<host>/",
+        )
+        parser.add_argument(
+            '--jobs', '-j', type=int, default=Default(1),
+            help="Handle JOBS files in parallel (0 for one per CPU)",
         )
         super().register_options(parser)
 
+    def _check_host(self, host, hosts_file, lineno):
+        """Ensure a host name can't write outside of its output folder."""
+        separators = [sep for sep in (os.sep, os.altsep) if sep]
+        if os.path.isabs(host) or host == '.' or '..' in host or any(sep in host for sep in separators):
+            raise ConfigError("Invalid host name %r in %s, line %d" % (host, hosts_file, lineno))
+
+    def _read_hosts(self, hosts_file, initial=()):
+        """Read a hosts file.
+
+        Args:
+            initial (str list): extra initial categories for every host,
+                e.g. from the ``initial`` setting
+
+        Yields:
+            (host, initial categories) tuples
+        """
+        with open(helpers.get_absolute_path(hosts_file), 'rt') as f:
+            for lineno, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                host, *extra = line.split()
+                self._check_host(host, hosts_file, lineno)
+                categories = [host, host.split('.')[0]] + extra + list(initial)
+                yield host, list(dict.fromkeys(categories))
+
     def run(self):
-        p = porcelain.BackDiffFile(self.env, self.active_repository)
-        for filename in self._get_files(self.env.get('files')):
-            try:
-                p.handle(filename)
-            except porcelain.PorcelainError as e:
-                logger.exception("Error while handling %s: %r", filename, e)
-                continue
+        output_root = helpers.get_absolute_path(self.env.get('output_root'))
+        files = self.env.get('files')
+        jobs = self.env.getint('jobs', 1)
+
+        # Configured initial categories apply to all hosts; the local host
+        # name, used by default, doesn't. Check all hosts before building.
+        hosts = list(self._read_hosts(self.env.get('hosts_file'), initial=self.env.getlist('initial')))
+
+        # Share a single filesystem, mounted on the output root, across hosts.
+        forward_fs = self.env.with_target(output_root).get_forward_fs()
+        forward_fs.makedirs(output_root)
+
+        porcelains = {}
+        host_files = {}
+        for host, initial_cats in hosts:
+            # Keep the build state for the main target: fleets would evict its records.
+            host_env = self.env.with_target(
+                os.path.join(output_root, host), forward_fs=forward_fs, record_builds=False)
+            active_repository = self.env.get_active_repository(initial_cats)
+            porcelains[host] = porcelain.MakeFile(host_env, active_repository)
+            host_files[host] = list(
+                helpers.filter_iter(active_repository.iter_files(), files, empty_is_all=True))
+
+        logger.info("Building files for %d hosts into %s", len(hosts), output_root)
+        p = porcelain.FleetMakeFile(self.env, porcelains, host_files)
+        runner = porcelain.FileRunner(p, jobs=jobs, logger=logger)
+        runner.run(p.iter_files())
 
 
 class ImportFile(WithRepoCommand):
@@ -329,7 +482,10 @@ base_commands = [
     ImportFile,
     RenameFile,
     Make,
+    FleetMake,
     Back,
     Diff,
     BackDiff,
+    Status,
+    Watch,
 ]
@@ -11,20 +11,29 @@ the repository, regardless of current settings.
 """
 
 
+import copy
 import fnmatch
+import hashlib
+import io
 import os
+import re
 import stat
 import time
 
 import confutils
 
-from . import action_parser
-from . import actions
+from . import cache
 from . import constants
-from . import fs
 from . import helpers
+from . import manifest
 from . import rule_parser
 
+# Only needed by some commands
+action_parser = helpers.lazy_import('.action_parser', __package__)
+actions = helpers.lazy_import('.actions', __package__)
+converter = helpers.lazy_import('.converter', __package__)
+fs = helpers.lazy_import('.fs', __package__)
+
 
 class FileConfig:
     """Definition of the action for a file."""
@@ -33,10 +42,11 @@ class FileConfig:
     SYMLINK = 'symlink'
     PARSE = 'parse'
 
+    # Names of the action classes, in the actions module
     ACTIONS = {
-        COPY: actions.CopyAction,
-        SYMLINK: actions.SymLinkAction,
-        PARSE: actions.FileProcessingAction,
+        COPY: 'CopyAction',
+        SYMLINK: 'SymLinkAction',
+        PARSE: 'FileProcessingAction',
     }
 
     def __init__(self, action, **options):
@@ -60,7 +70,7 @@ class FileConfig:
         return helpers.get_absolute_path(destination, base=target)
 
     def get_action(self, filename, env):
-        action = self.ACTIONS[self.action]
+        action = getattr(actions, self.ACTIONS[self.action])
         abs_source = helpers.get_absolute_path(filename, base=env.root)
         abs_dest = self.get_destination(filename, env.target)
 
@@ -71,26 +81,116 @@ class FileConfig:
 
 
 class GlobStore:
+    """A mapping whose keys are globs (see fnmatch).
+
+    Looking up a key returns the value of the first glob matching it.
+    Globs are indexed on first lookup:
+    - globs without wildcards go into a dict;
+    - other globs go into a trie, by their literal prefix: globs whose only
+      wildcard is a trailing '*' match any key reaching their node, others
+      are tested with their own regexp;
+    - globs starting with a wildcard are merged into a single regexp.
+    """
+
+    WILDCARDS = frozenset('*?[')
+
+    # Special keys of trie nodes, besides single characters.
+    _PREFIX = 'prefix'
+    _PATTERNS = 'patterns'
+
     def __init__(self, *args):
         self.entries = list(*args)
+        self._index = None
+
+    @classmethod
+    def _split_glob(cls, glob):
+        """Split a glob into its literal prefix and the remainder."""
+        for i, char in enumerate(glob):
+            if char in cls.WILDCARDS:
+                return glob[:i], glob[i:]
+        return glob, ''
+
+    def _build_index(self):
+        exact = {}
+        trie = {}
+        patterns = []
+
+        for position, (glob, _value) in enumerate(self.entries):
+            prefix, remainder = self._split_glob(glob)
+            if not remainder:
+                exact.setdefault(glob, position)
+            elif not prefix and remainder != '*':
+                patterns.append('(?P<entry%d>%s)' % (position, fnmatch.translate(glob)))
+            else:
+                node = trie
+                for char in prefix:
+                    node = node.setdefault(char, {})
+                if remainder == '*':
+                    node.setdefault(self._PREFIX, position)
+                else:
+                    # Compiled on first use
+                    node.setdefault(self._PATTERNS, []).append([position, fnmatch.translate(glob)])
+
+        regexp = re.compile('|'.join(patterns)) if patterns else None
+        return exact, trie, regexp
+
+    def _find(self, key):
+        """Find the position of the first entry matching a key, or None."""
+        if self._index is None:
+            self._index = self._build_index()
+        exact, trie, regexp = self._index
+
+        best = exact.get(key)
+
+        if regexp is not None:
+            match = regexp.match(key)
+            if match:
+                # The first matching alternative wins.
+                position = int(match.lastgroup[len('entry'):])
+                if best is None or position < best:
+                    best = position
+
+        node = trie
+        for depth in range(len(key) + 1):
+            position = node.get(self._PREFIX)
+            if position is not None and (best is None or position < best):
+                best = position
+            for pattern in node.get(self._PATTERNS, ()):
+                position, glob_re = pattern
+                if best is not None and position > best:
+                    break
+                if isinstance(glob_re, str):
+                    glob_re = pattern[1] = re.compile(glob_re)
+                if glob_re.match(key):
+                    best = position
+                    break
+            if depth == len(key):
+                break
+            node = node.get(key[depth])
+            if node is None:
+                break
+
+        return best
 
     def __getitem__(self, key):
-        for glob, value in self.entries:
-            if fnmatch.fnmatchcase(key, glob):
-                return value
-        raise KeyError("Key %s not found in %r" % (key, self))
+        position = self._find(key)
+        if position is None:
+            raise KeyError("Key %s not found in %r" % (key, self))
+        return self.entries[position][1]
 
     def __setitem__(self, key, value):
         for i, entry in enumerate(self.entries):
             if key == entry[0]:
                 self.entries[i] = (key, value)
+                return
         self.entries.append((key, value))
+        self._index = None
 
     def get(self, key, default=None):
-        try:
-            return self[key]
-        except KeyError:
+        position = self._find(key)
+        if position is None:
             return default
+        return self.entries[position][1]
 
     def __repr__(self):
         return "GlobStore(%r)" % self.entries
@@ -102,17 +202,19 @@ class RepositoryView:
     Attributes:
         base: the Repository on which this view is based
         categories: frozenset of active category names
+        category_mask: active categories, as a mask from base.universe
     """
 
     def __init__(self, base):
         self.base = base
         self.categories = frozenset()
+        self.category_mask = 0
 
     def set_initial_categories(self, initial):
-        self.categories = frozenset(initial)
-        for category_rule, extra_categories in self.base.category_rules:
-            if category_rule.test(self.categories):
-                self.categories |= extra_categories
+        universe = self.base.universe
+        mask = self.base.expand_categories(universe.mask(initial))
+        self.category_mask = mask
+        self.categories = universe.unmask(mask)
 
     def iter_files(self):
         """Retrieve all active files for this view
@@ -120,8 +222,9 @@ class RepositoryView:
         Yields:
             filename
         """
+        universe = self.base.universe
         for file_rule, filename in self.base.file_rules:
-            if file_rule.test(self.categories):
+            if file_rule.test_mask(self.category_mask, universe):
                 yield filename
 
     def get_file_config(self, filename, default_action='parse'):
@@ -129,28 +232,56 @@ class RepositoryView:
         return self.base.file_configs.get(filename, default_config)
 
 
+def get_sections(config):
+    """Extract the options of all sections of a configuration file.
+
+    Equivalent to config.section_view(name) for each section, in a single
+    pass over the lines of the file.
+
+    Returns:
+        str => (str => str dict) dict: options, by section name; the first
+            value of a key wins
+    """
+    sections = {}
+    for name in config.sections:
+        options = sections[name] = {}
+        for key, value in config.items(name):
+            options.setdefault(key, value)
+    return sections
+
+
 class Repository:
     """Holds repository configuration.
 
     Attributes:
-        categories (str set): all categories
-        files (str list): all managed files
-        file_actions (dict(str => FileConfig)): actions for files
+        universe (rule_parser.CategoryUniverse): all known categories
+        category_rules ((Rule, str set, int) list): extra categories (as
+            names and mask) to enable when a rule matches
+        file_rules ((Rule, str) list): files to enable when a rule matches
+        file_configs (GlobStore(str => FileConfig)): actions for files
+        sections (str => (str => str dict) dict): options of each section of
+            the configuration; the first value of a key wins
         rule_lexer (rule_parser.RuleLexer): lexer to use for rule parsing
+        store (cache.DiskCache): optional storage for the compiled repository
     """
 
-    def __init__(self, root=None, *args, **kwargs):
+    # Key of the compiled repository in the store
+    CACHE_KEY = 'repository'
+    # Version of the layout of cached entries
+    CACHE_FORMAT = 2
+
+    def __init__(self, root=None, *args, expansion_cache_size=1024, store=None, **kwargs):
         self.root = root
-        self.config = confutils.ConfigFile()
-        self.actions_config = self.config.section_view('actions')
-        self.files_config = self.config.section_view('files', True)
-        self.categories_config = self.config.section_view('categories', True)
+        self.store = store
+        self._config = None
 
+        self.universe = rule_parser.CategoryUniverse()
         self.category_rules = []
         self.file_rules = []
         self.file_configs = GlobStore()
-        self.rule_lexer = rule_parser.RuleLexer()
-        self.action_lexer = action_parser.ActionLexer()
+        self.sections = {}
+        self._rule_lexer = self._action_lexer = None
+        self._expansions = helpers.LRUCache(expansion_cache_size)
 
         self._read_config()
 
@@ -162,6 +293,65 @@ class Repository:
     def config_path(self):
         return os.path.join(self.uconf_dir, 'config')
 
+    @property
+    def rule_lexer(self):
+        if self._rule_lexer is None:
+            self._rule_lexer = rule_parser.RuleLexer()
+        return self._rule_lexer
+
+    @property
+    def action_lexer(self):
+        if self._action_lexer is None:
+            self._action_lexer = action_parser.ActionLexer()
+        return self._action_lexer
+
+    @property
+    def config(self):
+        """The parsed configuration file; only read when needed."""
+        if self._config is None:
+            self._parse_config()
+        return self._config
+
+    @property
+    def actions_config(self):
+        return self.config.section_view('actions')
+
+    @property
+    def files_config(self):
+        return self.config.section_view('files', True)
+
+    @property
+    def categories_config(self):
+        return self.config.section_view('categories', True)
+
+    def expand_categories(self, mask):
+        """Add all categories enabled by category rules to a mask.
+
+        Rules are applied until no more categories get enabled, so that the
+        order of rules in the configuration does not matter.
+
+        Args:
+            mask (int): initial categories, as a mask from self.universe
+
+        Returns:
+            int: the mask of all enabled categories
+        """
+        expanded = self._expansions.get(mask)
+        if expanded is not None:
+            return expanded
+
+        expanded = mask
+        changed = True
+        while changed:
+            changed = False
+            for category_rule, _extra_categories, extra_mask in self.category_rules:
+                if extra_mask & ~expanded and category_rule.test_mask(expanded, self.universe):
+                    expanded |= extra_mask
+                    changed = True
+
+        self._expansions[mask] = expanded
+        return expanded
+
     def extract(self, initial):
         """Extract a 'view' on this repository for given initial categories."""
         view = RepositoryView(self)
@@ -178,20 +368,60 @@ class Repository:
 
         fs.rename(temp_path, self.config_path)
 
+    def _parse_config(self, content=None):
+        self._config = confutils.ConfigFile()
+        if content is None:
+            if self.root:
+                self._config.parse_file(self.config_path, skip_unreadable=False)
+        else:
+            self._config.parse(io.StringIO(content), name_hint=self.config_path)
+
     def _read_config(self):
+        """Read the configuration, and compile its rules.
+
+        The compiled rules and file configurations are kept in the store,
+        until the content of the configuration file changes.
+        """
         if not self.root:
             return
 
-        self.config.parse_file(self.config_path, skip_unreadable=False)
-
+        try:
+            with open(self.config_path, 'rb') as f:
+                content = f.read()
+        except OSError:
+            # Let the config parser report the error.
+            self._parse_config()
+            content = None
+
+        key = None
+        if content is not None:
+            key = (hashlib.sha1(content).hexdigest(), self.CACHE_FORMAT)
+            if self.store is not None:
+                compiled = self.store.get(self.CACHE_KEY)
+                if compiled is not None and compiled[0] == key:
+                    (
+                        self.universe, self.category_rules, self.file_rules, self.file_configs, self.sections,
+                    ) = compiled[1]
+                    return
+            self._parse_config(content.decode('utf-8'))
+
+        self.sections = get_sections(self.config)
         self._read_category_rules(self.categories_config)
         self._read_file_rules(self.files_config)
         self._read_file_actions(self.actions_config)
 
+        enabled = helpers.parse_bool(self.sections.get('core', {}).get('repository_cache', True))
+        if self.store is not None and key is not None and enabled:
+            self.store.set(self.CACHE_KEY, (
+                key,
+                (self.universe, self.category_rules, self.file_rules, self.file_configs, self.sections),
+            ))
+
     def _read_category_rules(self, rules):
         for rule_text, extra_categories in rules.items():
             rule = self.rule_lexer.get_rule(rule_text)
-            self.category_rules.append((rule, helpers.flatten(extra_categories)))
+            extra_categories = helpers.flatten(extra_categories)
+            self.category_rules.append((rule, extra_categories, self.universe.mask(extra_categories)))
 
     def _read_file_rules(self, rules):
         for rule_text, filenames in rules.items():
@@ -231,6 +461,11 @@ class Env:
         self.target = target
 
         self._forward_fs = self._backward_fs = self._uconf_fs = self._repo_fs = None
+        # All filesystems built for this env and its copies
+        self._filesystems = []
+        self._template_cache = self._build_state = self._hash_cache = None
+        self._record_builds = True
+        self._views = helpers.LRUCache(self.getint('view_cache_size', 128))
 
     @property
     def uconf_dir(self):
@@ -250,48 +485,163 @@ class Env:
             value = value.split(separator)
         return list(value)
 
+    def getint(self, key, default=0):
+        return int(self.get(key, default=default))
+
+    def getbool(self, key, default=False):
+        return helpers.parse_bool(self.get(key, default=default))
+
+    @property
+    def cache_dir(self):
+        return os.path.join(self.uconf_dir, 'cache')
+
+    def with_target(self, target, forward_fs=None, record_builds=True):
+        """Build a copy of this env, writing generated files to another target.
+
+        The repository and caches are shared with the copy.
+
+        Args:
+            target (str): the new target folder
+            forward_fs (fs.FSLoader): a filesystem allowing writes to target;
+                built on demand if empty.
+            record_builds (bool): whether to record built files in the shared
+                build state; records for other targets count towards
+                'build_state_size', and could evict those of the main target.
+        """
+        env = copy.copy(self)
+        env.target = helpers.get_absolute_path(target, base=self.root)
+        env._forward_fs = forward_fs
+        env._template_cache = self.get_template_cache()
+        env._record_builds = record_builds
+        env._build_state = self.get_build_state() if record_builds else None
+        env._hash_cache = self.get_hash_cache()
+        return env
+
+    def reload_repository(self):
+        """Read the repository configuration again, e.g. after it changed.
+
+        Other options, e.g. from the "[core]" section, are not reloaded.
+        """
+        self.repository = Repository(root=self.root, store=self.repository.store)
+        self._views.clear()
+
     def get_active_repository(self, initial_cats):
-        # TODO(rbarrois): consider memoizing
-        return self.repository.extract(initial_cats)
+        """Retrieve the view of the repository for a set of initial categories.
+
+        Views are cached, up to 'view_cache_size' entries.
+        """
+        key = frozenset(initial_cats)
+        view = self._views.get(key)
+        if view is None:
+            view = self._views[key] = self.repository.extract(key)
+        return view
+
+    def get_template_cache(self):
+        """Retrieve the cache of compiled templates.
+
+        Up to 'template_memory_size' templates are kept in memory. They are
+        also stored in the uconf dir, up to 'template_cache_size' entries,
+        unless disabled through the 'template_cache' option.
+        """
+        if self._template_cache is None:
+            store = None
+            if self.root and self.getbool('template_cache', True):
+                store = cache.DiskCache(
+                    os.path.join(self.cache_dir, 'templates'),
+                    read_only=self.get('dry_run', False),
+                )
+            self._template_cache = converter.TemplateCache(
+                store=store,
+                max_entries=self.getint('template_cache_size', 10000),
+                memory_size=self.getint('template_memory_size', 4096),
+            )
+        return self._template_cache
+
+    def get_build_state(self):
+        """Retrieve the record of built files.
+
+        Records are kept for up to 'build_state_size' destinations, and
+        fingerprint files with the 'hash_algorithm' digest.
+        Returns None if incremental builds were disabled, through the
+        'incremental' option, or for this env (see with_target()).
+        """
+        if self._build_state is None and self._record_builds and self.root and self.getbool('incremental', True):
+            self._build_state = manifest.BuildState(
+                cache.DiskCache(
+                    os.path.join(self.uconf_dir, 'state'),
+                    read_only=self.get('dry_run', False),
+                ),
+                algorithm=self.get('hash_algorithm', manifest.HashCache.DEFAULT_ALGORITHM),
+                max_entries=self.getint('build_state_size', 100000),
+            )
+        return self._build_state
+
+    def get_hash_cache(self):
+        """Retrieve the cache of file digests.
+
+        The digest is chosen with the 'hash_algorithm' option. Digests are
+        stored in the uconf dir, up to 'hash_cache_size' files, unless
+        disabled through the 'hash_cache' option.
+        """
+        if self._hash_cache is None:
+            store = None
+            if self.root and self.getbool('hash_cache', True):
+                store = cache.DiskCache(
+                    os.path.join(self.cache_dir, 'hashes'),
+                    read_only=self.get('dry_run', False),
+                )
+            self._hash_cache = manifest.HashCache(
+                store=store,
+                algorithm=self.get('hash_algorithm', manifest.HashCache.DEFAULT_ALGORITHM),
+                max_entries=self.getint('hash_cache_size', 100000),
+            )
+        return self._hash_cache
+
+    def _make_fs(self, write_path):
+        loader = fs.FSLoader(
+            write_path,
+            dry_run=self.get('dry_run', False),
+            default_encoding=self.get('file_encoding', 'utf8'),
+            hash_algorithm=self.get('hash_algorithm', manifest.HashCache.DEFAULT_ALGORITHM),
+            spill=self.getbool('dry_run_spill'),
+        )
+        self._filesystems.append(loader)
+        return loader
 
     def get_forward_fs(self):
         if self._forward_fs is None:
-            self._forward_fs = fs.FSLoader(
-                self.target,
-                dry_run=self.get('dry_run', False),
-                default_encoding=self.get('file_encoding', 'utf8'),
-            )
+            self._forward_fs = self._make_fs(self.target)
         return self._forward_fs
 
     def get_backward_fs(self):
         if self._backward_fs is None:
-            self._backward_fs = fs.FSLoader(
-                self.root,
-                dry_run=self.get('dry_run', False),
-                default_encoding=self.get('file_encoding', 'utf8'),
-            )
+            self._backward_fs = self._make_fs(self.root)
         return self._backward_fs
 
     def get_uconf_fs(self):
         """Retrieve the filesystem associated with the private uconf dir."""
         if self._uconf_fs is None:
-            self._uconf_fs = fs.FSLoader(
-                self.uconf_dir,
-                dry_run=self.get('dry_run', False),
-                default_encoding=self.get('file_encoding', 'utf8'),
-            )
+            self._uconf_fs = self._make_fs(self.uconf_dir)
         return self._uconf_fs
 
     def get_repo_fs(self):
         """Retrieve a filesystem for the repository, including uconf."""
         if self._repo_fs is None:
-            self._repo_fs = fs.FSLoader(
-                self.root,
-                dry_run=self.get('dry_run', False),
-                default_encoding=self.get('file_encoding', 'utf8'),
-            )
+            self._repo_fs = self._make_fs(self.root)
         return self._repo_fs
 
+    def get_dry_run_changes(self):
+        """Retrieve the changes recorded by the filesystems of a dry-run.
+
+        Returns:
+            fs.DryRunChange list: sorted by path
+        """
+        changes = {}
+        for loader in self._filesystems:
+            for change in loader.get_changes():
+                changes[change.path] = change
+        return [changes[path] for path in sorted(changes)]
+
     @classmethod
     def _walk_root(cls, base):
         """Walk to the top of a directory tree until a repository root is found.
@@ -309,33 +659,41 @@ class Env:
             prev, current = current, os.path.dirname(current)
 
     @classmethod
-    def _read_config(cls, repo_root=None, config_files=constants.CONFIG_FILES):
-        """Read all relevant config files."""
-        if repo_root:
-            repo_root = cls._walk_root(repo_root)
+    def _read_config(cls, config_files=constants.CONFIG_FILES):
+        """Read user configuration files.
+
+        The repository configuration is read by the Repository.
 
+        Returns:
+            str => (str => str dict) dict: options, by section name
+        """
         config = confutils.ConfigFile()
 
         for config_file in config_files:
             config_file = helpers.get_absolute_path(config_file)
             config.parse_file(config_file, skip_unreadable=True)
 
-        if repo_root:
-            repo_config = os.path.join(repo_root, constants.REPO_SUBFOLDER, 'config')
-            config.parse_file(repo_config, skip_unreadable=False)
-
-        return repo_root, config
+        return get_sections(config)
 
     @classmethod
-    def _merge_config(cls, config, sections=(), extra=None):
+    def _merge_config(cls, *configs, sections=(), extra=None):
+        """Merge options from some sections of configurations.
+
+        Args:
+            configs (str => (str => str dict) dict list): options by section,
+                see get_sections(); in decreasing priority
+            sections (str list): extra sections to read, before '[core]'
+            extra (dict): options overriding all configurations
+        """
         merged = confutils.MergedConfig()
         if extra is not None:
             merged.add_options(extra)
 
-        for section in sections:
-            merged.add_options(config.section_view(section))
-
-        merged.add_options(config.section_view('core'))
+        for section in list(sections) + ['core']:
+            options = {}
+            for config in reversed(configs):
+                options.update(config.get(section, {}))
+            merged.add_options(options)
 
         return merged
 
@@ -349,10 +707,20 @@ class Env:
         - Dict of extra configuration values
         """
 
-        repo_root, config = cls._read_config(repo_root=repo_root, config_files=config_files)
-
-        repo = Repository(root=repo_root)
-
-        config_view = cls._merge_config(config, sections=sections, extra=extra)
+        if repo_root:
+            repo_root = cls._walk_root(repo_root)
+        user_config = cls._read_config(config_files=config_files)
+
+        # The repository configuration is cached along with the compiled
+        # repository; only user options can disable the cache beforehand.
+        user_view = cls._merge_config(user_config, sections=sections, extra=extra)
+        store = None
+        if repo_root and helpers.parse_bool(user_view.get('repository_cache', True)):
+            store = cache.DiskCache(
+                os.path.join(repo_root, constants.REPO_SUBFOLDER, 'cache'),
+                read_only=user_view.get('dry_run', False),
+            )
+        repo = Repository(root=repo_root, store=store)
 
+        config_view = cls._merge_config(user_config, repo.sections, sections=sections, extra=extra)
         return cls(root=repo_root, config=config_view, repository=repo)
@@ -8,3 +8,11 @@
 
 CONFIG_FILES = ('/etc/uconf.conf', '~/.uconfrc')
 REPO_SUBFOLDER = '.uconf'
+
+# Status of an installed file, see actions.BaseAction.status()
+UP_TO_DATE = 'up-to-date'
+MODIFIED_SOURCE = 'modified-source'
+MODIFIED_DESTINATION = 'modified-destination'
+# Both sides changed, or there is no record to tell which one did
+MODIFIED = 'modified'
+MISSING = 'missing'
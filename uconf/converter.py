@@ -2,9 +2,11 @@
 # Copyright (c) 2010-2013 Raphaël Barrois
 # This software is distributed under the two-clause BSD license.
 
-import difflib
 import re
 
+from uconf import cache
+from uconf import diffing
+from uconf import helpers
 from uconf import rule_parser
 
 
@@ -16,27 +18,44 @@ class FileProcessor:
     """Handles 'standard' processing of a file.
 
     Attributes:
-        src (str list): lines of the file to process
+        src (str list): lines of the file to process; a single-use iterable
+            when streaming
         fs (FileSystem): abstraction toward the filesystem
+        template_cache (TemplateCache): optional cache of compiled templates
+        dependencies (str set): paths of other files read while processing
+        universe (rule_parser.CategoryUniverse): optional, for mask-based rule tests
+        streaming (bool): whether to read src lazily, keeping only the current
+            line in memory; only supports forward()
+        diff_algorithm (str): the algorithm used to backport changes
+        strict (bool): whether to fail on placeholders for unknown variables
     """
-    def __init__(self, src, fs):
-        self.src = list(src)
+    def __init__(self, src, fs, template_cache=None, dependencies=None, universe=None, streaming=False,
+                 diff_algorithm=diffing.DEFAULT_ALGORITHM, strict=False):
+        self.streaming = streaming
+        self.strict = strict
+        self.diff_algorithm = diff_algorithm
+        self.src = src if streaming else list(src)
         self.fs = fs
+        self.template_cache = template_cache
+        self.universe = universe
+        self.dependencies = set() if dependencies is None else dependencies
 
     def _get_gen_config(self, categories):
         return GeneratorConfig(
             categories=categories,
             commands=[cmd() for cmd in DEFAULT_COMMANDS],
             fs=self.fs,
+            template_cache=self.template_cache,
+            dependencies=self.dependencies,
+            universe=self.universe,
+            strict=self.strict,
         )
 
     def forward(self, categories):
         """Process the source file with an active list of categories."""
         gen_config = self._get_gen_config(categories)
-        generator = gen_config.load(self.src)
-        for line in generator:
-            if line.output is not None:
-                yield line.output
+        generator = gen_config.load(self.src, streaming=self.streaming)
+        return generator.iter_output()
 
     def backward(self, categories, modified):
         """Revert a file.
@@ -48,29 +67,46 @@ class FileProcessor:
         Yields:
             str: updated lines for the original file
         """
-        categories = frozenset(categories)
-        original_output = self.forward(categories)
-        diff = Differ(original_output, modified)
+        if self.streaming:
+            raise ValueError("Streaming file processors can't backport files.")
         gen_config = self._get_gen_config(categories)
         generator = gen_config.load(self.src)
-        backporter = Backporter(diff, generator)
+        spans = list(generator.iter_spans())
+        lines = generator.lines
+
+        original_output = []
+        for kind, start, end, output in spans:
+            if kind == Generator.SPAN_TEXT:
+                original_output.extend(lines[start:end])
+            elif kind == Generator.SPAN_LINE:
+                original_output.append(output)
 
-        for line in backporter:
-            yield line
+        modified = list(modified)
+        differ = Differ(original_output, modified, algorithm=self.diff_algorithm)
+        backporter = HunkBackporter(differ.get_opcodes(), modified, spans, lines)
+        yield from backporter
 
 
 class Differ:
     """Computes differences between two files (as string lists).
 
-    Based on difflib.SequenceMatcher, but yields atomic operations.
+    Yields atomic operations, from the opcodes of a diffing algorithm.
 
     Attributes:
         original (str list): lines of the original file
         modified (str list): lines of the modified file
+        algorithm (str): the diff algorithm, one of diffing.ALGORITHMS
     """
-    def __init__(self, original, modified):
+    def __init__(self, original, modified, algorithm=diffing.DEFAULT_ALGORITHM):
+        if algorithm not in diffing.ALGORITHMS:
+            raise ValueError("Invalid diff algorithm %s, choose one of %s" % (
+                algorithm, ', '.join(diffing.ALGORITHMS)))
         self.original = list(original)
         self.modified = list(modified)
+        self.algorithm = algorithm
+
+    def get_opcodes(self):
+        return diffing.get_opcodes(self.original, self.modified, self.algorithm)
 
     def __iter__(self):
         """Yield atomic diff lines.
@@ -78,9 +114,7 @@ class Differ:
         Yields:
             (operation, new_line) tuples.
         """
-        matcher = difflib.SequenceMatcher(a=self.original, b=self.modified)
-        opcodes = matcher.get_opcodes()
-        for opcode, original_i, original_j, modified_i, modified_j in opcodes:
+        for opcode, original_i, original_j, modified_i, modified_j in self.get_opcodes():
             if opcode == 'equal':
                 for original_lineno in range(original_i, original_j):
                     yield (opcode, self.original[original_lineno])
@@ -156,7 +190,98 @@ class Backporter:
             yield self.reverse(output)
 
 
+class HunkBackporter:
+    """Backports a diff to an original file, one hunk at a time.
+
+    Unchanged ranges are copied from the source as slices; only changed
+    lines are handled one by one. The result matches Backporter's.
+
+    Attributes:
+        opcodes ((tag, i1, i2, j1, j2) list): the diff from the generated
+            output to the modified file, as from Differ.get_opcodes()
+        modified (str list): lines of the modified file
+        spans ((kind, start, end, output) iterable): from Generator.iter_spans()
+        lines (str list): lines of the source
+    """
+
+    INSERT = 0
+    REPLACE = 1
+    DELETE = 2
+
+    def __init__(self, opcodes, modified, spans, lines):
+        self.opcodes = opcodes
+        self.modified = modified
+        self.spans = spans
+        self.lines = lines
+
+    reverse = Backporter.reverse
+
+    def get_changes(self):
+        """Convert opcodes to changes on output lines.
+
+        Insertions go before the output line they are attached to, after any
+        masked line preceding it.
+
+        Returns:
+            (output_lineno, action, modified_lineno) list, sorted
+        """
+        changes = []
+        for tag, i1, i2, j1, j2 in self.opcodes:
+            if tag == 'equal':
+                continue
+            common = min(i2 - i1, j2 - j1) if tag == 'replace' else 0
+            for offset in range(common):
+                changes.append((i1 + offset, self.REPLACE, j1 + offset))
+            for modified_lineno in range(j1 + common, j2):
+                changes.append((i1 + common, self.INSERT, modified_lineno))
+            for output_lineno in range(i1 + common, i2):
+                changes.append((output_lineno, self.DELETE, None))
+        changes.sort()
+        return changes
+
+    def __iter__(self):
+        """Yield lines for the updated source."""
+        lines = self.lines
+        changes = self.get_changes()
+        change_index = 0
+        output_lineno = 0
+
+        for kind, start, end, _output in self.spans:
+            if kind == Generator.SPAN_MASKED:
+                yield from lines[start:end]
+                continue
+
+            span_end = output_lineno + end - start
+            current = start
+            while change_index < len(changes) and changes[change_index][0] < span_end:
+                changed_lineno, action, modified_lineno = changes[change_index]
+                change_index += 1
+                lineno = start + changed_lineno - output_lineno
+
+                yield from lines[current:lineno]
+                if action == self.INSERT:
+                    yield self.reverse(self.modified[modified_lineno])
+                    current = lineno
+                elif action == self.REPLACE:
+                    yield self.reverse(self.modified[modified_lineno])
+                    current = lineno + 1
+                else:
+                    assert action == self.DELETE
+                    current = lineno + 1
+
+            yield from lines[current:end]
+            output_lineno = span_end
+
+        # Handle additional lines from the diff
+        # Should only be insertions.
+        for changed_lineno, action, modified_lineno in changes[change_index:]:
+            assert action == self.INSERT, "Unexpected action %s on line %d" % (action, changed_lineno)
+            yield self.reverse(self.modified[modified_lineno])
+
+
 class Line:
+    __slots__ = ('output', 'original')
+
     def __init__(self, output, original):
         self.output = output
         self.original = original
@@ -189,6 +314,8 @@ class Line:
 
 
 class Block:
+    __slots__ = ('kind', 'published', 'context', 'start_line')
+
     KIND_IF = 'if'
     KIND_WITH = 'with'
 
@@ -208,8 +335,30 @@ class Block:
 
 
 class BlockStack:
+    """The stack of currently open blocks.
+
+    The publication status and variables of the stack are updated when
+    entering or leaving a block, instead of being computed for every line.
+
+    Attributes:
+        blocks (Block list): the open blocks, innermost last
+        published (bool): whether all open blocks are published
+        merged_context (str => str dict): the variables from all open blocks;
+            must not be modified
+        placeholder_re (re.Pattern): matches placeholders for all variables
+            in merged_context, None if there are no variables
+    """
+
+    __slots__ = ('blocks', 'published', 'merged_context', 'placeholder_re', '_saved_states')
+
+    any_placeholder_re = re.compile(r'@@(\w+)@@')
+
     def __init__(self):
         self.blocks = []
+        self.published = True
+        self.merged_context = {}
+        self.placeholder_re = None
+        self._saved_states = []
 
     def __nonzero__(self):
         return bool(self.blocks)
@@ -220,19 +369,34 @@ class BlockStack:
     def __repr__(self):
         return "<BlockStack: %r>" % self.blocks
 
-    @property
-    def published(self):
-        return all(b.published for b in self.blocks)
+    @classmethod
+    def _make_placeholder_re(cls, context):
+        return re.compile('@@(%s)@@' % '|'.join(re.escape(var) for var in sorted(context)))
 
-    @property
-    def merged_context(self):
-        context = {}
-        for block in self.blocks:
-            context.update(block.context)
-        return context
+    def _replace_placeholder(self, match):
+        return self.merged_context[match.group(1)]
+
+    def substitute(self, line, strict=False):
+        """Replace all placeholders for known variables in a line.
+
+        Raises:
+            KeyError: in strict mode, if the line holds an unknown placeholder
+        """
+        if strict:
+            return self.any_placeholder_re.sub(self._replace_placeholder, line)
+        if self.placeholder_re is None or '@@' not in line:
+            return line
+        return self.placeholder_re.sub(self._replace_placeholder, line)
 
     def enter(self, *args, **kwargs):
         block = Block(*args, **kwargs)
+        self._saved_states.append((self.published, self.merged_context, self.placeholder_re))
+        self.published = self.published and block.published
+        if block.context:
+            merged_context = dict(self.merged_context)
+            merged_context.update(block.context)
+            self.merged_context = merged_context
+            self.placeholder_re = self._make_placeholder_re(merged_context)
         self.blocks.append(block)
         return block
 
@@ -242,6 +406,7 @@ class BlockStack:
         last_kind = self.blocks[-1].kind
         if last_kind != kind:
             raise ValueError("Unexpected last block kind: %s!=%s." % (last_kind, kind))
+        self.published, self.merged_context, self.placeholder_re = self._saved_states.pop()
         return self.blocks.pop()
 
 
@@ -256,12 +421,24 @@ class BaseCommand:
         """Return the list of "keys" (or "commands") handled by this class."""
         return self.keys
 
+    def compile(self, key, argline):
+        """Pre-process the arguments of a line, when compiling a template.
+
+        Args:
+            key (str): one of the keys in get_keys()
+            argline (str): everything after the key and a space
+
+        Returns:
+            the arguments to pass to handle() when rendering the line.
+        """
+        return argline
+
     def handle(self, key, argline, state, config):
         """Handle a line.
 
         Args:
             key (str): one of the keys in get_keys()
-            argline (str): everything after the key and a space
+            argline: everything after the key and a space, as returned by compile()
             state (GeneratorState): the current state of the generator
             config (GeneratorConfig): various config-time params of the generator
         """
@@ -304,9 +481,20 @@ class IfBlockCommand(BaseBlockCommand):
         super().__init__(**kwargs)
         self.rule_lexer = rule_parser.RuleLexer()
 
+    def compile(self, key, argline):
+        if key in ('if', 'elif'):
+            return self.rule_lexer.get_rule(argline)
+        return argline
+
+    def _get_rule(self, argline):
+        if isinstance(argline, rule_parser.Rule):
+            # Already parsed by compile()
+            return argline
+        return self.rule_lexer.get_rule(argline)
+
     def enter(self, key, argline, state, config):
-        rule = self.rule_lexer.get_rule(argline)
-        state.enter_block(Block.KIND_IF, published=rule.test(config.categories))
+        rule = self._get_rule(argline)
+        state.enter_block(Block.KIND_IF, published=config.test(rule))
 
     def inside(self, key, argline, state, config):
         if key == 'else':
@@ -321,8 +509,8 @@ class IfBlockCommand(BaseBlockCommand):
             if last_block.published:
                 published = False
             else:
-                rule = self.rule_lexer.get_rule(argline)
-                published = rule.test(config.categories)
+                rule = self._get_rule(argline)
+                published = config.test(rule)
 
             state.enter_block(Block.KIND_IF, published=published)
 
@@ -341,6 +529,7 @@ class WithBlockCommand(BaseBlockCommand):
 
     def _read_file(self, filename, config):
         """Read one line from a file."""
+        config.dependencies.add(filename)
         return config.fs.read_one_line(filename)
 
     def _parse_with_args(self, args, state):
@@ -378,6 +567,8 @@ class GeneratorState:
         _current_lineno (int): the current line number
     """
 
+    __slots__ = ('block_stack', '_current_lineno')
+
     def __init__(self):
         self.block_stack = BlockStack()
         self._current_lineno = 0
@@ -409,7 +600,7 @@ class GeneratorState:
         try:
             return self.block_stack.leave(kind)
         except ValueError as e:
-            self.invalid("Error when closing block: %r", e)
+            self.error("Error when closing block: %r", e)
 
 
 DEFAULT_COMMANDS = [
@@ -418,18 +609,162 @@ DEFAULT_COMMANDS = [
 ]
 
 
+class Template:
+    """A compiled source file.
+
+    The lines of the source are grouped into a flat list of operations:
+    - (OP_TEXT, start, end): lines[start:end] are plain text
+    - (OP_SUBST, lineno): a plain text line holding @@placeholders@@
+    - (OP_MASKED, lineno): a comment, never output
+    - (OP_ESCAPED, lineno, output): an escaped line, always output
+    - (OP_COMMAND, lineno, name, args): a command, with its pre-compiled args
+
+    Attributes:
+        lines (str tuple): the lines of the source
+        ops (tuple tuple): the operations
+    """
+
+    OP_TEXT = 'text'
+    OP_SUBST = 'subst'
+    OP_MASKED = 'masked'
+    OP_ESCAPED = 'escaped'
+    OP_COMMAND = 'command'
+
+    command_prefix_re = re.compile(r'^(["!#]@)(.+)$')
+    placeholder_marker = '@@'
+
+    def __init__(self, lines, ops):
+        self.lines = lines
+        self.ops = ops
+
+    def __repr__(self):
+        return '<Template: %d lines, %d ops>' % (len(self.lines), len(self.ops))
+
+    @classmethod
+    def compile(cls, lines, commands_by_key):
+        """Compile a list of lines.
+
+        Args:
+            lines (str iterable): the lines of the source
+            commands_by_key (str => BaseCommand dict): the available commands
+        """
+        lines = tuple(lines)
+        ops = []
+
+        for lineno, line in enumerate(lines):
+            op = cls.compile_line(lineno, line, commands_by_key)
+            if op[0] == cls.OP_TEXT and ops and ops[-1][0] == cls.OP_TEXT:
+                # Extend the current span of plain text
+                op = (cls.OP_TEXT, ops.pop()[1], lineno + 1)
+            ops.append(op)
+
+        return cls(lines, tuple(ops))
+
+    @classmethod
+    def compile_line(cls, lineno, line, commands_by_key):
+        """Compile a single line.
+
+        Returns:
+            tuple: the operation for the line; plain text yields a one-line span.
+        """
+        match = cls.command_prefix_re.match(line)
+        if match:
+            return cls._compile_command(lineno, *match.groups(), commands_by_key=commands_by_key)
+        elif cls.placeholder_marker in line:
+            return (cls.OP_SUBST, lineno)
+        else:
+            return (cls.OP_TEXT, lineno, lineno + 1)
+
+    @classmethod
+    def _compile_command(cls, lineno, prefix, command, commands_by_key):
+        if command.startswith('#'):
+            # A comment
+            return (cls.OP_MASKED, lineno)
+
+        elif command.startswith('@'):
+            # An escaped line
+            return (cls.OP_ESCAPED, lineno, prefix + command[1:])
+
+        if ' ' in command:
+            name, args = command.split(' ', 1)
+        else:
+            name, args = command, ''
+
+        if name not in commands_by_key:
+            raise CommandError(
+                "Unknown command '%s' on line %d (not in %r)" % (name, lineno, sorted(commands_by_key)))
+
+        args = commands_by_key[name].compile(name, args)
+        return (cls.OP_COMMAND, lineno, name, args)
+
+
+class TemplateCache:
+    """Caches compiled templates, keyed by the hash of their source.
+
+    Attributes:
+        store (cache.DiskCache): optional persistent storage for templates
+        max_entries (int): the number of templates to keep in the store
+        templates (helpers.LRUCache): in-memory cache, holding up to
+            'memory_size' templates; long-running commands (e.g. watch) would
+            otherwise keep every version of every source
+    """
+
+    def __init__(self, store=None, max_entries=10000, memory_size=4096):
+        self.store = store
+        self.max_entries = max_entries
+        self.templates = helpers.LRUCache(memory_size)
+        self._evicted = False
+
+    def get(self, lines, compiler):
+        """Retrieve the template for a set of lines.
+
+        Args:
+            lines (str list): the lines of the source
+            compiler (callable): builds a Template from a list of lines
+
+        Returns:
+            Template
+        """
+        key = cache.hash_lines(lines)
+        template = self.templates.get(key)
+        if template is None and self.store is not None:
+            template = self.store.get(key)
+            if template is not None:
+                self.store.touch(key)
+
+        if template is None:
+            template = compiler(lines)
+            if self.store is not None:
+                if not self._evicted:
+                    # Only look for stale entries in runs which add new ones.
+                    self.store.evict(max(0, self.max_entries - 1))
+                    self._evicted = True
+                self.store.set(key, template)
+
+        self.templates[key] = template
+        return template
+
+
 class Generator:
     """Generate the output from a source.
 
     Attributes:
-        src (iterable of str): the source lines
+        src (iterable of str, or Template): the source lines
+        lines (str list, or int => str dict): the source lines being processed,
+            indexed by line number; only holds the current line when streaming
         state (GeneratorState): the current generator state
+        streaming (bool): whether to process src one line at a time,
+            instead of compiling the whole file first
     """
 
-    command_prefix_re = re.compile(r'^(["!#]@)(.+)$')
+    SPAN_TEXT = 'text'
+    SPAN_MASKED = 'masked'
+    SPAN_LINE = 'line'
 
-    def __init__(self, src, commands, config):
+    def __init__(self, src, commands, config, streaming=False):
         self.src = src
+        self.lines = None
+        self.streaming = streaming and not isinstance(src, Template)
         self.config = config
         self.state = GeneratorState()
         self.commands_by_key = {}
@@ -442,45 +777,117 @@ class Generator:
                     )
                 self.commands_by_key[key] = command
 
-    def __iter__(self):
+    def compile(self, lines):
+        return Template.compile(lines, self.commands_by_key)
+
+    def get_template(self):
+        if isinstance(self.src, Template):
+            return self.src
+        template_cache = self.config.template_cache
+        if template_cache is None:
+            return self.compile(self.src)
+        return template_cache.get(list(self.src), self.compile)
+
+    def _stream_ops(self, window):
+        """Compile source lines one at a time.
+
+        Only the current line is kept, in the 'window' dict.
+        """
         for lineno, line in enumerate(self.src):
-            self.state.advance_to(lineno)
-
-            match = self.command_prefix_re.match(line)
-            if match:
-                prefix, command = match.groups()
-                output = self.handle_line(prefix, command)
-
-            # If displaying the line, replace placeholders.
-            elif self.state.in_published_block:
-                updated_line = line
-                for var, value in self.state.context.items():
-                    pattern = '@@%s@@' % var
-                    updated_line = updated_line.replace(pattern, value)
-                output = updated_line
-
-            # Not displaying the line
+            window.clear()
+            window[lineno] = line
+            yield Template.compile_line(lineno, line, self.commands_by_key)
+
+    def _load(self):
+        """Retrieve the source lines and operations to run.
+
+        Returns:
+            (lines, ops): lines is indexable by line number
+        """
+        if self.streaming:
+            lines = {}
+            return lines, self._stream_ops(lines)
+        template = self.get_template()
+        return template.lines, template.ops
+
+    def _iter_spans(self, ops):
+        for op in ops:
+            kind = op[0]
+
+            if kind == Template.OP_TEXT:
+                _kind, start, end = op
+                if self.state.in_published_block:
+                    yield (self.SPAN_TEXT, start, end, None)
+                else:
+                    yield (self.SPAN_MASKED, start, end, None)
+
+            elif kind == Template.OP_SUBST:
+                lineno = op[1]
+                # If displaying the line, replace placeholders.
+                if self.state.in_published_block:
+                    block_stack = self.state.block_stack
+                    try:
+                        updated_line = block_stack.substitute(self.lines[lineno], strict=self.config.strict)
+                    except KeyError as e:
+                        self.state.advance_to(lineno)
+                        self.state.error("Unknown placeholder %s", e.args[0])
+                    yield (self.SPAN_LINE, lineno, lineno + 1, updated_line)
+                else:
+                    yield (self.SPAN_MASKED, lineno, lineno + 1, None)
+
+            elif kind == Template.OP_MASKED:
+                yield (self.SPAN_MASKED, op[1], op[1] + 1, None)
+
+            elif kind == Template.OP_ESCAPED:
+                _kind, lineno, output = op
+                yield (self.SPAN_LINE, lineno, lineno + 1, output)
+
             else:
-                output = None
+                assert kind == Template.OP_COMMAND
+                _kind, lineno, name, args = op
+                self.state.advance_to(lineno)
+                self.handle_command(name, args)
+                yield (self.SPAN_MASKED, lineno, lineno + 1, None)
 
-            yield Line(output, line)
+    def iter_spans(self):
+        """Yield the output of consecutive source lines.
 
-    def handle_line(self, prefix, command):
-        if command.startswith('#'):
-            # A comment
-            return None
+        Once the generator is exhausted, the source lines are available in
+        self.lines (unless streaming).
 
-        elif command.startswith('@'):
-            # An escaped line
-            return prefix + command[1:]
+        Yields:
+            (kind, start, end, output) tuples, where kind is one of:
+            - SPAN_TEXT: lines[start:end] are output unchanged
+            - SPAN_MASKED: lines[start:end] have no output
+            - SPAN_LINE: lines[start] (with end == start + 1) is output as 'output'
+        """
+        self.lines, ops = self._load()
+        return self._iter_spans(ops)
+
+    def iter_output(self):
+        """Yield output lines only, without pairing them with source lines."""
+        for kind, start, end, output in self.iter_spans():
+            if kind == self.SPAN_TEXT:
+                if end - start == 1:
+                    # Always the case when streaming, where self.lines only holds one line.
+                    yield self.lines[start]
+                else:
+                    yield from self.lines[start:end]
+            elif kind == self.SPAN_LINE:
+                yield output
 
-        else:
-            if ' ' in command:
-                name, args = command.split(' ', 1)
+    def __iter__(self):
+        for kind, start, end, output in self.iter_spans():
+            lines = self.lines
+            if kind == self.SPAN_TEXT:
+                for lineno in range(start, end):
+                    line = lines[lineno]
+                    yield Line(line, line)
+            elif kind == self.SPAN_MASKED:
+                for lineno in range(start, end):
+                    yield Line(None, lines[lineno])
             else:
-                name, args = command, ''
-            self.handle_command(name, args)
-            return None
+                yield Line(output, lines[start])
 
     def handle_command(self, command, args):
         """Handle a "#@<command>" line."""
@@ -492,16 +899,30 @@ class Generator:
 
 
 class GeneratorConfig:
-    def __init__(self, categories, commands, fs, generator=Generator):
-        self.categories = categories
+    def __init__(
+            self, categories, commands, fs, generator=Generator, template_cache=None, dependencies=None,
+            universe=None, strict=False):
+        self.categories = frozenset(categories)
+        self.strict = strict
+        self.universe = universe
+        self.category_mask = universe.mask(self.categories) if universe is not None else None
         self.commands = commands
         self.fs = fs
         self.fs_root = '/'
         self.generator_class = generator
+        self.template_cache = template_cache
+        self.dependencies = set() if dependencies is None else dependencies
+
+    def test(self, rule):
+        """Test whether a rule matches the active categories."""
+        if self.universe is None:
+            return rule.test(self.categories)
+        return rule.test_mask(self.category_mask, self.universe)
 
-    def load(self, source_file):
+    def load(self, source_file, streaming=False):
         return self.generator_class(
             source_file,
             config=self,
             commands=self.commands,
+            streaming=streaming,
         )
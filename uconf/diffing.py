@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2013 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+"""Line-based diff algorithms.
+
+All algorithms work on lines interned to integers, after trimming the
+common prefix and suffix, and return difflib-compatible opcodes.
+"""
+
+import bisect
+import difflib
+import math
+
+
+MYERS = 'myers'
+PATIENCE = 'patience'
+DIFFLIB = 'difflib'
+
+ALGORITHMS = (MYERS, PATIENCE, DIFFLIB)
+DEFAULT_ALGORITHM = MYERS
+
+# Minimal number of edits before giving up on finding the shortest diff
+MIN_COST = 64
+
+# Diagonals Myers' algorithm may explore, per line of input, with a floor for
+# small inputs. Past that, huge and unrelated files are only split around
+# lines appearing once on both sides, in linear time.
+COST_PER_LINE = 10
+MIN_BUDGET = 100000
+
+
+class _Budget:
+    """The number of diagonals Myers' algorithm may still explore."""
+
+    def __init__(self, left):
+        self.left = left
+
+
+def intern_lines(original, modified):
+    """Map lines to integers, equal lines getting the same integer.
+
+    Returns:
+        (int list, int list): the interned original and modified lines
+    """
+    ids = {}
+    original_ids = [ids.setdefault(line, len(ids)) for line in original]
+    modified_ids = [ids.setdefault(line, len(ids)) for line in modified]
+    return original_ids, modified_ids
+
+
+def _bisect(a, b, a_lo, a_hi, b_lo, b_hi, budget):
+    """Find the middle of the shortest edit script between two ranges.
+
+    Runs Myers' algorithm from both ends at once, in linear space.
+    Past max_cost edits, or once the budget is spent, gives up on a minimal
+    script and splits at the furthest point reached from the start, to
+    bound the running time on very different ranges.
+
+    Returns:
+        (int, int): offsets, in both ranges, where the script can be split;
+            None if the ranges have nothing in common
+    """
+    n = a_hi - a_lo
+    m = b_hi - b_lo
+    max_d = (n + m + 1) // 2
+    v_offset = max_d
+    v_length = 2 * max_d + 2
+    forward = [-1] * v_length
+    forward[v_offset + 1] = 0
+    backward = [-1] * v_length
+    backward[v_offset + 1] = 0
+
+    delta = n - m
+    # With an odd delta, the forward path reaches the overlap first.
+    check_forward = delta % 2 != 0
+    # Diagonals which already went out of the box
+    k1_start = k1_end = k2_start = k2_end = 0
+    max_cost = max(MIN_COST, int(math.sqrt(n + m)))
+    best = None
+
+    for d in range(max_d):
+        budget.left -= 2 * d + 2
+        if d > max_cost or budget.left < 0:
+            return best
+        for k1 in range(-d + k1_start, d + 1 - k1_end, 2):
+            k1_offset = v_offset + k1
+            if k1 == -d or (k1 != d and forward[k1_offset - 1] < forward[k1_offset + 1]):
+                x1 = forward[k1_offset + 1]
+            else:
+                x1 = forward[k1_offset - 1] + 1
+            y1 = x1 - k1
+            while x1 < n and y1 < m and a[a_lo + x1] == b[b_lo + y1]:
+                x1 += 1
+                y1 += 1
+            forward[k1_offset] = x1
+            if x1 <= n and y1 <= m and 0 < x1 + y1 < n + m and (best is None or x1 + y1 > sum(best)):
+                best = (x1, y1)
+
+            if x1 > n:
+                k1_end += 2
+            elif y1 > m:
+                k1_start += 2
+            elif check_forward:
+                k2_offset = v_offset + delta - k1
+                if 0 <= k2_offset < v_length and backward[k2_offset] != -1:
+                    if x1 >= n - backward[k2_offset]:
+                        return x1, y1
+
+        for k2 in range(-d + k2_start, d + 1 - k2_end, 2):
+            k2_offset = v_offset + k2
+            if k2 == -d or (k2 != d and backward[k2_offset - 1] < backward[k2_offset + 1]):
+                x2 = backward[k2_offset + 1]
+            else:
+                x2 = backward[k2_offset - 1] + 1
+            y2 = x2 - k2
+            while x2 < n and y2 < m and a[a_hi - x2 - 1] == b[b_hi - y2 - 1]:
+                x2 += 1
+                y2 += 1
+            backward[k2_offset] = x2
+
+            if x2 > n:
+                k2_end += 2
+            elif y2 > m:
+                k2_start += 2
+            elif not check_forward:
+                k1_offset = v_offset + delta - k2
+                if 0 <= k1_offset < v_length and forward[k1_offset] != -1:
+                    x1 = forward[k1_offset]
+                    if x1 >= n - x2:
+                        return x1, x1 - (k1_offset - v_offset)
+
+    return None
+
+
+def _split_myers(a, b, a_lo, a_hi, b_lo, b_hi, budget):
+    """Split a range around the middle of its shortest edit script.
+
+    Returns:
+        ((int, int, int) list, box list): matching blocks, and ranges left to diff
+    """
+    if budget.left >= 0:
+        split = _bisect(a, b, a_lo, a_hi, b_lo, b_hi, budget)
+        if split is not None:
+            x, y = split
+            return [], [(a_lo, a_lo + x, b_lo, b_lo + y), (a_lo + x, a_hi, b_lo + y, b_hi)]
+        elif budget.left >= 0:
+            # Nothing in common
+            return [], []
+
+    # Out of budget: only match unique lines; other lines of the range are replaced.
+    return _split_unique(a, b, a_lo, a_hi, b_lo, b_hi) or ([], [])
+
+
+def _unique_positions(seq, lo, hi):
+    positions = {}
+    for i in range(lo, hi):
+        item = seq[i]
+        positions[item] = -1 if item in positions else i
+    return positions
+
+
+def _longest_increasing(pairs):
+    """Longest subsequence of (i, j) pairs, sorted by i, whose j also increase."""
+    tails = []  # index in pairs of the smallest tail of each subsequence length
+    tail_values = []
+    previous = [None] * len(pairs)
+    for index, (_i, j) in enumerate(pairs):
+        length = bisect.bisect_left(tail_values, j)
+        if length > 0:
+            previous[index] = tails[length - 1]
+        if length == len(tails):
+            tails.append(index)
+            tail_values.append(j)
+        else:
+            tails[length] = index
+            tail_values[length] = j
+
+    result = []
+    index = tails[-1] if tails else None
+    while index is not None:
+        result.append(pairs[index])
+        index = previous[index]
+    result.reverse()
+    return result
+
+
+def _split_unique(a, b, a_lo, a_hi, b_lo, b_hi):
+    """Split a range around lines appearing exactly once on both sides.
+
+    Returns:
+        ((int, int, int) list, box list): matching blocks, and ranges left to
+            diff; None if there is no such line
+    """
+    a_unique = _unique_positions(a, a_lo, a_hi)
+    b_unique = _unique_positions(b, b_lo, b_hi)
+    pairs = [
+        (i, b_unique[item])
+        for item, i in a_unique.items()
+        if i != -1 and b_unique.get(item, -1) != -1
+    ]
+    if not pairs:
+        return None
+
+    pairs.sort()
+    anchors = _longest_increasing(pairs)
+    matches = [(i, j, 1) for i, j in anchors]
+    boxes = []
+    prev_i, prev_j = a_lo, b_lo
+    for i, j in anchors:
+        boxes.append((prev_i, i, prev_j, j))
+        prev_i, prev_j = i + 1, j + 1
+    boxes.append((prev_i, a_hi, prev_j, b_hi))
+    return matches, boxes
+
+
+def _split_patience(a, b, a_lo, a_hi, b_lo, b_hi, budget):
+    """Split a range around unique lines, falling back to Myers without any."""
+    split = _split_unique(a, b, a_lo, a_hi, b_lo, b_hi)
+    if split is None:
+        return _split_myers(a, b, a_lo, a_hi, b_lo, b_hi, budget)
+    return split
+
+
+SPLITTERS = {
+    MYERS: _split_myers,
+    PATIENCE: _split_patience,
+}
+
+
+def get_matching_blocks(a, b, algorithm=DEFAULT_ALGORITHM):
+    """Find matching blocks between two sequences of hashable items.
+
+    Returns:
+        (int, int, int) list: sorted (i, j, size) blocks, a[i:i+size] == b[j:j+size]
+    """
+    if not set(a).intersection(b):
+        # Unrelated sequences: don't spend the budget on finding it out.
+        return []
+
+    split = SPLITTERS[algorithm]
+    budget = _Budget(max(MIN_BUDGET, COST_PER_LINE * (len(a) + len(b))))
+    matches = []
+    boxes = [(0, len(a), 0, len(b))]
+    while boxes:
+        a_lo, a_hi, b_lo, b_hi = boxes.pop()
+
+        # Common prefix and suffix
+        start = 0
+        while a_lo + start < a_hi and b_lo + start < b_hi and a[a_lo + start] == b[b_lo + start]:
+            start += 1
+        if start:
+            matches.append((a_lo, b_lo, start))
+            a_lo += start
+            b_lo += start
+
+        end = 0
+        while a_lo < a_hi - end and b_lo < b_hi - end and a[a_hi - end - 1] == b[b_hi - end - 1]:
+            end += 1
+        if end:
+            a_hi -= end
+            b_hi -= end
+            matches.append((a_hi, b_hi, end))
+
+        if a_lo == a_hi or b_lo == b_hi:
+            continue
+
+        box_matches, box_boxes = split(a, b, a_lo, a_hi, b_lo, b_hi, budget)
+        matches.extend(box_matches)
+        boxes.extend(box_boxes)
+
+    # Merge adjacent blocks
+    blocks = []
+    for i, j, size in sorted(matches):
+        if blocks and blocks[-1][0] + blocks[-1][2] == i and blocks[-1][1] + blocks[-1][2] == j:
+            blocks[-1] = (blocks[-1][0], blocks[-1][1], blocks[-1][2] + size)
+        else:
+            blocks.append((i, j, size))
+    return blocks
+
+
+def get_opcodes(original, modified, algorithm=DEFAULT_ALGORITHM):
+    """Compute the differences between two lists of lines.
+
+    Returns:
+        (tag, i1, i2, j1, j2) list: as difflib.SequenceMatcher.get_opcodes()
+    """
+    if algorithm not in ALGORITHMS:
+        raise ValueError("Invalid diff algorithm %s, choose one of %s" % (
+            algorithm, ', '.join(ALGORITHMS)))
+
+    if algorithm == DIFFLIB:
+        return difflib.SequenceMatcher(a=original, b=modified).get_opcodes()
+
+    a, b = intern_lines(original, modified)
+    opcodes = []
+    i = j = 0
+    for block_i, block_j, size in get_matching_blocks(a, b, algorithm) + [(len(a), len(b), 0)]:
+        if i < block_i and j < block_j:
+            opcodes.append(('replace', i, block_i, j, block_j))
+        elif i < block_i:
+            opcodes.append(('delete', i, block_i, j, j))
+        elif j < block_j:
+            opcodes.append(('insert', i, i, j, block_j))
+        if size:
+            opcodes.append(('equal', block_i, block_i + size, block_j, block_j + size))
+        i, j = block_i + size, block_j + size
+    return opcodes
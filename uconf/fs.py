@@ -4,11 +4,25 @@
 
 """Abstract the filesystem layer."""
 
+import contextlib
+import errno
+import hashlib
+import io
+import itertools
 import logging
+import os
+import stat
+import sys
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Not on a Unix
+    fcntl = None
 
 import fslib
-import fslib.builders
-import fslib.stacking
+import fslib.exceptions
 
 
 logger = logging.getLogger(__name__)
@@ -17,50 +31,784 @@ logger = logging.getLogger(__name__)
 FSError = fslib.FSError
 
 
+# From linux/fs.h: share the blocks of a file with another one.
+FICLONE = 0x40049409
+
+# Errors meaning that a copy method is not available for a pair of files.
+_UNSUPPORTED_COPY_ERRNOS = {
+    errno.EBADF, errno.EINVAL, errno.ENOSYS, errno.ENOTSUP, errno.ENOTTY,
+    errno.EOPNOTSUPP, errno.EPERM, errno.EXDEV,
+}
+
+
+def _copy_with(copy_chunk, size):
+    """Copy data with a kernel-assisted method, chunk by chunk.
+
+    Returns:
+        bool: whether the copy was performed; False if the method is not
+            supported for those files, or copied nothing (e.g. on procfs or
+            some FUSE filesystems)
+    """
+    copied = 0
+    while copied < size:
+        try:
+            written = copy_chunk(min(size - copied, 1 << 30), copied)
+        except OSError as e:
+            if copied == 0 and e.errno in _UNSUPPORTED_COPY_ERRNOS:
+                return False
+            raise
+        if written == 0:
+            if copied == 0:
+                return False
+            # Source file shrunk during the copy
+            break
+        copied += written
+    return True
+
+
+def copy_data(src_fd, dst_fd, size, reflink=False):
+    """Copy 'size' bytes from a file descriptor to another.
+
+    Tries, in order: a reflink (if requested), copy_file_range, sendfile and
+    a buffered copy.
+    """
+    if reflink and fcntl is not None and sys.platform.startswith('linux'):
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+            return
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_COPY_ERRNOS:
+                raise
+
+    def copy_file_range(count, offset):
+        return os.copy_file_range(src_fd, dst_fd, count, offset_src=offset, offset_dst=offset)
+
+    def sendfile(count, offset):
+        # Writes at the current position of dst_fd, which is the start of the file.
+        return os.sendfile(dst_fd, src_fd, offset, count)
+
+    if hasattr(os, 'copy_file_range') and _copy_with(copy_file_range, size):
+        return
+    if hasattr(os, 'sendfile') and sys.platform.startswith('linux') and _copy_with(sendfile, size):
+        return
+
+    os.lseek(src_fd, 0, os.SEEK_SET)
+    os.lseek(dst_fd, 0, os.SEEK_SET)
+    for chunk in iter(lambda: os.read(src_fd, 1 << 20), b''):
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(dst_fd, view):]
+
+
+class OSFileSystem:
+    """Direct access to the local filesystem, only writable below some paths.
+
+    Provides the same interface as the fslib.FileSystem used for dry-runs,
+    without its layers of mounts and wrappers.
+
+    Attributes:
+        write_paths (str list): absolute paths of the writable folders
+        files_encoding (str): the default encoding for text files
+    """
+
+    def __init__(self, write_paths, files_encoding='utf-8'):
+        self.write_paths = [os.path.abspath(path) for path in write_paths]
+        self.files_encoding = files_encoding
+
+    def __repr__(self):
+        return '<OSFileSystem: %s>' % ', '.join(self.write_paths)
+
+    def check_writable(self, path):
+        """Ensure a path lies within the writable folders."""
+        path = os.path.abspath(path)
+        for write_path in self.write_paths:
+            if path == write_path or path.startswith(write_path.rstrip(os.sep) + os.sep):
+                return
+        raise fslib.exceptions.EROFS(path)
+
+    # Read
+    # ----
+
+    def access(self, path, read=True, write=False, follow=True):
+        mode = os.F_OK
+        if read:
+            mode |= os.R_OK
+        if write:
+            mode |= os.W_OK
+        return os.access(path, mode, follow_symlinks=follow)
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def lstat(self, path):
+        return os.lstat(path)
+
+    def file_exists(self, path):
+        return os.path.isfile(path)
+
+    def dir_exists(self, path):
+        return os.path.isdir(path)
+
+    def symlink_exists(self, path):
+        return os.path.islink(path)
+
+    def read_one_line(self, path, encoding=None):
+        with self.open(path, 'rt', encoding=encoding) as f:
+            return f.readline().strip()
+
+    def readlines(self, path, encoding=None):
+        """Yield lines of a file, without their terminating \\n."""
+        with self.open(path, 'rt', encoding=encoding) as f:
+            for line in f:
+                yield line[:-1]
+
+    def get_hash(self, filename, method=hashlib.md5):
+        file_hash = method()
+        with open(filename, 'rb') as f:
+            for data in iter(lambda: f.read(1 << 20), b''):
+                file_hash.update(data)
+        return file_hash
+
+    def readlink(self, path):
+        return os.readlink(path)
+
+    # Read/write
+    # ----------
+
+    def open(self, path, mode, encoding=None):
+        if any(flag in mode for flag in 'wax+'):
+            self.check_writable(path)
+        if 'b' in mode:
+            return open(path, mode)
+        return open(path, mode, encoding=encoding or self.files_encoding)
+
+    # Write
+    # -----
+
+    def mkdir(self, path):
+        self.check_writable(path)
+        os.mkdir(path)
+
+    def makedirs(self, path):
+        if not self.dir_exists(path):
+            self.check_writable(path)
+            os.makedirs(path, exist_ok=True)
+
+    def chmod(self, path, mode):
+        self.check_writable(path)
+        os.chmod(path, stat.S_IMODE(mode))
+
+    def chown(self, path, uid, gid):
+        self.check_writable(path)
+        os.chown(path, uid, gid)
+
+    def symlink(self, link_name, target):
+        self.check_writable(link_name)
+        os.symlink(target, link_name)
+
+    def create_symlink(self, link_name, target, relative=False, force=False):
+        if relative:
+            raise NotImplementedError("Need to implement relative=True.")
+
+        try:
+            file_stat = self.lstat(link_name)
+        except FileNotFoundError:
+            file_stat = None
+
+        if file_stat is not None:
+            if not stat.S_ISLNK(file_stat.st_mode) and not force:
+                raise fslib.exceptions.EEXIST(link_name)
+            elif stat.S_ISDIR(file_stat.st_mode):
+                raise fslib.exceptions.EISDIR(link_name)
+            else:
+                self.remove(link_name)
+
+        self.symlink(link_name, target)
+
+    def copy(self, source, destination, copy_mode=True, copy_user=False, reflink=False):
+        """Copy a file, atomically.
+
+        The data is copied by the kernel when possible; with reflink=True,
+        the destination may even share the source's blocks (copy-on-write).
+        """
+        self.check_writable(destination)
+        destination = os.path.realpath(destination)
+        stats = os.stat(source)
+        with open(source, 'rb') as src, self._atomic_write(destination, 'wb') as dst:
+            copy_data(src.fileno(), dst.fileno(), stats.st_size, reflink=reflink)
+            if copy_mode:
+                os.chmod(dst.fileno(), stat.S_IMODE(stats.st_mode))
+            if copy_user:
+                os.chown(dst.fileno(), stats.st_uid, stats.st_gid)
+
+    def rename(self, source, destination):
+        """Move a file, replacing the destination."""
+        self.check_writable(source)
+        self.check_writable(destination)
+        os.replace(source, destination)
+
+    def writelines(self, path, lines, encoding=None):
+        """Write a set of lines to a file, atomically.
+
+        Lines are written to a temporary file, which then replaces the target;
+        its mode and owner are preserved, and symlinks are followed.
+        Readers never see a half-written file, and lines are never all held
+        in memory.
+        """
+        self.check_writable(path)
+        path = os.path.realpath(path)
+        with self._atomic_write(path, 'wt', encoding=encoding or self.files_encoding) as f:
+            for line in lines:
+                f.write('%s\n' % line)
+            f.flush()
+            if os.path.isfile(path):
+                self._copy_metadata(path, f.fileno())
+
+    @contextlib.contextmanager
+    def _atomic_write(self, path, mode, encoding=None):
+        """Open a temporary file, replacing 'path' once successfully closed."""
+        temp_path = os.path.join(
+            os.path.dirname(path),
+            '.%s.uconf-%d.new' % (os.path.basename(path), os.getpid()),
+        )
+        try:
+            with open(temp_path, mode, encoding=encoding) as f:
+                yield f
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.lexists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def _copy_metadata(self, source, destination):
+        """Copy the mode and owner of a file to another one (path or file descriptor)."""
+        stats = os.stat(source)
+        os.chmod(destination, stat.S_IMODE(stats.st_mode))
+        temp_stats = os.stat(destination)
+        if (temp_stats.st_uid, temp_stats.st_gid) != (stats.st_uid, stats.st_gid):
+            try:
+                os.chown(destination, stats.st_uid, stats.st_gid)
+            except PermissionError:
+                logger.warning("Unable to preserve owner of %s", source)
+
+    # Delete
+    # ------
+
+    def remove(self, path):
+        self.check_writable(path)
+        if os.path.isdir(path) and not os.path.islink(path):
+            os.rmdir(path)
+        else:
+            os.unlink(path)
+
+
+class DryRunChange:
+    """A change which a dry-run would have made to a path.
+
+    Attributes:
+        path (str): the absolute path
+        kind (str): the new type of the path: FILE, SYMLINK, DIRECTORY or REMOVED
+        mode (int): the new permission bits
+        size (int): the new size, in bytes
+        hasher: the hashlib object holding the new content's digest, for files
+        target (str): the target of a symlink
+        spill_path (str): where a copy of the new content was kept, if any
+        old_hash (str): the hex digest of the previous content, None if it
+            wasn't a regular file
+        old_size (int): the previous size, None if the path didn't exist
+        old_mode (int): the previous permission bits, None if the path didn't exist
+    """
+
+    FILE = 'file'
+    SYMLINK = 'symlink'
+    DIRECTORY = 'directory'
+    REMOVED = 'removed'
+
+    __slots__ = (
+        'path', 'kind', 'mode', 'size', 'hasher', 'target', 'spill_path',
+        'old_hash', 'old_size', 'old_mode', 'inode', 'mtime_ns',
+    )
+
+    def __init__(self, path, kind, mode=0, size=0, hasher=None, target=None, spill_path=None,
+                 old_hash=None, old_size=None, old_mode=None, inode=0):
+        self.path = path
+        self.kind = kind
+        self.mode = mode
+        self.size = size
+        self.hasher = hasher
+        self.target = target
+        self.spill_path = spill_path
+        self.old_hash = old_hash
+        self.old_size = old_size
+        self.old_mode = old_mode
+        self.inode = inode
+        self.mtime_ns = time.time_ns()
+
+    @property
+    def new_hash(self):
+        """The hex digest of the new content, for files."""
+        return self.hasher.hexdigest() if self.hasher is not None else None
+
+    def __repr__(self):
+        return '<DryRunChange: %s %s>' % (self.kind, self.path)
+
+    def __str__(self):
+        if self.kind == self.REMOVED:
+            return "Would remove %s" % self.path
+        if self.kind == self.DIRECTORY:
+            return "Would create directory %s" % self.path
+        if self.kind == self.SYMLINK:
+            return "Would link %s -> %s" % (self.path, self.target)
+
+        if self.old_mode is None:
+            return "Would create %s (%d bytes, %s %s)" % (
+                self.path, self.size, self.hasher.name, self.new_hash)
+        if self.old_hash == self.new_hash:
+            if self.old_mode != self.mode:
+                return "Would change mode of %s to %o" % (self.path, self.mode)
+            return "Would rewrite %s, unchanged" % self.path
+        return "Would update %s (%d bytes, %s %s -> %s)" % (
+            self.path, self.size, self.hasher.name, self.old_hash, self.new_hash)
+
+
+class _DryRunSink(io.RawIOBase):
+    """A write-only stream keeping only the digest and size of its data.
+
+    The data may also be copied to a 'spill' file. Once closed, the content
+    is recorded by calling on_close(sink), unless discard() was called.
+    """
+
+    def __init__(self, hasher, on_close, spill_file=None):
+        super().__init__()
+        self.hasher = hasher
+        self.size = 0
+        self.on_close = on_close
+        self.spill_file = spill_file
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.hasher.update(data)
+        self.size += len(data)
+        if self.spill_file is not None:
+            self.spill_file.write(data)
+        return len(data)
+
+    def discard(self):
+        self.on_close = None
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        if self.spill_file is not None:
+            self.spill_file.close()
+            if self.on_close is None:
+                os.unlink(self.spill_file.name)
+        if self.on_close is not None:
+            self.on_close(self)
+
+
+class DryRunFileSystem(OSFileSystem):
+    """Pretend to write to the local filesystem.
+
+    Writes are only recorded as DryRunChange objects: the new content goes
+    through a hasher and is then dropped, unless 'spill' is set, in which
+    case it is kept in a temporary folder. Reading back content written
+    earlier in the run requires 'spill'; its metadata and digest are always
+    available.
+
+    Attributes:
+        hash_algorithm (str): the hashlib digest computed for new content
+        spill (bool): whether to keep new content in temporary files
+        changes (str => DryRunChange dict): recorded changes, by absolute path
+    """
+
+    def __init__(self, write_paths, files_encoding='utf-8', hash_algorithm='md5', spill=False):
+        super().__init__(write_paths, files_encoding=files_encoding)
+        self.hash_algorithm = hash_algorithm
+        self.hash_method = getattr(hashlib, hash_algorithm)
+        self.spill = spill
+        self.changes = {}
+        self._spill_dir = None
+        self._spill_ids = itertools.count()
+        self._inodes = itertools.count(1)
+
+    def __repr__(self):
+        return '<DryRunFileSystem: %s>' % ', '.join(self.write_paths)
+
+    def get_changes(self):
+        """Retrieve recorded changes, sorted by path."""
+        return [self.changes[path] for path in sorted(self.changes)]
+
+    # Recording changes
+    # -----------------
+
+    def _get_disk_state(self, path):
+        """Retrieve the (hash, size, mode) of a path on disk, before any change."""
+        try:
+            stats = os.lstat(path)
+        except FileNotFoundError:
+            return None, None, None
+        digest = None
+        if stat.S_ISREG(stats.st_mode):
+            digest = super().get_hash(path, method=self.hash_method).hexdigest()
+        return digest, stats.st_size, stat.S_IMODE(stats.st_mode)
+
+    def _record(self, path, kind, **kwargs):
+        previous = self.changes.get(path)
+        if previous is None:
+            old_hash, old_size, old_mode = self._get_disk_state(path)
+        else:
+            old_hash, old_size, old_mode = previous.old_hash, previous.old_size, previous.old_mode
+            if previous.spill_path is not None and previous.spill_path != kwargs.get('spill_path'):
+                os.unlink(previous.spill_path)
+
+        if kind == DryRunChange.REMOVED and old_mode is None:
+            # Created, then removed, within the run
+            self.changes.pop(path, None)
+            return None
+
+        change = DryRunChange(
+            path, kind,
+            old_hash=old_hash, old_size=old_size, old_mode=old_mode,
+            inode=next(self._inodes),
+            **kwargs
+        )
+        self.changes[path] = change
+        return change
+
+    def _get_change(self, path, follow=True):
+        """Retrieve the change recorded for a path, None if it is unchanged.
+
+        Raises:
+            FileNotFoundError: if the path was removed
+        """
+        path = self._resolve(path) if follow else os.path.abspath(path)
+        change = self.changes.get(path)
+        if change is not None and change.kind == DryRunChange.REMOVED:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        return change
+
+    def _resolve(self, path):
+        """Follow symlinks, recorded or on disk, at the end of a path."""
+        path = os.path.abspath(path)
+        for _i in range(40):
+            change = self.changes.get(path)
+            if change is not None:
+                if change.kind != DryRunChange.SYMLINK:
+                    return path
+                target = change.target
+            elif os.path.islink(path):
+                target = os.readlink(path)
+            else:
+                return path
+            path = os.path.abspath(os.path.join(os.path.dirname(path), target))
+        raise OSError(errno.ELOOP, os.strerror(errno.ELOOP), path)
+
+    def _get_spill_path(self):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.TemporaryDirectory(prefix='uconf-dry-run-')
+        return os.path.join(self._spill_dir.name, '%d' % next(self._spill_ids))
+
+    def _get_content_path(self, change):
+        """Retrieve a file holding the content written to a path."""
+        if change.spill_path is None:
+            raise FSError(
+                errno.ENODATA,
+                "Content written during the dry-run was not kept (set dry_run_spill): %r" % change.path,
+            )
+        return change.spill_path
+
+    def _get_new_mode(self, path, file_mode=None):
+        """The mode of a file after writing to it: kept unless file_mode is set."""
+        if file_mode is not None:
+            return file_mode
+        try:
+            return stat.S_IMODE(self.stat(path).st_mode)
+        except FileNotFoundError:
+            return 0o644
+
+    def _open_for_write(self, path, mode, encoding=None, file_mode=None):
+        """Open a stream recording a new content for a file once closed.
+
+        Returns:
+            (stream, _DryRunSink): the stream to write to, and its sink
+        """
+        if 'a' in mode or '+' in mode:
+            raise NotImplementedError("Dry-runs only support writing whole files.")
+        file_mode = self._get_new_mode(path, file_mode)
+
+        def record(sink):
+            self._record(
+                path, DryRunChange.FILE,
+                mode=file_mode, size=sink.size, hasher=sink.hasher,
+                spill_path=spill_file.name if spill_file is not None else None,
+            )
+
+        spill_file = open(self._get_spill_path(), 'wb') if self.spill else None
+        sink = _DryRunSink(self.hash_method(), record, spill_file=spill_file)
+        stream = io.BufferedWriter(sink)
+        if 'b' not in mode:
+            stream = io.TextIOWrapper(stream, encoding=encoding or self.files_encoding)
+        return stream, sink
+
+    # Read
+    # ----
+
+    def _make_stat(self, change):
+        kind = {
+            DryRunChange.FILE: stat.S_IFREG,
+            DryRunChange.SYMLINK: stat.S_IFLNK,
+            DryRunChange.DIRECTORY: stat.S_IFDIR,
+        }[change.kind]
+        seconds = change.mtime_ns // 10 ** 9
+        return os.stat_result((
+            kind | change.mode, change.inode, 0, 1, os.getuid(), os.getgid(), change.size,
+            seconds, seconds, seconds,
+            change.mtime_ns / 10 ** 9, change.mtime_ns / 10 ** 9, change.mtime_ns / 10 ** 9,
+            change.mtime_ns, change.mtime_ns, change.mtime_ns,
+        ))
+
+    def access(self, path, read=True, write=False, follow=True):
+        try:
+            change = self._get_change(path, follow=follow)
+        except FileNotFoundError:
+            return False
+        if change is None:
+            return super().access(path, read=read, write=write, follow=follow)
+        return True
+
+    def stat(self, path):
+        change = self._get_change(path)
+        if change is None:
+            return os.stat(self._resolve(path))
+        return self._make_stat(change)
+
+    def lstat(self, path):
+        change = self._get_change(path, follow=False)
+        if change is None:
+            return os.lstat(path)
+        return self._make_stat(change)
+
+    def file_exists(self, path):
+        try:
+            return stat.S_ISREG(self.stat(path).st_mode)
+        except OSError:
+            return False
+
+    def dir_exists(self, path):
+        try:
+            return stat.S_ISDIR(self.stat(path).st_mode)
+        except OSError:
+            return False
+
+    def symlink_exists(self, path):
+        try:
+            return stat.S_ISLNK(self.lstat(path).st_mode)
+        except OSError:
+            return False
+
+    def get_hash(self, filename, method=hashlib.md5):
+        change = self._get_change(filename)
+        if change is None:
+            return super().get_hash(self._resolve(filename), method=method)
+        if change.kind != DryRunChange.FILE:
+            raise fslib.exceptions.EISDIR(filename)
+        if method is self.hash_method:
+            return change.hasher.copy()
+        return super().get_hash(self._get_content_path(change), method=method)
+
+    def readlink(self, path):
+        change = self._get_change(path, follow=False)
+        if change is None:
+            return os.readlink(path)
+        if change.kind != DryRunChange.SYMLINK:
+            raise fslib.exceptions.EINVAL(path)
+        return change.target
+
+    # Read/write
+    # ----------
+
+    def open(self, path, mode, encoding=None):
+        if any(flag in mode for flag in 'wax+'):
+            self.check_writable(path)
+            if 'x' in mode and self.access(path, follow=False):
+                raise fslib.exceptions.EEXIST(path)
+            stream, _sink = self._open_for_write(self._resolve(path), mode, encoding=encoding)
+            return stream
+
+        change = self._get_change(path)
+        if change is None:
+            return super().open(self._resolve(path), mode, encoding=encoding)
+        if change.kind != DryRunChange.FILE:
+            raise fslib.exceptions.EISDIR(path)
+        return super().open(self._get_content_path(change), mode, encoding=encoding)
+
+    # Write
+    # -----
+
+    def mkdir(self, path):
+        self.check_writable(path)
+        if self.access(path, follow=False):
+            raise fslib.exceptions.EEXIST(path)
+        self._record(os.path.abspath(path), DryRunChange.DIRECTORY, mode=0o755)
+
+    def makedirs(self, path):
+        path = os.path.abspath(path)
+        if self.dir_exists(path):
+            return
+        self.check_writable(path)
+        parent = os.path.dirname(path)
+        if parent != path:
+            self.makedirs(parent)
+        self.mkdir(path)
+
+    def chmod(self, path, mode):
+        self.check_writable(path)
+        path = self._resolve(path)
+        change = self._get_change(path, follow=False)
+        if change is None:
+            stats = self.stat(path)
+            if not stat.S_ISREG(stats.st_mode):
+                # Only the mode of regular files is tracked.
+                return
+            hasher = super().get_hash(path, method=self.hash_method)
+            change = self.changes[path] = DryRunChange(
+                path, DryRunChange.FILE,
+                mode=stat.S_IMODE(stats.st_mode), size=stats.st_size, hasher=hasher,
+                old_hash=hasher.hexdigest(), old_size=stats.st_size,
+                old_mode=stat.S_IMODE(stats.st_mode), inode=next(self._inodes),
+            )
+        change.mode = stat.S_IMODE(mode)
+
+    def chown(self, path, uid, gid):
+        self.check_writable(path)
+        # Owners are not tracked; only check that the path exists.
+        self.stat(path)
+
+    def symlink(self, link_name, target):
+        self.check_writable(link_name)
+        if self.access(link_name, follow=False):
+            raise fslib.exceptions.EEXIST(link_name)
+        self._record(
+            os.path.abspath(link_name), DryRunChange.SYMLINK,
+            mode=0o777, size=len(target), target=target,
+        )
+
+    def copy(self, source, destination, copy_mode=True, copy_user=False, reflink=False):
+        """Record the copy of a file, hashing its content."""
+        self.check_writable(destination)
+        destination = self._resolve(destination)
+        source_change = self._get_change(source)
+        source_mode = stat.S_IMODE(self.stat(source).st_mode)
+        file_mode = source_mode if copy_mode else None
+
+        if source_change is not None and source_change.spill_path is None:
+            # Only metadata is known: reuse it.
+            self._record(
+                destination, DryRunChange.FILE,
+                mode=self._get_new_mode(destination, file_mode),
+                size=source_change.size, hasher=source_change.hasher.copy(),
+            )
+            return
+
+        stream, _sink = self._open_for_write(destination, 'wb', file_mode=file_mode)
+        with self.open(source, 'rb') as src, stream:
+            for chunk in iter(lambda: src.read(1 << 20), b''):
+                stream.write(chunk)
+
+    def rename(self, source, destination):
+        """Record the move of a file or symlink."""
+        self.check_writable(source)
+        self.check_writable(destination)
+        source = os.path.abspath(source)
+        destination = os.path.abspath(destination)
+        if self.symlink_exists(source):
+            self.symlink(destination, self.readlink(source))
+        elif self.dir_exists(source):
+            raise fslib.exceptions.EISDIR(source)
+        else:
+            self.copy(source, destination)
+        self.remove(source)
+
+    def writelines(self, path, lines, encoding=None):
+        """Record the new content of a file, without keeping it."""
+        self.check_writable(path)
+        stream, sink = self._open_for_write(self._resolve(path), 'wt', encoding=encoding)
+        try:
+            for line in lines:
+                stream.write('%s\n' % line)
+        except BaseException:
+            sink.discard()
+            raise
+        finally:
+            stream.close()
+
+    # Delete
+    # ------
+
+    def remove(self, path):
+        self.check_writable(path)
+        path = os.path.abspath(path)
+        # Fails if missing
+        self.lstat(path)
+        self._record(path, DryRunChange.REMOVED)
+
+
 class FSLoader:
+    """The filesystem for a run, writable below some paths.
+
+    Uses the OS directly, unless in dry-run mode, where writes are only
+    recorded (see DryRunFileSystem).
+    """
+
     def __init__(self, *write_paths, **kwargs):
         self.dry_run = kwargs.pop('dry_run', False)
         self.default_encoding = kwargs.pop('default_encoding', 'utf-8')
         self.write_paths = write_paths
-        self.fs, self.subfs = self._prepare_fs(write_paths, dry_run=self.dry_run)
-
-    def _prepare_fs(self, paths, dry_run=False):
-        """Prepare the filesystem for a set of writable paths."""
-        base_fs = fslib.stacking.MountFS()
-        base = fslib.stacking.ReadOnlyFS(fslib.OSFS())
-        base_fs.mount_fs(base, fslib.ROOT)
-
-        sub_filesystems = {}
-
-        for path in paths:
-            subfs = fslib.OSFS(mapped_root=path)
-            if dry_run:
-                ro_fs = fslib.stacking.ReadOnlyFS(subfs)
-                mem_fs = fslib.builders.make_memory_fake()
-                union_fs = fslib.stacking.UnionFS()
-                union_fs.add_branch(mem_fs, 'mem', rank=0, writable=True)
-                union_fs.add_branch(ro_fs, 'os_ro', rank=1, writable=False)
-                subfs = union_fs
-                sub_filesystems[path] = mem_fs
-            base_fs.mount_fs(subfs, path)
-
-        return fslib.FileSystem(base_fs), sub_filesystems
+        if self.dry_run:
+            self.fs = DryRunFileSystem(
+                write_paths,
+                files_encoding=self.default_encoding,
+                hash_algorithm=kwargs.pop('hash_algorithm', 'md5'),
+                spill=kwargs.pop('spill', False),
+            )
+        else:
+            self.fs = OSFileSystem(write_paths, files_encoding=self.default_encoding)
+        # Maps (path, encoding) to ((inode, mtime_ns, size), line)
+        self._line_cache = {}
 
-    def get_changes(self):
+    def read_one_line(self, path, encoding=None):
+        """Read one (stripped) line from a file.
+
+        Lines are cached until the file's inode, mtime or size change, since
+        the same snippets are typically read by many source files.
+        """
         if self.dry_run:
-            for path, fs in self.subfs.items():
-                for subpath in fs.walkfiles():
-                    length = len(fs.getcontents(subpath))
-                    yield '%s%s' % (path, subpath), length
+            return self.fs.read_one_line(path, encoding=encoding)
 
-    def __del__(self):
-        try:
-            if self.dry_run:
-                for path, lenth in self.get_changes():
-                    logger.info("[Dry-run] Updated path %s (%d bytes)", path, lenth)
-        except Exception as e:
-            # Something went wrong while deleting ourselves.
-            logger.exception("Failure while deleting %r: %r", self, e)
+        stats = self.fs.stat(path)
+        signature = (stats.st_ino, stats.st_mtime_ns, stats.st_size)
+        key = (path, encoding)
+        cached = self._line_cache.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        line = self.fs.read_one_line(path, encoding=encoding)
+        self._line_cache[key] = (signature, line)
+        return line
+
+    def get_changes(self):
+        """Retrieve the changes recorded in dry-run mode.
+
+        Returns:
+            DryRunChange list: sorted by path; empty outside of dry-runs
+        """
+        if self.dry_run:
+            return self.fs.get_changes()
+        return []
 
     def __getattr__(self, name):
         return getattr(self.fs, name)
@@ -2,8 +2,33 @@
 # Copyright (c) 2010-2013 Raphaël Barrois
 # This software is distributed under the two-clause BSD license.
 
+import collections
+import importlib.util
 import os
 import socket
+import sys
+
+
+def lazy_import(name, package=None):
+    """Import a module, deferring its execution until an attribute is accessed.
+
+    Used for modules which only some commands need, to keep startup fast.
+
+    Args:
+        name (str): the module name, possibly relative to 'package'
+    """
+    absolute_name = importlib.util.resolve_name(name, package)
+    module = sys.modules.get(absolute_name)
+    if module is not None:
+        return module
+
+    spec = importlib.util.find_spec(absolute_name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[absolute_name] = module
+    loader.exec_module(module)
+    return module
 
 
 def filter_iter(iterator, items, key=lambda o: o, empty_is_all=False):
@@ -28,6 +53,13 @@ def flatten(fields, separator=None):
     return flattened
 
 
+def parse_bool(value):
+    """Convert a configuration value (e.g 'yes', 'off') to a boolean."""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'yes', 'true', 'on')
+    return bool(value)
+
+
 def get_absolute_path(path, base=''):
     path = os.path.join(base, os.path.expanduser(path))
     return os.path.abspath(path)
@@ -42,3 +74,36 @@ def get_hostnames(name=''):
     """Return the list of hostnames for a name (defaults to local host)."""
     fqdn = socket.getfqdn(name)
     return fqdn, fqdn.split('.')[0]
+
+
+class LRUCache:
+    """A dict-like cache, holding at most 'maxsize' entries.
+
+    The least recently used entries are evicted first.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        try:
+            self.entries.move_to_end(key)
+        except KeyError:
+            return default
+        return self.entries[key]
+
+    def __setitem__(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2013 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+"""A minimal binding to Linux' inotify, through ctypes."""
+
+import collections
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+
+
+# From sys/inotify.h
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_CLOEXEC = 0o2000000
+
+# Events meaning that the content of a file inside a watched folder may have changed
+CONTENT_EVENTS = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE | IN_ATTRIB
+
+# struct inotify_event, without its trailing name
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+Event = collections.namedtuple('Event', ('path', 'mask'))
+
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        _libc.inotify_init1.argtypes = [ctypes.c_int]
+        _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        _libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return _libc
+
+
+def _check(result, path=None):
+    if result < 0:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code), path)
+    return result
+
+
+class Inotify:
+    """Watches folders for changes.
+
+    Attributes:
+        fd (int): the inotify file descriptor
+        watches (int => str dict): watched folders, by watch descriptor
+    """
+
+    def __init__(self):
+        self.libc = _get_libc()
+        self.fd = _check(self.libc.inotify_init1(IN_CLOEXEC))
+        self.watches = {}
+
+    def __repr__(self):
+        return '<Inotify: %d folders>' % len(self.watches)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self.watches.clear()
+
+    def add_watch(self, path, mask=CONTENT_EVENTS):
+        """Watch a folder; watching it again replaces its mask."""
+        wd = _check(self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask | IN_ONLYDIR), path)
+        self.watches[wd] = path
+        return wd
+
+    def remove_watch(self, path):
+        for wd, watched in list(self.watches.items()):
+            if watched == path:
+                del self.watches[wd]
+                _check(self.libc.inotify_rm_watch(self.fd, wd), path)
+
+    def read_events(self, timeout=None):
+        """Wait for events.
+
+        Args:
+            timeout (float): how long to wait, in seconds; None to wait forever
+
+        Returns:
+            Event list: empty if the timeout expired. The path of an event on
+                the watched folder itself is the folder; an IN_Q_OVERFLOW event
+                has an empty path.
+        """
+        ready, _w, _x = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_IGNORED:
+                # The folder was removed, or its watch was.
+                folder = self.watches.pop(wd, None)
+                if folder is not None:
+                    events.append(Event(folder, mask))
+                continue
+
+            folder = self.watches.get(wd)
+            if mask & IN_Q_OVERFLOW:
+                events.append(Event('', mask))
+            elif folder is not None:
+                events.append(Event(os.path.join(folder, name) if name else folder, mask))
+        return events
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2010-2013 Raphaël Barrois
+# This software is distributed under the two-clause BSD license.
+
+"""Track the inputs and outputs of built files."""
+
+import hashlib
+import os
+import time
+
+
+# Files modified this recently could still change within the same
+# timestamp; their stat signature can't be trusted.
+RACY_DELAY_NS = 2 * 10 ** 9
+
+
+def get_signature(fs, path):
+    """Retrieve cheap metadata identifying the content of a file.
+
+    Returns:
+        (inode, size, mtime_ns) tuple, or None if the file doesn't exist.
+    """
+    if not fs.file_exists(path):
+        return None
+    stats = fs.stat(path)
+    return (stats.st_ino, stats.st_size, stats.st_mtime_ns)
+
+
+class Fingerprint:
+    """The recorded state of a file.
+
+    Attributes:
+        signature (tuple): the stat signature of the file, see get_signature()
+        digest (str): the hash of the file's content
+        racy (bool): whether the file was modified too recently, when
+            fingerprinted, for its signature to be trusted
+    """
+
+    # Entries recorded before racy signatures were tracked
+    racy = False
+
+    def __init__(self, signature, digest, racy=False):
+        self.signature = signature
+        self.digest = digest
+        self.racy = racy
+
+    def __repr__(self):
+        return 'Fingerprint(%r, %r)' % (self.signature, self.digest)
+
+    @classmethod
+    def is_racy(cls, signature):
+        return time.time_ns() - signature[2] < RACY_DELAY_NS
+
+    @classmethod
+    def from_file(cls, fs, path, method=hashlib.md5):
+        """Fingerprint a file; call it *before* reading the file's content."""
+        signature = get_signature(fs, path)
+        if signature is None:
+            return None
+        return cls(signature, fs.get_hash(path, method=method).hexdigest(), racy=cls.is_racy(signature))
+
+    def matches(self, fs, path, method=hashlib.md5):
+        """Whether a file still has the recorded content.
+
+        The content is only hashed if its stat signature has changed, or
+        couldn't be trusted when recorded.
+        """
+        signature = get_signature(fs, path)
+        if signature is None:
+            return False
+        if signature == self.signature and not self.racy:
+            return True
+        if fs.get_hash(path, method=method).hexdigest() != self.digest:
+            return False
+        # Same content, but different metadata (e.g. touched), or an older change
+        self.signature = signature
+        self.racy = self.is_racy(signature)
+        return True
+
+
+class Dependencies:
+    """Paths of other files read while building a destination.
+
+    Each file is fingerprinted when first added, i.e. before it is read:
+    a change made while building is then seen on the next build.
+
+    Attributes:
+        fs (FileSystem): the filesystem holding files; None to skip fingerprints
+        method (callable): the hashlib digest used for fingerprints
+        fingerprints (str => Fingerprint dict): fingerprints, by path
+    """
+
+    def __init__(self, fs=None, method=hashlib.md5):
+        self.fs = fs
+        self.method = method
+        self.paths = set()
+        self.fingerprints = {}
+
+    def __repr__(self):
+        return '<Dependencies: %r>' % sorted(self.paths)
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, path):
+        return path in self.paths
+
+    def add(self, path):
+        if path not in self.paths and self.fs is not None:
+            self.fingerprints[path] = Fingerprint.from_file(self.fs, path, method=self.method)
+        self.paths.add(path)
+
+    def update(self, paths):
+        for path in paths:
+            self.add(path)
+
+
+class BuildEntry:
+    """The state of a destination when it was last built.
+
+    Attributes:
+        params (tuple): action name, options and active categories
+        source (Fingerprint): the state of the source file
+        dependencies (str => Fingerprint dict): the state of other files read
+        destination (Fingerprint): the state of the written file
+    """
+
+    def __init__(self, params, source, dependencies, destination):
+        self.params = params
+        self.source = source
+        self.dependencies = dependencies
+        self.destination = destination
+
+    def __repr__(self):
+        return '<BuildEntry: %r>' % (self.params,)
+
+
+class BuildState:
+    """Records how files were built, to skip rebuilding them when unchanged.
+
+    Attributes:
+        store (cache.DiskCache): holds one BuildEntry per destination
+        algorithm (str): the name of the hashlib digest used for fingerprints
+        max_entries (int): the number of destinations to keep in the store
+    """
+
+    def __init__(self, store, algorithm='md5', max_entries=100000):
+        self.store = store
+        self.algorithm = algorithm
+        self.method = getattr(hashlib, algorithm)
+        self.max_entries = max_entries
+        self._evicted = False
+
+    def __repr__(self):
+        return '<BuildState: %s in %r>' % (self.algorithm, self.store)
+
+    @property
+    def read_only(self):
+        """Whether new records would be discarded, e.g. during a dry-run."""
+        return self.store.read_only
+
+    @classmethod
+    def get_params(cls, action, options, categories):
+        return (action, tuple(sorted(options.items())), tuple(sorted(categories)))
+
+    def _get_key(self, destination):
+        key = '%s:%s' % (self.algorithm, destination)
+        return hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def get_drift(self, fs, source, destination, params):
+        """Check which sides of a destination changed since it was built.
+
+        Files are only hashed if their stat signature has changed.
+
+        Returns:
+            (bool, bool): whether the inputs (params, source or dependencies)
+                and the destination changed; None if it was never built.
+        """
+        key = self._get_key(destination)
+        entry = self.store.get(key)
+        if entry is None:
+            return None
+        self.store.touch(key)
+
+        inputs = [(source, entry.source)]
+        inputs.extend(entry.dependencies.items())
+        fingerprints = inputs + [(destination, entry.destination)]
+        signatures = [(fp.signature, fp.racy) for _path, fp in fingerprints]
+
+        inputs_changed = entry.params != params or not all(
+            fp.matches(fs, path, method=self.method) for path, fp in inputs)
+        destination_changed = not entry.destination.matches(fs, destination, method=self.method)
+
+        if signatures != [(fp.signature, fp.racy) for _path, fp in fingerprints]:
+            # Store refreshed signatures, to avoid hashing again next time.
+            self.store.set(key, entry)
+        return inputs_changed, destination_changed
+
+    def is_fresh(self, fs, source, destination, params):
+        """Whether a destination is up to date.
+
+        That is:
+        - it was built with the same params;
+        - its source and dependencies have not changed;
+        - it wasn't modified since.
+        """
+        return self.get_drift(fs, source, destination, params) == (False, False)
+
+    def get_dependencies(self, destination):
+        """Retrieve the other files read when a destination was last built."""
+        entry = self.store.get(self._get_key(destination))
+        if entry is None:
+            return []
+        return list(entry.dependencies)
+
+    def record(self, fs, source, destination, params, dependencies=(), fingerprints=None):
+        """Record the state of a newly built destination.
+
+        Args:
+            fingerprints (str => Fingerprint dict): the source and dependencies,
+                as fingerprinted before they were read; others are
+                fingerprinted now
+        """
+        fingerprints = fingerprints or {}
+
+        def get_fingerprint(path):
+            if path in fingerprints:
+                return fingerprints[path]
+            return Fingerprint.from_file(fs, path, method=self.method)
+
+        source_fp = get_fingerprint(source)
+        destination_fp = Fingerprint.from_file(fs, destination, method=self.method)
+        if source_fp is None or destination_fp is None:
+            return
+
+        dependency_fps = {}
+        for path in dependencies:
+            dependency_fp = get_fingerprint(path)
+            if dependency_fp is None:
+                return
+            dependency_fps[path] = dependency_fp
+
+        entry = BuildEntry(
+            params=params,
+            source=source_fp,
+            dependencies=dependency_fps,
+            destination=destination_fp,
+        )
+        if not self._evicted:
+            # Only look for stale entries in runs which add new ones.
+            self.store.evict(max(0, self.max_entries - 1))
+            self._evicted = True
+        self.store.set(self._get_key(destination), entry)
+
+
+class HashCache:
+    """Remembers the digest of files, until their stat signature changes.
+
+    Attributes:
+        store (cache.DiskCache): holds one (path, signature, digest) entry per
+            file; None to disable caching
+        algorithm (str): the name of the hashlib digest to use
+        max_entries (int): the number of entries to keep in the store
+    """
+
+    ALGORITHMS = ('md5', 'sha1', 'sha256', 'sha512', 'blake2b', 'blake2s')
+    DEFAULT_ALGORITHM = 'md5'
+
+    RACY_DELAY_NS = RACY_DELAY_NS
+
+    def __init__(self, store=None, algorithm=DEFAULT_ALGORITHM, max_entries=100000):
+        if algorithm not in self.ALGORITHMS:
+            raise ValueError("Invalid hash algorithm %s, choose one of %s" % (
+                algorithm, ', '.join(self.ALGORITHMS)))
+        self.store = store
+        self.algorithm = algorithm
+        self.method = getattr(hashlib, algorithm)
+        self.max_entries = max_entries
+        self._evicted = False
+
+    def __repr__(self):
+        return '<HashCache: %s in %r>' % (self.algorithm, self.store)
+
+    @classmethod
+    def get_signature(cls, stats):
+        return (stats.st_dev, stats.st_ino, stats.st_size, stats.st_mtime_ns, stats.st_ctime_ns)
+
+    def _get_key(self, path):
+        key = '%s:%s' % (self.algorithm, os.path.abspath(path))
+        return hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def get_hexdigest(self, fs, path):
+        """Retrieve the hex digest of a file, hashing it only if it changed."""
+        if self.store is None:
+            return fs.get_hash(path, method=self.method).hexdigest()
+
+        signature = self.get_signature(fs.stat(path))
+        key = self._get_key(path)
+        entry = self.store.get(key)
+        if entry is not None and entry[:2] == (path, signature):
+            self.store.touch(key)
+            return entry[2]
+
+        digest = fs.get_hash(path, method=self.method).hexdigest()
+        if time.time_ns() - signature[3] > self.RACY_DELAY_NS:
+            if not self._evicted:
+                # Only look for stale entries in runs which add new ones.
+                self.store.evict(max(0, self.max_entries - 1))
+                self._evicted = True
+            self.store.set(key, (path, signature, digest))
+        return digest
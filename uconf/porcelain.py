@@ -6,12 +6,18 @@
 """Low level actions for uconf."""
 
 
-import difflib
 import logging
 import os.path
 
 from . import helpers
 
+# Only needed by some commands
+concurrent_futures = helpers.lazy_import('concurrent.futures')
+difflib = helpers.lazy_import('difflib')
+inotify = helpers.lazy_import('.inotify', __package__)
+multiprocessing = helpers.lazy_import('multiprocessing')
+traceback = helpers.lazy_import('traceback')
+
 
 class PorcelainError(Exception):
     def __init__(self, user_message):
@@ -19,6 +25,20 @@ class PorcelainError(Exception):
         super().__init__()
 
 
+class WorkerError(Exception):
+    """An unexpected error, raised while handling a file in a worker process.
+
+    Attributes:
+        filename (str): the file being handled
+        formatted (str): the traceback of the original error
+    """
+
+    def __init__(self, filename, formatted):
+        self.filename = filename
+        self.formatted = formatted
+        super().__init__("Error while handling %s in a worker process:\n%s" % (filename, formatted))
+
+
 class Porcelain:
     def __init__(self, env, active_repo=None):
         self.env = env
@@ -156,7 +176,7 @@ class FilePorcelain(Porcelain):
         except KeyError:
             raise PorcelainError("File %s not in repository." % filename)
 
-        self.handle_file(filename, file_config, *args, **kwargs)
+        return self.handle_file(filename, file_config, *args, **kwargs)
 
 
 class MakeFile(FilePorcelain):
@@ -164,6 +184,37 @@ class MakeFile(FilePorcelain):
         action = file_config.get_action(filename, self.env)
         self.logger.info("Building file %s (%s)", filename, action.__class__.__name__)
         action.forward(self.active_repo.categories)
+        return action
+
+
+class FleetMakeFile(Porcelain):
+    """Build files for many hosts, each through its own MakeFile porcelain.
+
+    Files are named '<host>/<filename>', so that a single FileRunner (and
+    pool of workers) handles all hosts.
+
+    Attributes:
+        porcelains (str => MakeFile dict): porcelains, by host
+        files (str => str list dict): files to build, by host
+        first_files (str => str dict): the first file of each host
+    """
+
+    def __init__(self, env, porcelains, files):
+        super().__init__(env)
+        self.porcelains = porcelains
+        self.files = files
+        self.first_files = {host: filenames[0] for host, filenames in files.items() if filenames}
+
+    def iter_files(self):
+        for host, filenames in self.files.items():
+            for filename in filenames:
+                yield os.path.join(host, filename)
+
+    def handle(self, host_filename):
+        host, filename = host_filename.split(os.sep, 1)
+        if self.first_files.get(host) == filename:
+            self.logger.info("Building files for host %s", host)
+        return self.porcelains[host].handle(filename)
 
 
 class BackFile(FilePorcelain):
@@ -199,3 +250,234 @@ class BackDiffFile(FilePorcelain):
             diff = ('',) + tuple(diff)
             diff = '\n'.join(diff)
             self.logger.info("File %s has changed: %s", filename, diff)
+
+
+class StatusFile(FilePorcelain):
+    def handle_file(self, filename, file_config):
+        action = file_config.get_action(filename, self.env)
+        return action.status(self.active_repo.categories)
+
+
+class _RecordCollector(logging.Handler):
+    """Collect log records, in a form suitable for sending to another process."""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        self.records.append(record)
+
+    def flush_records(self):
+        records, self.records = self.records, []
+        return records
+
+
+# State of worker processes; inherited through fork().
+_worker_state = {}
+
+
+def _init_worker():
+    """Route all log records of a worker process to a collector.
+
+    The parent process replays them through its own logging configuration.
+    """
+    collector = _RecordCollector()
+    loggers = [logging.getLogger()] + [
+        logger for logger in logging.Logger.manager.loggerDict.values()
+        if isinstance(logger, logging.Logger)
+    ]
+    for logger in loggers:
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.propagate = True
+    logging.getLogger().addHandler(collector)
+    _worker_state['collector'] = collector
+
+
+def _handle_in_worker(filename):
+    """Handle a file in a worker process.
+
+    Returns:
+        (LogRecord list, str): the log records of the file, and the
+            formatted traceback of an unexpected error, if any
+    """
+    runner = _worker_state['runner']
+    error = None
+    try:
+        runner.handle_one(filename)
+    except Exception:
+        # Exceptions may not be picklable; the parent re-raises it as a WorkerError.
+        error = traceback.format_exc()
+    return _worker_state['collector'].flush_records(), error
+
+
+class FileRunner:
+    """Run a file porcelain command over a set of files.
+
+    With more than one job, files are spread across a pool of forked worker
+    processes; their log records are replayed in the order of the files,
+    so the output does not depend on scheduling. Unexpected errors in a
+    worker are raised as WorkerError, after the records of their file.
+
+    Attributes:
+        porcelain (FilePorcelain): the command to run for each file
+        jobs (int): the number of parallel jobs; 0 for one per CPU
+        logger (logging.Logger): where to report per-file errors
+    """
+
+    def __init__(self, porcelain, jobs=1, logger=None):
+        self.porcelain = porcelain
+        self.jobs = jobs or os.cpu_count() or 1
+        self.logger = logger or logging.getLogger(__name__)
+
+    def handle_one(self, filename):
+        try:
+            self.porcelain.handle(filename)
+        except PorcelainError as e:
+            self.logger.exception("Error while handling %s: %r", filename, e)
+
+    def _can_fork(self):
+        if self.porcelain.env.get('dry_run', False):
+            # Dry-run changes are recorded in memory, and would be lost in workers.
+            return False
+        return 'fork' in multiprocessing.get_all_start_methods()
+
+    def run(self, filenames):
+        filenames = list(filenames)
+        if self.jobs <= 1 or len(filenames) <= 1 or not self._can_fork():
+            for filename in filenames:
+                self.handle_one(filename)
+            return
+
+        _worker_state['runner'] = self
+        try:
+            with concurrent_futures.ProcessPoolExecutor(
+                    max_workers=min(self.jobs, len(filenames)),
+                    mp_context=multiprocessing.get_context('fork'),
+                    initializer=_init_worker,
+            ) as executor:
+                for filename, (records, error) in zip(filenames, executor.map(_handle_in_worker, filenames)):
+                    for record in records:
+                        logging.getLogger(record.name).handle(record)
+                    if error is not None:
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        raise WorkerError(filename, error)
+        finally:
+            _worker_state.pop('runner', None)
+
+
+class Watcher:
+    """Rebuild files whenever their inputs change.
+
+    Inputs are the source of a file, the files it read through #@withfile,
+    and the repository configuration; their folders are watched with inotify.
+    Changes are grouped until none happened for 'delay' seconds.
+
+    Attributes:
+        env (config.Env): the environment, kept warm across rebuilds
+        initial_cats (str list): initial categories of the active repository
+        files (str list): files to build; all active files if empty
+        delay (float): seconds without changes to wait for before rebuilding
+        active_repo (config.RepositoryView): the current active repository
+        inputs (str => str set dict): absolute paths of inputs, by file name
+        notifier (inotify.Inotify): watches folders of inputs
+    """
+
+    def __init__(self, env, initial_cats, files=(), delay=0.2, logger=None):
+        self.env = env
+        self.initial_cats = initial_cats
+        self.files = files
+        self.delay = delay
+        self.logger = logger or logging.getLogger(__name__)
+        self.active_repo = None
+        self.inputs = {}
+        self.notifier = inotify.Inotify()
+
+    def close(self):
+        self.notifier.close()
+
+    def load(self):
+        """Compute the active repository, and build all its files."""
+        self.active_repo = self.env.get_active_repository(self.initial_cats)
+        filenames = list(helpers.filter_iter(self.active_repo.iter_files(), self.files, empty_is_all=True))
+        self.inputs = {}
+        self.make(filenames)
+
+    def make(self, filenames):
+        """Build some files, and watch their inputs."""
+        p = MakeFile(self.env, self.active_repo)
+        for filename in sorted(filenames):
+            inputs = {helpers.get_absolute_path(filename, base=self.env.root)}
+            try:
+                action = p.handle(filename)
+            except Exception as e:
+                # Keep watching: the next change may fix the error.
+                self.logger.exception("Error while building %s: %r", filename, e)
+            else:
+                inputs.update(os.path.abspath(path) for path in getattr(action, 'dependencies', ()))
+            self.inputs[filename] = inputs
+        self._update_watches()
+
+    def _update_watches(self):
+        folders = {os.path.dirname(self.env.repository.config_path)}
+        for inputs in self.inputs.values():
+            folders.update(os.path.dirname(path) for path in inputs)
+
+        for folder in set(self.notifier.watches.values()) - folders:
+            self.notifier.remove_watch(folder)
+        for folder in folders:
+            try:
+                self.notifier.add_watch(folder)
+            except OSError as e:
+                # Missing folders are watched again after the next change.
+                self.logger.debug("Unable to watch %s: %s", folder, e)
+
+    def get_affected(self, paths):
+        """Retrieve files having one of the given paths, or a file within them, as input."""
+        folders = tuple(path + os.sep for path in paths)
+        return [
+            filename for filename, inputs in self.inputs.items()
+            if not inputs.isdisjoint(paths) or any(path.startswith(folders) for path in inputs)
+        ]
+
+    def poll(self, timeout=None):
+        """Wait for changes, and rebuild affected files.
+
+        Args:
+            timeout (float): how long to wait for a first change, in seconds;
+                None to wait forever
+
+        Returns:
+            bool: whether any change was seen
+        """
+        events = self.notifier.read_events(timeout)
+        if not events:
+            return False
+        while True:
+            more = self.notifier.read_events(self.delay)
+            if not more:
+                break
+            events.extend(more)
+
+        paths = {event.path for event in events}
+        if self.env.repository.config_path in paths:
+            self.logger.info("Configuration changed, rebuilding all files")
+            try:
+                self.env.reload_repository()
+            except Exception as e:
+                self.logger.exception("Error while reading the configuration: %r", e)
+                return True
+            self.load()
+        elif '' in paths:
+            self.logger.warning("Too many changes, rebuilding all files")
+            self.load()
+        else:
+            self.make(self.get_affected(paths))
+        return True
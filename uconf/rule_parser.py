@@ -4,7 +4,7 @@
 
 """Handles parsing of rules."""
 
-import tdparser
+from . import helpers
 
 
 # {{{ Nodes
@@ -12,13 +12,31 @@ import tdparser
 class _ConditionNode:
     """Base class for a node."""
 
-    def eval(self, atoms):
+    def eval(self, atoms, universe=None):
         """Evaluate this node with a given set of atoms.
 
+        Args:
+            atoms (str set): the atoms to test
+            universe (CategoryUniverse): if set, atoms are a bit mask from
+                this universe instead of a set of names
+
         Returns a boolean.
         """
         raise NotImplementedError()
 
+    def compile(self, atoms='atoms', universe=None):
+        """Convert this node to an equivalent Python expression.
+
+        Args:
+            atoms (str): the name of the variable holding the set of atoms
+            universe (CategoryUniverse): if set, atoms are a bit mask from
+                this universe instead of a set of names
+
+        Returns:
+            str
+        """
+        raise NotImplementedError()
+
     def simplify(self):
         """Simplify the current node (for easier representation).
 
@@ -35,9 +53,12 @@ class _ConditionNode:
 
 class _FalseNode(_ConditionNode):
     """A 'false' node."""
-    def eval(self, atoms):
+    def eval(self, atoms, universe=None):
         return False
 
+    def compile(self, atoms='atoms', universe=None):
+        return 'False'
+
     def __repr__(self):
         return '<False>'
 
@@ -47,9 +68,12 @@ class _FalseNode(_ConditionNode):
 
 class _TrueNode(_ConditionNode):
     """A 'true' node."""
-    def eval(self, atoms):
+    def eval(self, atoms, universe=None):
         return True
 
+    def compile(self, atoms='atoms', universe=None):
+        return 'True'
+
     def __repr__(self):
         return '<True>'
 
@@ -67,9 +91,17 @@ class _TextNode(_ConditionNode):
     def __init__(self, text):
         self.text = text
 
-    def eval(self, atoms):
+    def eval(self, atoms, universe=None):
+        if universe is not None:
+            # Categories without a bit can't be in the mask.
+            return bool(atoms & universe.bits.get(self.text, 0))
         return self.text in atoms
 
+    def compile(self, atoms='atoms', universe=None):
+        if universe is not None:
+            return '(%s & %d)' % (atoms, universe.intern(self.text))
+        return '(%r in %s)' % (self.text, atoms)
+
     def __repr__(self):
         return '<%s>' % self.text
 
@@ -89,8 +121,11 @@ class _NegateNode(_ConditionNode):
     def __init__(self, son):
         self.son = son
 
-    def eval(self, atoms):
-        return not self.son.eval(atoms)
+    def eval(self, atoms, universe=None):
+        return not self.son.eval(atoms, universe)
+
+    def compile(self, atoms='atoms', universe=None):
+        return '(not %s)' % self.son.compile(atoms, universe)
 
     def simplify(self):
         self.son = self.son.simplify()
@@ -132,13 +167,26 @@ class _MultiNode(_ConditionNode):
         self.sons = new_sons
         return self
 
+    def _atoms_mask(self, universe):
+        """Retrieve the mask of all sons, if they are all text nodes."""
+        if universe is None or not all(isinstance(son, _TextNode) for son in self.sons):
+            return None
+        return universe.mask(son.text for son in self.sons)
+
 
 class _AndNode(_MultiNode):
     """A 'and' node."""
     precedence = 20
 
-    def eval(self, atoms):
-        return all(son.eval(atoms) for son in self.sons)
+    def eval(self, atoms, universe=None):
+        return all(son.eval(atoms, universe) for son in self.sons)
+
+    def compile(self, atoms='atoms', universe=None):
+        mask = self._atoms_mask(universe)
+        if mask is not None:
+            # All of the bits must be set.
+            return '((%s & %d) == %d)' % (atoms, mask, mask)
+        return '(%s)' % ' and '.join(son.compile(atoms, universe) for son in self.sons)
 
     def __repr__(self):
         return '<And%r>' % (tuple(self.sons),)
@@ -153,8 +201,15 @@ class _OrNode(_MultiNode):
     """A 'or' node."""
     precedence = 10
 
-    def eval(self, atoms):
-        return any(son.eval(atoms) for son in self.sons)
+    def eval(self, atoms, universe=None):
+        return any(son.eval(atoms, universe) for son in self.sons)
+
+    def compile(self, atoms='atoms', universe=None):
+        mask = self._atoms_mask(universe)
+        if mask is not None:
+            # Any of the bits must be set.
+            return '(%s & %d)' % (atoms, mask)
+        return '(%s)' % ' or '.join(son.compile(atoms, universe) for son in self.sons)
 
     def __repr__(self):
         return '<Or%r>' % (tuple(self.sons),)
@@ -169,100 +224,320 @@ class _OrNode(_MultiNode):
 # {{{ Tokens
 
 
-class _TextToken(tdparser.Token):
-    lbp = 25
-    regexp = r'[a-zA-Z0-9._-]+'
+class RuleSyntaxError(ValueError):
+    """Raised when a rule can't be parsed.
 
-    def __init__(self, text):
-        self.text = text
+    Attributes:
+        text (str): the text of the rule
+        position (int): the position of the error in the text
+    """
 
-    def nud(self, context):
-        return _TextNode(self.text)
+    def __init__(self, message, text, position):
+        self.text = text
+        self.position = position
+        super().__init__("%s at position %d in %r" % (message, position, text))
+
+
+# Token kinds
+_TEXT = 'text'
+_OR = '||'
+_AND = '&&'
+_NOT = '!'
+_LPAREN = '('
+_RPAREN = ')'
+_END = 'end of rule'
+
+# Left binding power of each kind of token.
+# Text binds tighter than '&&': whitespace-separated atoms form an implicit 'or'.
+_LBP = {
+    _TEXT: 25,
+    _AND: 15,
+    _OR: 10,
+    _NOT: 10,
+    _LPAREN: 0,
+    _RPAREN: 0,
+    _END: 0,
+}
+
+_TEXT_CHARS = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789._-')
+_BLANK_CHARS = frozenset(' \t')
+_OPERATORS = {'||': _OR, '&&': _AND}
+_PUNCTUATION = {'!': _NOT, '(': _LPAREN, ')': _RPAREN}
+
+
+def _tokenize(text):
+    """Split a rule into tokens, in a single pass.
+
+    Returns:
+        (kind, text, position) list, ending with an _END token
+    """
+    tokens = []
+    position = 0
+    length = len(text)
+    while position < length:
+        char = text[position]
+        if char in _TEXT_CHARS:
+            end = position + 1
+            while end < length and text[end] in _TEXT_CHARS:
+                end += 1
+            tokens.append((_TEXT, text[position:end], position))
+            position = end
+        elif char in _BLANK_CHARS:
+            position += 1
+        elif char in _PUNCTUATION:
+            tokens.append((_PUNCTUATION[char], char, position))
+            position += 1
+        elif text[position:position + 2] in _OPERATORS:
+            tokens.append((_OPERATORS[text[position:position + 2]], text[position:position + 2], position))
+            position += 2
+        else:
+            raise RuleSyntaxError("Invalid character %r" % char, text, position)
+    tokens.append((_END, '', length))
+    return tokens
+
+
+class _RuleParser:
+    """A top-down operator precedence parser for rules.
 
-    def led(self, left, context):
-        return _OrNode([left, _TextNode(self.text)])
+    Attributes:
+        text (str): the rule being parsed
+        tokens ((kind, text, position) list): the tokens of the rule
+        index (int): the position of the next token in the list
+    """
 
-    def __repr__(self):
-        return '<Text: %r>' % self.text
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.index = 0
+
+    def error(self, message, token):
+        return RuleSyntaxError(message, self.text, token[2])
+
+    def consume(self):
+        token = self.tokens[self.index]
+        if token[0] == _END:
+            raise self.error("Unexpected end of rule", token)
+        self.index += 1
+        return token
+
+    def parse(self):
+        node = self.expression()
+        token = self.tokens[self.index]
+        if token[0] != _END:
+            raise self.error("Unexpected %r" % token[1], token)
+        return node
+
+    def expression(self, rbp=0):
+        left = self.nud(self.consume())
+        while rbp < _LBP[self.tokens[self.index][0]]:
+            left = self.led(self.consume(), left)
+        return left
+
+    def nud(self, token):
+        """Handle a token at the beginning of an expression."""
+        kind = token[0]
+        if kind == _TEXT:
+            return _TextNode(token[1])
+        elif kind == _NOT:
+            return _NegateNode(self.expression(100))
+        elif kind == _LPAREN:
+            node = self.expression()
+            closing = self.tokens[self.index]
+            if closing[0] != _RPAREN:
+                raise self.error("Expected ')', got %r" % (closing[1] or closing[0]), closing)
+            self.index += 1
+            return node
+        raise self.error("Unexpected %r at the start of an expression" % token[1], token)
+
+    def led(self, token, left):
+        """Handle a token following an expression."""
+        kind = token[0]
+        if kind == _TEXT:
+            return _OrNode([left, _TextNode(token[1])])
+        elif kind == _AND:
+            return _AndNode([left, self.expression(_LBP[_AND])])
+        elif kind == _OR:
+            return _OrNode([left, self.expression(_LBP[_OR])])
+        raise self.error("Unexpected %r in the middle of an expression" % token[1], token)
 
 
-class _OrToken(tdparser.Token):
-    lbp = 10
-    regexp = r'\|\|'
+# }}}
+# {{{ Lexer
 
-    def led(self, left, context):
-        right = context.expression(self.lbp)
-        return _OrNode([left, right])
 
-    def __repr__(self):
-        return '<Or>'
+class RuleLexer:
+    """Build a rule lexer
 
+    Some possible patterns:
+    a b c => Matches if any of a, b, c
+    a || b || c
+    a || (b && !c) => Matches if a or (b and not c)
 
-class _AndToken(tdparser.Token):
-    lbp = 15
-    regexp = r'&&'
+    Parsed rules are interned: the same text always yields the same Rule,
+    across all lexers.
+    """
 
-    def led(self, left, context):
-        right = context.expression(self.lbp)
-        return _AndNode([left, right])
+    # Rules, by text; shared by all lexers
+    _rules = helpers.LRUCache(4096)
 
-    def __repr__(self):
-        return '<And>'
+    @classmethod
+    def clear_cache(cls):
+        cls._rules.clear()
 
+    def parse(self, text):
+        """Parse a rule into its simplified tree of nodes."""
+        return _RuleParser(text).parse().simplify()
 
-class _NotToken(tdparser.Token):
-    lbp = 10
-    regexp = r'!'
+    def get_rule(self, text):
+        rule = self._rules.get(text)
+        if rule is None:
+            rule = self._rules[text] = Rule(text, self.parse(text))
+        return rule
 
-    def nud(self, context):
-        return _NegateNode(context.expression(100))
+# }}}
+# {{{ Categories
 
-    def __repr__(self):
-        return '<Not>'
 
+class CategoryUniverse:
+    """Maps category names to bit positions.
 
-# }}}
-# {{{ Lexer
+    Sets of categories can then be handled as integer masks, where testing
+    a rule only takes a few bitwise operations.
 
+    Attributes:
+        bits (str => int dict): maps a category name to its bit
+        names (str list): category names, by bit position
+    """
 
-class RuleLexer:
-    """Build a rule lexer
+    def __init__(self, names=()):
+        self.bits = {}
+        self.names = []
+        for name in names:
+            self.intern(name)
 
-    Some possible patterns:
-    a b c => Matches if any of a, b, c
-    a || b || c
-    a || (b && !c) => Matches if a or (b and not c)
-    """
-    def __init__(self):
-        self.lexer = self._build_lexer()
+    def __len__(self):
+        return len(self.names)
 
-    @classmethod
-    def _build_lexer(cls):
-        lexer = tdparser.Lexer(with_parens=True)
-        lexer.register_tokens(_TextToken, _OrToken, _AndToken, _NotToken)
-        return lexer
+    def __repr__(self):
+        return '<CategoryUniverse: %d categories>' % len(self.names)
+
+    def intern(self, name):
+        """Retrieve the bit for a category, allocating it if needed."""
+        bit = self.bits.get(name)
+        if bit is None:
+            bit = self.bits[name] = 1 << len(self.names)
+            self.names.append(name)
+        return bit
+
+    def mask(self, names):
+        """Convert a set of category names into a mask."""
+        mask = 0
+        for name in names:
+            mask |= self.intern(name)
+        return mask
+
+    def unmask(self, mask):
+        """Convert a mask back into a frozenset of category names."""
+        return frozenset(
+            name for position, name in enumerate(self.names)
+            if mask >> position & 1
+        )
 
-    def get_rule(self, text):
-        return Rule(text, self.lexer.parse(text))
 
 # }}}
 # {{{ Rule
 
 
 class Rule:
+    """A parsed rule.
+
+    Rules are shared through the RuleLexer cache, and must not be modified.
+
+    Rules are evaluated by walking their tree of nodes; a rule is only
+    compiled once it has been evaluated COMPILE_THRESHOLD times, since
+    compiling costs far more than a few evaluations.
+
+    Attributes:
+        text (str): the text of the rule
+        node (_ConditionNode): the root of the parsed rule
+        _evaluations (int): the number of evaluations of the uncompiled rule
+        _test (callable): the compiled version of the rule, see compile()
+        _mask_test ((CategoryUniverse, callable)): the compiled version of
+            the rule for masks of a universe, see compile()
+    """
+
+    # Evaluations of a rule before compiling it
+    COMPILE_THRESHOLD = 32
+
     def __init__(self, text, node):
         self.text = text
         self.node = node
+        self._evaluations = 0
+        self._test = None
+        self._mask_test = None
+
+    def __getstate__(self):
+        # Compiled functions can't be pickled; rules are only compiled again
+        # once evaluated often enough in a run.
+        return {'text': self.text, 'node': self.node}
+
+    def __setstate__(self, state):
+        self.__init__(state['text'], state['node'])
+
+    def compile(self, universe=None):
+        """Compile the rule into a single function.
+
+        Args:
+            universe (CategoryUniverse): if set, the function will test
+                category masks from this universe.
+
+        Returns:
+            callable: takes a set (or mask) of categories, returns a boolean
+        """
+        if universe is None:
+            if self._test is None:
+                self._test = self._compile()
+            return self._test
+
+        if self._mask_test is None or self._mask_test[0] is not universe:
+            self._mask_test = (universe, self._compile(universe))
+        return self._mask_test[1]
+
+    def _compile(self, universe=None):
+        expression = self.node.simplify().compile('atoms', universe)
+        return eval('lambda atoms: (%s) != 0' % expression, {'__builtins__': {}})
+
+    def test_mask(self, mask, universe):
+        """Test whether a mask of categories match this rule.
+
+        Args:
+            mask (int): categories to test, as a mask from the universe
+            universe (CategoryUniverse): maps categories to bits
+
+        Returns:
+            bool
+        """
+        if self._mask_test is not None and self._mask_test[0] is universe:
+            return self._mask_test[1](mask)
+        self._evaluations += 1
+        if self._evaluations > self.COMPILE_THRESHOLD:
+            return self.compile(universe)(mask)
+        return self.node.eval(mask, universe)
 
     def test(self, categories):
         """Test whether a set of categories match this rule.
 
         Args:
-            categories (str set): categories to test
+            categories (str set): categories to test; a frozenset is fastest
 
         Returns:
             bool
         """
+        if self._test is not None:
+            return self._test(categories)
+        self._evaluations += 1
+        if self._evaluations > self.COMPILE_THRESHOLD:
+            return self.compile()(categories)
         return self.node.eval(categories)
 
     def __repr__(self):